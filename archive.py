@@ -0,0 +1,185 @@
+"""
+Архив холодных транзакций: JSONL-файлы, разбитые по месяцам (UTC):
+<archive_dir>/transactions-YYYY-MM.jsonl. Хранилище переносит сюда транзакции старше
+срока хранения и запоминает границу (watermark): все, что раньше нее, читается из архива.
+"""
+
+import json
+import os
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Optional
+
+PREFIX = 'transactions-'
+SUFFIX = '.jsonl'
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def retention_cutoffs(now_ms: int, sent_days: float, transactions_days: float) -> tuple:
+    """Границы хранения (ms): (удалять отправленные напоминания раньше, архивировать транзакции раньше); 0 — выключено."""
+    sent_before = now_ms - int(sent_days * DAY_MS) if sent_days > 0 else 0
+    archived_before = now_ms - int(transactions_days * DAY_MS) if transactions_days > 0 else 0
+    return sent_before, archived_before
+
+
+def _partition(ts_ms: int) -> str:
+    dt = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
+    return f'{dt.year:04d}-{dt.month:02d}'
+
+
+def _partition_bounds(name: str):
+    """Границы месяца раздела [start, end) в ms."""
+    year, month = map(int, name.split('-'))
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+class TransactionArchive:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, PREFIX + name + SUFFIX)
+
+    def partitions(self) -> List[str]:
+        """Имена разделов (YYYY-MM) по возрастанию."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(n[len(PREFIX):-len(SUFFIX)] for n in names if n.startswith(PREFIX) and n.endswith(SUFFIX))
+
+    def append(self, transactions: Iterable[dict]):
+        """Дописать транзакции в разделы их месяцев (с fsync до возврата)."""
+        by_partition = {}
+        for t in transactions:
+            by_partition.setdefault(_partition(t['timestamp']), []).append(t)
+        if not by_partition:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for name, items in by_partition.items():
+            with open(self._path(name), 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(t, ensure_ascii=False, separators=(',', ':')) + '\n' for t in items)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _read_partition(self, name: str, user_id: Optional[int], before_ms: int) -> List[dict]:
+        # Повторный перенос после сбоя может записать транзакцию дважды — отсеять по id
+        seen = set()
+        items = []
+        with open(self._path(name), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    t = json.loads(line)
+                except ValueError:
+                    continue
+                if (user_id is None or t['user_id'] == user_id) and t['timestamp'] < before_ms and t['id'] not in seen:
+                    seen.add(t['id'])
+                    items.append(t)
+        items.sort(key=lambda t: t['timestamp'])
+        return items
+
+    def range(self, user_id: int, start_ts_ms: int, end_ts_ms: int, before_ms: int) -> Iterator[dict]:
+        """Транзакции пользователя из архива в [start, end] и раньше before_ms, по возрастанию времени."""
+        for name in self.partitions():
+            lo, hi = _partition_bounds(name)
+            if hi <= start_ts_ms or lo > end_ts_ms or lo >= before_ms:
+                continue
+            for t in self._read_partition(name, user_id, before_ms):
+                if start_ts_ms <= t['timestamp'] <= end_ts_ms:
+                    yield t
+
+    def scan(self, before_ms: int) -> Iterator[dict]:
+        """Все архивные транзакции раньше before_ms (например, для пересчета итогов)."""
+        for name in self.partitions():
+            yield from self._read_partition(name, None, before_ms)
+
+    def stream(self, user_id: Optional[int], before_ms: int) -> Iterator[dict]:
+        """
+        Архивные транзакции (пользователя или все) раньше before_ms построчно, раздел за разделом,
+        без сортировки внутри раздела — для выгрузки; в памяти только id текущего раздела.
+        """
+        for name in self.partitions():
+            if _partition_bounds(name)[0] >= before_ms:
+                continue
+            seen = set()
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        t = json.loads(line)
+                    except ValueError:
+                        continue
+                    if (user_id is None or t['user_id'] == user_id) and t['timestamp'] < before_ms and t['id'] not in seen:
+                        seen.add(t['id'])
+                        yield t
+
+    def partition_ids(self, name: str) -> set:
+        """id транзакций раздела name (пустое множество, если раздела нет)."""
+        ids = set()
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        ids.add(json.loads(line)['id'])
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+        return ids
+
+    def latest(self, user_id: int, limit: int, before_ms: int) -> List[dict]:
+        """Последние limit транзакций пользователя из архива (раньше before_ms), от новых к старым."""
+        result = []
+        for name in reversed(self.partitions()):
+            if len(result) >= limit:
+                break
+            lo, _ = _partition_bounds(name)
+            if lo >= before_ms:
+                continue
+            result.extend(reversed(self._read_partition(name, user_id, before_ms)))
+        return result[:limit]
+
+
+class ArchivedIds:
+    """
+    Проверка при импорте, что транзакция с таким id уже перенесена в архив. В памяти — id
+    одного месячного раздела: выгрузка идет по разделам, и соседние строки попадают в один.
+    """
+
+    def __init__(self, archive: TransactionArchive):
+        self.archive = archive
+        self._name = None
+        self._ids = set()
+
+    def contains(self, trans: dict, before_ms: int) -> bool:
+        if not trans.get('id') or trans['timestamp'] >= before_ms:
+            return False
+        name = _partition(trans['timestamp'])
+        if name != self._name:
+            self._name, self._ids = name, self.archive.partition_ids(name)
+        return trans['id'] in self._ids
+
+
+def merge_range(cold: Iterable[dict], hot: List[dict]) -> List[dict]:
+    """Объединить архивную и оперативную части диапазона (по возрастанию времени)."""
+    hot_ids = {t['id'] for t in hot}
+    cold = [t for t in cold if t['id'] not in hot_ids]
+    if not cold:
+        return hot
+    return sorted(cold + hot, key=lambda t: t['timestamp'])
+
+
+def merge_latest(cold: List[dict], hot: List[dict], limit: int) -> List[dict]:
+    """Объединить последние транзакции из архива и оперативной части (от новых к старым)."""
+    hot_ids = {t['id'] for t in hot}
+    merged = hot + [t for t in cold if t['id'] not in hot_ids]
+    merged.sort(key=lambda t: t['timestamp'], reverse=True)
+    return merged[:limit]
+
+
+def needs_archive(hot_latest: List[dict], limit: int, archived_before: int) -> bool:
+    """Нужно ли дочитывать архив: оперативной части не хватило или в ней есть записи старше границы."""
+    if not archived_before or limit <= 0:
+        return False
+    return len(hot_latest) < limit or hot_latest[-1]['timestamp'] < archived_before
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Загрузка и выгрузка истории транзакций (ledger.py) на каждом движке хранения:
+импорт пачками (import_transactions: одно сохранение на пачку) против add_transaction
+на каждую строку (на части строк), выгрузка в CSV и пиковая память выгрузки (tracemalloc).
+
+Запуск из корня репозитория:
+    python bench/bench_ledger.py
+    python bench/bench_ledger.py --rows 1000000 --engines journal,sqlite
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ledger  # noqa: E402
+from sqlite_storage import SQLiteStorage  # noqa: E402
+from storage import Storage  # noqa: E402
+
+
+def make_storage(engine: str, workdir: str):
+    os.makedirs(workdir, exist_ok=True)
+    if engine == 'sqlite':
+        return SQLiteStorage(os.path.join(workdir, 'reminders.db'))
+    return Storage(os.path.join(workdir, 'reminders.json'), engine=engine)
+
+
+def write_csv(path: str, rows: int, users: int, seed: int):
+    rnd = random.Random(seed)
+    start = 1700000000000
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('user_id,amount,category,timestamp\n')
+        for _ in range(rows):
+            f.write(f'{rnd.randint(1, users)},{rnd.randint(-5000, 5000)},cat{rnd.randint(1, 30)},'
+                    f'{start + rnd.randint(0, 365 * 86400000)}\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--per-row', type=int, default=2000, help='строк для замера add_transaction на каждую строку')
+    parser.add_argument('--engines', default='json,journal,sqlite')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='maxon-ledger-')
+    try:
+        source = os.path.join(workdir, 'ledger.csv')
+        write_csv(source, args.rows, args.users, args.seed)
+        print(f'{args.rows} rows, {args.users} users')
+        print(f"{'engine':>8} {'per_row/s':>10} {'import/s':>10} {'export/s':>10} {'export_peak_mb':>15}")
+        for engine in args.engines.split(','):
+            # add_transaction на каждую строку (как при ручной загрузке) — на первых --per-row строках
+            storage = make_storage(engine, os.path.join(workdir, engine + '-row'))
+            with open(source, 'r', encoding='utf-8', newline='') as f:
+                rows = list(zip(range(args.per_row), ledger.load(f, 'csv')))
+            start = time.perf_counter()
+            for _, t in rows:
+                storage.add_transaction(t['user_id'], t['amount'], t['category'], t['timestamp'])
+            per_row = len(rows) / (time.perf_counter() - start)
+            storage.close()
+
+            storage = make_storage(engine, os.path.join(workdir, engine))
+            start = time.perf_counter()
+            with open(source, 'r', encoding='utf-8', newline='') as f:
+                added, _ = ledger.import_ledger(storage, f, 'csv')
+            imported = added / (time.perf_counter() - start)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            with open(os.devnull, 'w', encoding='utf-8') as out:
+                exported = ledger.export_ledger(storage, out, 'csv')
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            storage.close()
+            print(f'{engine:>8} {per_row:>10.0f} {imported:>10.0f} {exported / seconds:>10.0f} {peak / 2 ** 20:>15.2f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
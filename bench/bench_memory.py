@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Память файлового хранилища (json/journal) на больших объемах: прежнее представление
+записей словарями против компактного (records.py: __slots__, целочисленные id,
+интернированные категории). Оба варианта загружают один и тот же снимок; для словарей
+строятся те же индексы, что держало хранилище до перехода на компактные записи.
+Каждый вариант считается в отдельном процессе (tracemalloc): удерживаемая память после
+загрузки (и доля в ней итогов rollups, общих для обоих вариантов), пик во время загрузки,
+байт на запись без итогов и время загрузки.
+
+Запуск из корня репозитория:
+    python bench/bench_memory.py
+    python bench/bench_memory.py --transactions 500000 --users 5000 --reminders 50000
+"""
+
+import argparse
+import gc
+import heapq
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from rollups import add_to_rollups  # noqa: E402
+
+VARIANTS = ('dict', 'compact')
+CATEGORIES = ['Продукты', 'Транспорт', 'Кафе', 'Аренда', 'Зарплата', 'Подарки', 'Здоровье', 'Связь', 'Прочее']
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def write_snapshot(path: str, args):
+    """Снимок в формате хранилища: транзакции за год и напоминания (часть — отправленные)."""
+    rnd = random.Random(args.seed)
+    now_ms = int(time.time() * 1000)
+    transactions = []
+    rollups = {}
+    for _ in range(args.transactions):
+        t = {'id': str(uuid.UUID(int=rnd.getrandbits(128), version=4)), 'user_id': rnd.randrange(args.users),
+             'amount': rnd.choice((-1, 1)) * rnd.randrange(1, 50000), 'category': rnd.choice(CATEGORIES),
+             'timestamp': now_ms - rnd.randrange(365 * DAY_MS)}
+        transactions.append(t)
+        add_to_rollups(rollups.setdefault(str(t['user_id']), {}), t)
+    reminders = [{'id': str(uuid.UUID(int=rnd.getrandbits(128), version=4)), 'user_id': rnd.randrange(args.users),
+                  'time': now_ms + rnd.randrange(-7 * DAY_MS, 30 * DAY_MS), 'text': f'Напоминание {i}',
+                  'sent': rnd.random() < 0.5} for i in range(args.reminders)]
+    data = {'reminders': reminders, 'pending': {}, 'user_timezones': {}, 'transactions': transactions,
+            'pending_transactions': {}, 'features': {'notifications': True, 'transactions': True}, 'rollups': rollups}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+class DictStore:
+    """Прежнее представление: словари из json.load и индексы хранилища поверх них."""
+
+    def __init__(self, path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            self.data = json.load(f)
+        self.by_id = {r['id']: r for r in self.data['reminders']}
+        self.due_heap = [(r['time'], r['id']) for r in self.data['reminders'] if not r['sent']]
+        heapq.heapify(self.due_heap)
+        self.active_by_user = {}
+        for r in self.data['reminders']:
+            if not r['sent']:
+                self.active_by_user.setdefault(r['user_id'], []).append(r)
+        self.tx_by_user = {}
+        for t in self.data['transactions']:
+            self.tx_by_user.setdefault(t['user_id'], []).append(t)
+        for items in self.tx_by_user.values():
+            items.sort(key=lambda t: t['timestamp'])
+
+
+def load(variant: str, path: str):
+    if variant == 'dict':
+        return DictStore(path)
+    from storage import Storage
+    return Storage(path, engine='json')
+
+
+def run_child(args) -> dict:
+    # время загрузки — без tracemalloc (он замедляет каждое выделение памяти)
+    start = time.perf_counter()
+    store = load(args.child, args.file)
+    load_seconds = time.perf_counter() - start
+    if args.child == 'compact':
+        store.close()
+    del store
+    gc.collect()
+
+    tracemalloc.start()
+    store = load(args.child, args.file)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    # итоги по дням и месяцам (rollups) одинаковы в обоих вариантах — показать их долю отдельно
+    data = store.data if args.child == 'dict' else store._data
+    data['rollups'] = {}
+    gc.collect()
+    without_rollups = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    records = args.transactions + args.reminders
+    return {'variant': args.child, 'retained_mb': retained / 2 ** 20, 'rollups_mb': (retained - without_rollups) / 2 ** 20,
+            'peak_mb': peak / 2 ** 20, 'bytes_per_record': without_rollups / records, 'load_s': load_seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=300000)
+    parser.add_argument('--reminders', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+
+    workdir = tempfile.mkdtemp(prefix='maxon-memory-')
+    try:
+        path = os.path.join(workdir, 'reminders.json')
+        write_snapshot(path, args)
+        print(f'snapshot: {args.transactions} transactions, {args.reminders} reminders, '
+              f'{os.path.getsize(path) / 2 ** 20:.1f} MB on disk')
+        print(f"{'variant':>8} {'retained_mb':>12} {'rollups_mb':>11} {'peak_mb':>9} {'B/record':>9} {'load_s':>7}")
+        for variant in VARIANTS:
+            cmd = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--child', variant, '--file', path]
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f'{variant} failed:\n{proc.stderr[-2000:]}', file=sys.stderr)
+                continue
+            row = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{row['variant']:>8} {row['retained_mb']:>12.1f} {row['rollups_mb']:>11.1f} {row['peak_mb']:>9.1f} "
+                  f"{row['bytes_per_record']:>9.0f} {row['load_s']:>7.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
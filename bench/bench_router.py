@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк маршрутизации обновлений: Router.dispatch на синтетических обновлениях
+(bench/synthetic_updates.py) без сети — отправка сообщений подменена заглушкой.
+Печатает общую скорость, p50/p99 на обновление и время каждого обработчика
+(вызовы, сколько из них обработчик принял, среднее время).
+
+Запуск из корня репозитория:
+    python bench/bench_router.py
+    python bench/bench_router.py --updates 50000 --users 1000 --engine sqlite
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic_updates import UpdateGenerator  # noqa: E402
+
+
+class HandlerStats:
+    def __init__(self):
+        self.calls = 0
+        self.accepted = 0
+        self.seconds = 0.0
+
+
+def instrument(router) -> dict:
+    """Обернуть зарегистрированные обработчики счетчиками времени; имя -> HandlerStats."""
+    stats = {}
+
+    def timed(handler):
+        entry = stats.setdefault(handler.__name__, HandlerStats())
+
+        def wrapper(ctx):
+            start = time.perf_counter()
+            result = handler(ctx)
+            entry.seconds += time.perf_counter() - start
+            entry.calls += 1
+            entry.accepted += result is not False
+            return result
+        return wrapper
+
+    router.commands = {name: (timed(h), exact) for name, (h, exact) in router.commands.items()}
+    router.patterns = [(regex, timed(h)) for regex, h in router.patterns]
+    router.callbacks = {prefix: timed(h) for prefix, h in router.callbacks.items()}
+    if router.default_callback is not None:
+        router.default_callback = timed(router.default_callback)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--engine', default='journal', help='json, journal или sqlite')
+    parser.add_argument('--policy', default='interval', help='persist_policy (interval — без fsync на каждое изменение)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='maxon-router-')
+    os.environ.setdefault('MAX_ACCESS_TOKEN', 'bench')
+    try:
+        import bot
+        from router import Context
+        from storage import Storage
+        from sqlite_storage import SQLiteStorage
+
+        logging.getLogger().setLevel(logging.ERROR)
+        bot.send_message = lambda *a, **k: None
+        bot.answer_callback = lambda *a, **k: None
+        if args.engine == 'sqlite':
+            storage = SQLiteStorage(os.path.join(workdir, 'router.db'), bot.cfg['max_reminders_per_user'], persist_policy=args.policy)
+        else:
+            storage = Storage(os.path.join(workdir, 'router.json'), bot.cfg['max_reminders_per_user'], engine=args.engine,
+                              persist_policy=args.policy)
+        updates = list(UpdateGenerator(args.users, seed=args.seed).generate(args.updates))
+        router = bot.router
+        # прогрев: кэши шаблонов, соединения чтения, индексы пользователей
+        for u in updates[:500]:
+            router.dispatch(Context(storage, u))
+        stats = instrument(router)
+
+        latencies = []
+        start = time.perf_counter()
+        for u in updates:
+            t0 = time.perf_counter()
+            router.dispatch(Context(storage, u))
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+        storage.close()
+
+        latencies.sort()
+        print(f'{len(updates)} updates in {elapsed:.2f}s: {len(updates) / elapsed:.0f}/s, '
+              f'p50 {latencies[len(latencies) // 2] * 1e6:.0f}us, p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f}us')
+        print(f"{'handler':>24} {'calls':>8} {'accepted':>9} {'mean_us':>9}")
+        for name, s in sorted(stats.items(), key=lambda item: -item[1].seconds):
+            print(f'{name:>24} {s.calls:>8} {s.accepted:>9} {s.seconds / max(1, s.calls) * 1e6:>9.1f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Холодный старт файлового хранилища: загрузка снимка JSON против двоичного
+(snapshot_format "binary") на одних и тех же данных, и время импорта модулей,
+которые нужны до готовности процесса. Каждый замер — в отдельном процессе.
+
+Запуск из корня репозитория:
+    python bench/bench_startup.py
+    python bench/bench_startup.py --transactions 1000000 --users 10000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_memory import write_snapshot  # noqa: E402
+
+IMPORTS = ('config', 'storage', 'bot', 'webhook')
+
+
+def child_load(path: str) -> dict:
+    from storage import Storage
+
+    start = time.perf_counter()
+    storage = Storage(path, engine='json', snapshot_format='binary')
+    seconds = time.perf_counter() - start
+    storage.close()
+    return {'load_s': seconds}
+
+
+def child_import(module: str) -> dict:
+    os.environ.setdefault('MAX_ACCESS_TOKEN', 'bench')
+    start = time.perf_counter()
+    __import__(module)
+    return {'import_s': time.perf_counter() - start}
+
+
+def run(*child_args) -> dict:
+    cmd = [sys.executable, os.path.abspath(__file__), '--child'] + list(child_args)
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=300000)
+    parser.add_argument('--reminders', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        kind, value = args.child
+        print(json.dumps(child_load(value) if kind == 'load' else child_import(value)))
+        return
+
+    workdir = tempfile.mkdtemp(prefix='maxon-startup-')
+    try:
+        from storage import Storage
+
+        json_path = os.path.join(workdir, 'json', 'reminders.json')
+        os.makedirs(os.path.dirname(json_path))
+        write_snapshot(json_path, args)
+        binary_path = os.path.join(workdir, 'binary', 'reminders.json')
+        # тот же снимок, пересохраненный в двоичном формате
+        storage = Storage(json_path, engine='json', snapshot_format='binary')
+        with storage.lock.read():
+            payload = storage._encode_snapshot('binary')
+        storage.close()
+        os.makedirs(os.path.dirname(binary_path))
+        with open(binary_path, 'wb') as f:
+            f.write(payload)
+
+        print(f'{args.transactions} transactions, {args.reminders} reminders')
+        print(f"{'snapshot':>10} {'size_mb':>8} {'load_s':>7}")
+        for name, path in (('json', json_path), ('binary', binary_path)):
+            row = run('load', path)
+            print(f'{name:>10} {os.path.getsize(path) / 2 ** 20:>8.1f} {row["load_s"]:>7.2f}')
+        print(f"{'import':>10} {'seconds':>8}")
+        for module in IMPORTS:
+            print(f'{module:>10} {run("import", module)["import_s"]:>8.3f}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Сравнение движков хранения (json, journal, sqlite) на наборах из 10k, 100k и 1M записей.
+
+Запуск из корня репозитория:
+    python bench/bench_storage.py
+    python bench/bench_storage.py --sizes 10000,100000 --writes 50
+
+Для каждого размера генерируется JSON-файл с транзакциями (и напоминаниями),
+затем каждый движок открывает его (sqlite — через одноразовую миграцию) и измеряются:
+время открытия, средняя задержка записи и типовых чтений, размер файлов на диске.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import Storage  # noqa: E402
+from sqlite_storage import SQLiteStorage  # noqa: E402
+
+DAY_MS = 24 * 3600 * 1000
+
+
+def generate(path: str, n: int, now_ms: int):
+    """Сгенерировать файл хранилища с n транзакциями; возвращает число пользователей."""
+    users = max(100, n // 100)
+    rnd = random.Random(n)
+    transactions = [
+        {'id': str(uuid.uuid4()), 'user_id': rnd.randrange(users), 'amount': rnd.randint(-5000, 5000),
+         'category': rnd.choice(('Продукты', 'Такси', 'Кафе', 'Зарплата', 'Подработка')),
+         'timestamp': now_ms - rnd.randrange(365 * DAY_MS)}
+        for _ in range(n)
+    ]
+    reminders = [
+        {'id': str(uuid.uuid4()), 'user_id': u, 'time': now_ms + rnd.randrange(30 * DAY_MS), 'text': 'Напоминание', 'sent': False}
+        for u in range(users) for _ in range(3)
+    ]
+    data = {'reminders': reminders, 'pending': {}, 'user_timezones': {}, 'transactions': transactions,
+            'pending_transactions': {}, 'features': {'notifications': True, 'transactions': True}}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return users
+
+
+def timed(fn, repeat: int):
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn(i)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def file_size(*paths):
+    return sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+
+
+def run_engine(engine: str, workdir: str, source: str, users: int, writes: int, now_ms: int):
+    json_path = os.path.join(workdir, f'{engine}.json')
+    db_path = os.path.join(workdir, f'{engine}.db')
+    shutil.copyfile(source, json_path)
+    start = time.perf_counter()
+    if engine == 'sqlite':
+        storage = SQLiteStorage(db_path, migrate_from=json_path)
+    else:
+        storage = Storage(json_path, engine=engine, compact_every=10 ** 9)
+    open_ms = (time.perf_counter() - start) * 1000
+    rnd = random.Random(1)
+    result = {
+        'engine': engine,
+        'open_ms': open_ms,
+        'add_transaction_ms': timed(lambda i: storage.add_transaction(rnd.randrange(users), 100, 'Кафе', now_ms + i), writes),
+        'get_transactions_ms': timed(lambda i: storage.get_transactions(rnd.randrange(users)), 200),
+        'range_week_ms': timed(lambda i: storage.get_transactions_in_range(rnd.randrange(users), now_ms - 7 * DAY_MS, now_ms), 200),
+        'list_reminders_ms': timed(lambda i: storage.list_reminders(rnd.randrange(users)), 200),
+        'get_due_ms': timed(lambda i: storage.get_due(now_ms), 50),
+    }
+    if engine == 'sqlite':
+        storage.compact()
+        storage.close()
+        result['disk_bytes'] = file_size(db_path, db_path + '-wal')
+    else:
+        result['disk_bytes'] = file_size(json_path, json_path + '.wal')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='размеры набора (число транзакций) через запятую')
+    parser.add_argument('--engines', default='json,journal,sqlite')
+    parser.add_argument('--writes', type=int, default=20, help='число add_transaction на замер (json на 1M медленный)')
+    args = parser.parse_args()
+
+    now_ms = int(time.time() * 1000)
+    columns = ('engine', 'open_ms', 'add_transaction_ms', 'get_transactions_ms', 'range_week_ms',
+               'list_reminders_ms', 'get_due_ms', 'disk_bytes')
+    for n in (int(s) for s in args.sizes.split(',')):
+        workdir = tempfile.mkdtemp(prefix='maxon-bench-')
+        try:
+            source = os.path.join(workdir, 'source.json')
+            users = generate(source, n, now_ms)
+            print(f'\n== {n} transactions, {users} users ==')
+            print(' '.join(f'{c:>20}' for c in columns))
+            for engine in args.engines.split(','):
+                row = run_engine(engine, workdir, source, users, args.writes, now_ms)
+                print(' '.join(f'{row[c]:>20.3f}' if isinstance(row[c], float) else f'{row[c]:>20}' for c in columns))
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
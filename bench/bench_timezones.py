@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк часовых поясов: разбор строки пояса без кэша и с кэшем, tz_to_utc_offset,
+форматирование списка меток времени (astimezone на каждую строку против заранее
+вычисленного смещения) и get_user_tzinfo хранилища против чтения строки и разбора.
+
+Запуск из корня репозитория:
+    python bench/bench_timezones.py
+    python bench/bench_timezones.py --rounds 200000 --engine sqlite
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from dateutil import tz  # noqa: E402
+
+from timezones import local_time_formatter, tz_to_utc_offset, utc_offset_to_tz  # noqa: E402
+
+ZONES = ['UTC+3', 'UTC-5', 'UTC+5:30', 'Europe/Moscow', 'America/New_York']
+
+
+def measure(name: str, rounds: int, func):
+    start = time.perf_counter()
+    for i in range(rounds):
+        func(i)
+    elapsed = time.perf_counter() - start
+    print(f'{name:>40} {elapsed / rounds * 1e6:>9.2f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=50000)
+    parser.add_argument('--rows', type=int, default=100, help='строк в списке /note или /cash')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--engine', default='journal', help='json, journal или sqlite')
+    args = parser.parse_args()
+
+    parse_uncached = utc_offset_to_tz.__wrapped__
+    measure('parse, uncached', args.rounds, lambda i: parse_uncached(ZONES[i % len(ZONES)]))
+    measure('parse, cached', args.rounds, lambda i: utc_offset_to_tz(ZONES[i % len(ZONES)]))
+    measure('tz_to_utc_offset', args.rounds, lambda i: tz_to_utc_offset(ZONES[i % len(ZONES)]))
+
+    now_ms = int(time.time() * 1000)
+    stamps = [now_ms + i * 3600_000 for i in range(args.rows)]
+    list_rounds = max(1, args.rounds // args.rows)
+    for zone in ('UTC+3', 'Europe/Moscow'):
+        tz_obj = utc_offset_to_tz(zone)
+        measure(f'{args.rows} rows astimezone, {zone}', list_rounds, lambda i: [
+            datetime.fromtimestamp(ms / 1000, tz=tz.tzutc()).astimezone(tz_obj).strftime('%H:%M') for ms in stamps])
+
+        def formatted(i, tz_obj=tz_obj):
+            local_time = local_time_formatter(tz_obj)
+            return [local_time(ms).strftime('%H:%M') for ms in stamps]
+        measure(f'{args.rows} rows formatter, {zone}', list_rounds, formatted)
+
+    workdir = tempfile.mkdtemp(prefix='maxon-tz-')
+    try:
+        from storage import Storage
+        from sqlite_storage import SQLiteStorage
+
+        if args.engine == 'sqlite':
+            storage = SQLiteStorage(os.path.join(workdir, 'tz.db'), 10, persist_policy='interval')
+        else:
+            storage = Storage(os.path.join(workdir, 'tz.json'), 10, engine=args.engine, persist_policy='interval')
+        with storage.batch():
+            for user_id in range(args.users):
+                storage.set_user_tz(user_id, ZONES[user_id % len(ZONES)])
+        measure('storage get_user_tz + parse', args.rounds,
+                lambda i: parse_uncached(storage.get_user_tz(i % args.users)))
+        measure('storage get_user_tzinfo', args.rounds, lambda i: storage.get_user_tzinfo(i % args.users))
+        storage.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
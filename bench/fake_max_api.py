@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Локальный сервер, имитирующий Max Bot API для нагрузочных тестов: POST /messages,
+POST /answers и GET /updates (long-polling с marker) с настраиваемой задержкой
+ответа и долей ошибок. Бот направляется на него переменной окружения MAX_API_BASE.
+
+Отдельный запуск (например, для ручной проверки бота без доступа к Max):
+    python bench/fake_max_api.py --port 8081 --latency-ms 30 --error-rate 0.01
+    MAX_API_BASE=http://127.0.0.1:8081 MAX_ACCESS_TOKEN=x python bot.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Верхняя граница ожидания в GET /updates (бот просит до 30 с; тестам столько не нужно)
+MAX_POLL_WAIT_SECONDS = 1.0
+
+
+class FakeMaxApi:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0, jitter_ms: float = 0,
+                 error_rate: float = 0.0, error_status: int = 503, seed: int = 1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Condition()
+        # очередь обновлений для GET /updates; marker — позиция в ней
+        self._updates = []
+        # успешно принятые сообщения: (время приема в мс, user_id, текст)
+        self.messages = []
+        self.answers = 0
+        self.errors = 0
+        self.polls = 0
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.api = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeMaxApi':
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-max-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def push_updates(self, updates: list):
+        """Добавить обновления, которые бот получит через GET /updates."""
+        with self._lock:
+            self._updates.extend(updates)
+            self._lock.notify_all()
+
+    def pending_updates(self, marker: int) -> int:
+        with self._lock:
+            return len(self._updates) - marker
+
+    def _delay(self):
+        delay = self.latency_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def _fail(self) -> bool:
+        with self._lock:
+            failed = self.error_rate > 0 and self._random.random() < self.error_rate
+            self.errors += failed
+        return failed
+
+    def _poll(self, marker: int, limit: int, timeout: float):
+        deadline = time.monotonic() + min(timeout, MAX_POLL_WAIT_SECONDS)
+        with self._lock:
+            self.polls += 1
+            while len(self._updates) <= marker:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            batch = self._updates[marker:marker + limit]
+        return {'updates': batch, 'marker': marker + len(batch)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # заголовки и тело уходят разными write: без TCP_NODELAY каждый ответ ждал бы delayed ACK (~40 мс)
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+    def do_GET(self):
+        api = self.server.api
+        url = urlparse(self.path)
+        if url.path != '/updates':
+            return self._reply(404, {'code': 'not.found'})
+        if api._fail():
+            return self._reply(api.error_status, {'code': 'fake.error'})
+        query = parse_qs(url.query)
+        marker = int(query.get('marker', ['0'])[0])
+        limit = int(query.get('limit', ['100'])[0])
+        timeout = float(query.get('timeout', ['30'])[0])
+        self._reply(200, api._poll(marker, limit, timeout))
+
+    def do_POST(self):
+        api = self.server.api
+        url = urlparse(self.path)
+        body = self._read_json()
+        if url.path not in ('/messages', '/answers'):
+            return self._reply(404, {'code': 'not.found'})
+        api._delay()
+        if api._fail():
+            return self._reply(api.error_status, {'code': 'fake.error'})
+        if url.path == '/messages':
+            user_id = parse_qs(url.query).get('user_id', [None])[0]
+            with api._lock:
+                api.messages.append((time.time() * 1000, user_id, body.get('text', '')))
+            return self._reply(200, {'message': {'body': {'mid': f'fake.{len(api.messages)}', 'text': body.get('text', '')}}})
+        with api._lock:
+            api.answers += 1
+        self._reply(200, {'success': True})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0, help='задержка ответа /messages и /answers')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='случайная добавка к задержке (0..jitter)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов с ошибкой (0..1)')
+    parser.add_argument('--error-status', type=int, default=503)
+    args = parser.parse_args()
+
+    api = FakeMaxApi(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.error_status).start()
+    print(f'Fake Max API on {api.base_url}. Ctrl+C to stop.')
+    try:
+        while True:
+            time.sleep(5)
+            print(f'messages={len(api.messages)} answers={api.answers} polls={api.polls} errors={api.errors}')
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест бота целиком: бот работает против локального имитатора Max API
+(bench/fake_max_api.py), обновления генерирует bench/synthetic_updates.py.
+
+Сценарии:
+    webhook    — POST /updates в webhook.app (uvicorn на локальном порту), обработка пулом потоков
+    long_poll  — Bot.long_poll забирает обновления из GET /updates имитатора
+    scheduler  — scheduler_thread рассылает заранее созданные напоминания
+
+Для каждого сценария и движка хранения печатаются пропускная способность, p50/p99
+задержки (webhook и long_poll — от отправки обновления до конца обработки, scheduler —
+опоздание доставки), число ошибок и размер файлов хранилища. Каждый прогон идет в
+отдельном процессе с чистым каталогом данных.
+
+Запуск из корня репозитория:
+    python bench/load_bot.py
+    python bench/load_bot.py --scenarios webhook --engines sqlite --updates 5000 --users 500 --latency-ms 20
+    python bench/load_bot.py --scenarios scheduler --set delivery_rate_per_second=200 --out results.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_max_api import FakeMaxApi  # noqa: E402
+from synthetic_updates import UpdateGenerator  # noqa: E402
+
+SCENARIOS = ('webhook', 'long_poll', 'scheduler')
+COLUMNS = ('scenario', 'engine', 'count', 'seconds', 'per_second', 'p50_ms', 'p99_ms', 'errors', 'storage_bytes')
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(p / 100 * len(values))) - 1)]
+
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_overrides(pairs: list) -> dict:
+    """--set key=value: значение разбирается как JSON, иначе остается строкой."""
+    result = {}
+    for pair in pairs:
+        key, _, value = pair.partition('=')
+        try:
+            result[key] = json.loads(value)
+        except ValueError:
+            result[key] = value
+    return result
+
+
+def paced(items, rate: float):
+    """Выдавать элементы не быстрее rate в секунду (0 — без ограничения)."""
+    start = time.perf_counter()
+    for i, item in enumerate(items):
+        if rate > 0:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield item
+
+
+class HandleTracker:
+    """Время от отправки обновления до окончания Bot.handle_update."""
+
+    def __init__(self, bot_instance, update_key):
+        self._update_key = update_key
+        self._sent = {}
+        self._lock = threading.Condition()
+        self.latencies = []
+        self.errors = 0
+        handle = bot_instance.handle_update
+
+        def tracked(update):
+            try:
+                handle(update)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                self._done(update)
+
+        # webhook и long_poll берут bot.handle_update во время работы
+        bot_instance.handle_update = tracked
+
+    def sent(self, update: dict):
+        with self._lock:
+            self._sent[self._update_key(update)] = time.perf_counter()
+
+    def _done(self, update: dict):
+        now = time.perf_counter()
+        with self._lock:
+            started = self._sent.pop(self._update_key(update), None)
+            if started is not None:
+                self.latencies.append((now - started) * 1000)
+            self._lock.notify_all()
+
+    def wait(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while len(self.latencies) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+        return True
+
+
+def run_webhook(bot, args, updates: list, tracker: HandleTracker) -> dict:
+    import requests
+    import uvicorn
+    import webhook
+
+    server = uvicorn.Server(uvicorn.Config(webhook.app, host='127.0.0.1', port=free_port(), log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    url = f'http://127.0.0.1:{server.config.port}/updates'
+    local = threading.local()
+    acks = []
+    rejected = [0]
+
+    def post(update):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        tracker.sent(update)
+        started = time.perf_counter()
+        resp = session.post(url, json=update)
+        acks.append((time.perf_counter() - started) * 1000)
+        if resp.status_code != 200:
+            rejected[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for f in [pool.submit(post, u) for u in paced(updates, args.rate)]:
+            f.result()
+    tracker.wait(len(updates) - rejected[0], args.timeout)
+    elapsed = time.perf_counter() - start
+    # остановка сервера дообрабатывает очередь и закрывает хранилище
+    server.should_exit = True
+    thread.join()
+    return {'seconds': elapsed, 'ack_p50_ms': percentile(acks, 50), 'ack_p99_ms': percentile(acks, 99),
+            'rejected': rejected[0]}
+
+
+def run_long_poll(bot, args, updates: list, tracker: HandleTracker, fake: FakeMaxApi) -> dict:
+    # пачки в обработке: хранилище закрывается только после сохранения последней
+    in_flight = [0]
+    idle = threading.Condition()
+    process_batch = bot.process_batch
+
+    def tracked_batch(*a):
+        with idle:
+            in_flight[0] += 1
+        try:
+            process_batch(*a)
+        finally:
+            with idle:
+                in_flight[0] -= 1
+                idle.notify_all()
+
+    bot.process_batch = tracked_batch
+    start = time.perf_counter()
+    threading.Thread(target=bot.long_poll, daemon=True).start()
+
+    def producer():
+        for u in paced(updates, args.rate):
+            tracker.sent(u)
+            fake.push_updates([u])
+
+    threading.Thread(target=producer, daemon=True).start()
+    tracker.wait(len(updates), args.timeout)
+    elapsed = time.perf_counter() - start
+    with idle:
+        idle.wait_for(lambda: not in_flight[0], args.timeout)
+    return {'seconds': elapsed, 'polls': fake.polls}
+
+
+def run_scheduler(bot_module, storage, args, fake: FakeMaxApi) -> dict:
+    limit = bot_module.cfg['max_reminders_per_user']
+    users = max(args.users, math.ceil(args.reminders / limit))
+    first_due = int(time.time() * 1000) + 1000
+    due = {}
+    with storage.batch():
+        for i in range(args.reminders):
+            due_ms = first_due + int(i * args.spread * 1000 / max(1, args.reminders))
+            storage.add_reminder(1000 + i % users, due_ms, f'bench {i}')
+            due[f'Напоминание: bench {i}'] = due_ms
+    threading.Thread(target=bot_module.scheduler_thread, args=(storage,), daemon=True).start()
+    deadline = time.monotonic() + args.spread + args.timeout
+    while time.monotonic() < deadline:
+        with fake._lock:
+            delivered = {text: at for at, _, text in fake.messages if text in due}
+        if len(delivered) >= len(due):
+            break
+        time.sleep(0.05)
+    # дождаться отметки об отправке, прежде чем хранилище будет закрыто
+    while storage.next_due_ms() is not None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    lags = [delivered[text] - due[text] for text in delivered]
+    last = max(delivered.values()) if delivered else first_due
+    return {'count': len(delivered), 'seconds': max(0.001, (last - first_due) / 1000), 'lags': lags,
+            'missed': len(due) - len(delivered)}
+
+
+def run_child(args) -> dict:
+    """Один сценарий на одном движке в текущем процессе (каталог данных — временный)."""
+    workdir = tempfile.mkdtemp(prefix='maxon-load-')
+    fake = FakeMaxApi(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate).start()
+    os.environ['MAX_API_BASE'] = fake.base_url
+    os.environ.setdefault('MAX_ACCESS_TOKEN', 'bench')
+    os.chdir(workdir)
+    try:
+        import bot
+        from dedupe import update_key
+        from storage import open_storage
+
+        logging.getLogger().setLevel(logging.INFO if args.verbose else logging.ERROR)
+        bot.cfg.update({
+            'storage_engine': args.engines,
+            'storage_file': 'data/reminders.json',
+            'sqlite_file': 'data/reminders.db',
+            'archive_dir': 'data/archive',
+            'retention_sent_days': 0,
+            'retention_transactions_days': 0,
+            'updates_timeout_seconds': 1,
+        })
+        bot.cfg.update(parse_overrides(args.set))
+        os.makedirs('data', exist_ok=True)
+        storage = open_storage(bot.cfg)
+        storage.set_feature('notifications', True)
+        storage.set_feature('transactions', True)
+        instance = bot.Bot(storage)
+        bot._bot_instance = instance
+
+        row = {'scenario': args.child, 'engine': args.engines}
+        if args.child == 'scheduler':
+            result = run_scheduler(bot, storage, args, fake)
+            latencies = result.pop('lags')
+            errors = result.pop('missed')
+        else:
+            updates = list(UpdateGenerator(args.users, seed=args.seed).generate(args.updates))
+            tracker = HandleTracker(instance, update_key)
+            if args.child == 'webhook':
+                result = run_webhook(instance, args, updates, tracker)
+            else:
+                result = run_long_poll(instance, args, updates, tracker, fake)
+            result['count'] = len(tracker.latencies)
+            latencies = tracker.latencies
+            errors = tracker.errors + result.get('rejected', 0) + len(updates) - len(tracker.latencies)
+        if args.child != 'webhook':
+            storage.close()
+        row.update(result)
+        row['per_second'] = row['count'] / row['seconds'] if row['seconds'] else 0.0
+        row['p50_ms'] = percentile(latencies, 50)
+        row['p99_ms'] = percentile(latencies, 99)
+        row['errors'] = errors
+        row['api_errors'] = fake.errors
+        row['storage_bytes'] = dir_size(os.path.join(workdir, 'data'))
+        return row
+    finally:
+        fake.stop()
+        os.chdir(BENCH_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--engines', default='json,journal,sqlite')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--updates', type=int, default=2000, help='обновлений на сценарий webhook/long_poll')
+    parser.add_argument('--reminders', type=int, default=200, help='напоминаний в сценарии scheduler')
+    parser.add_argument('--spread', type=float, default=5, help='сроки напоминаний распределены на столько секунд')
+    parser.add_argument('--rate', type=float, default=0, help='обновлений в секунду (0 — все сразу)')
+    parser.add_argument('--concurrency', type=int, default=16, help='параллельных отправителей webhook')
+    parser.add_argument('--latency-ms', type=float, default=10, help='задержка ответа имитатора Max API')
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 503 от имитатора')
+    parser.add_argument('--timeout', type=float, default=120, help='сколько ждать завершения обработки')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='переопределить ключ config.json')
+    parser.add_argument('--out', help='сохранить результаты в JSON (для сравнения между версиями)')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+
+    rows = []
+    print(' '.join(f'{c:>14}' for c in COLUMNS))
+    for scenario in args.scenarios.split(','):
+        for engine in args.engines.split(','):
+            cmd = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--child', scenario, '--engines', engine]
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f'{scenario}/{engine} failed:\n{proc.stderr[-2000:]}', file=sys.stderr)
+                continue
+            row = json.loads(proc.stdout.strip().splitlines()[-1])
+            rows.append(row)
+            print(' '.join(f'{row[c]:>14.1f}' if isinstance(row[c], float) else f'{row[c]:>14}' for c in COLUMNS))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+    if any(row['errors'] for row in rows) or len(rows) < len(args.scenarios.split(',')) * len(args.engines.split(',')):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Стресс-проверка хранилища из многих потоков: писатели добавляют транзакции и
+напоминания, читатели непрерывно вызывают все методы чтения, планировщик забирает
+наступившие напоминания. В конце проверяются инварианты (ничего не потеряно,
+лимиты соблюдены, данные совпадают после переоткрытия). Отдельно проверяются
+границы batch() (пачка откладывает только свои изменения), проигрывание журнала
+поверх свернутого снимка, откат транзакции пачки SQLite при исключении, лимит напоминаний
+SQLite при записи из нескольких процессов и перенос файлового хранилища в SQLite (JSON и двоичный снимок, с marker long-polling).
+Код выхода 1 при ошибке.
+
+Запуск из корня репозитория:
+    python bench/stress_storage.py
+    python bench/stress_storage.py --engines journal --writers 16 --ops 500 --policy interval
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import Storage  # noqa: E402
+from sqlite_storage import SQLiteStorage  # noqa: E402
+
+MAX_PER_USER = 5
+
+
+def open_engine(engine: str, workdir: str, policy: str):
+    if engine == 'sqlite':
+        return SQLiteStorage(os.path.join(workdir, 'stress.db'), MAX_PER_USER, persist_policy=policy)
+    return Storage(os.path.join(workdir, 'stress.json'), MAX_PER_USER, engine=engine, compact_every=200,
+                   persist_policy=policy, persist_interval_ms=20, persist_every=50)
+
+
+def run(engine: str, writers: int, readers: int, ops: int, policy: str) -> list:
+    workdir = tempfile.mkdtemp(prefix='maxon-stress-')
+    errors = []
+    try:
+        storage = open_engine(engine, workdir, policy)
+        stop = threading.Event()
+        reads = [0]
+
+        def writer(user_id):
+            try:
+                for i in range(ops):
+                    if i % 3 == 0:
+                        with storage.batch():
+                            storage.set_pending_transaction_amount(user_id, i)
+                            storage.add_transaction(user_id, i, 'stress', 1_000_000 + i)
+                            storage.clear_pending_transaction(user_id)
+                    else:
+                        storage.add_transaction(user_id, i, 'stress', 1_000_000 + i)
+                    if i % 10 == 0:
+                        storage.add_reminder(user_id, i, f'r{i}')
+                    if i % 25 == 0:
+                        storage.delete_reminder_by_index(user_id, 0)
+                    if i % 50 == 0:
+                        storage.set_user_tz(user_id, f'UTC+{i % 12}')
+            except Exception as e:
+                errors.append(f'writer {user_id}: {e!r}')
+
+        def reader(n):
+            try:
+                while not stop.is_set():
+                    user_id = n % writers
+                    storage.get_pending(user_id)
+                    storage.get_user_tz(user_id)
+                    storage.get_feature('notifications')
+                    storage.get_pending_transaction_amount(user_id)
+                    if len(storage.list_reminders(user_id)) > MAX_PER_USER:
+                        errors.append(f'user {user_id}: reminder limit exceeded')
+                    tx = storage.get_transactions_in_range(user_id, 0, 2_000_000)
+                    if any(a['timestamp'] > b['timestamp'] for a, b in zip(tx, tx[1:])):
+                        errors.append(f'user {user_id}: range result is not sorted')
+                    storage.get_transactions(user_id, limit=10)
+                    reads[0] += 1
+            except Exception as e:
+                errors.append(f'reader {n}: {e!r}')
+
+        def scheduler():
+            try:
+                while not stop.is_set():
+                    due = storage.get_due(ops)
+                    if due:
+                        with storage.batch():
+                            storage.mark_sent_many([r['id'] for r in due[:5]])
+                    storage.next_due_ms()
+                    time.sleep(0.001)
+            except Exception as e:
+                errors.append(f'scheduler: {e!r}')
+
+        start = time.perf_counter()
+        background = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+        background.append(threading.Thread(target=scheduler))
+        for th in background:
+            th.start()
+        write_threads = [threading.Thread(target=writer, args=(u,)) for u in range(writers)]
+        for th in write_threads:
+            th.start()
+        for th in write_threads:
+            th.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        for th in background:
+            th.join()
+
+        for user_id in range(writers):
+            count = len(storage.get_transactions_in_range(user_id, 0, 2_000_000))
+            if count != ops:
+                errors.append(f'user {user_id}: expected {ops} transactions, got {count}')
+            if storage.get_pending_transaction_amount(user_id) is not None:
+                errors.append(f'user {user_id}: pending transaction left behind')
+        snapshot = {u: (storage.get_user_tz(u), [r['id'] for r in storage.list_reminders(u)]) for u in range(writers)}
+        storage.close()
+
+        reopened = open_engine(engine, workdir, policy)
+        for user_id in range(writers):
+            if len(reopened.get_transactions_in_range(user_id, 0, 2_000_000)) != ops:
+                errors.append(f'user {user_id}: transactions lost after reopen')
+            if (reopened.get_user_tz(user_id), [r['id'] for r in reopened.list_reminders(user_id)]) != snapshot[user_id]:
+                errors.append(f'user {user_id}: state differs after reopen')
+        reopened.close()
+
+        total_writes = writers * ops
+        print(f'{engine:>8} {policy:>9}: {total_writes} writes in {elapsed:.2f}s '
+              f'({total_writes / elapsed:.0f}/s), {reads[0]} read rounds ({reads[0] / elapsed:.0f}/s), '
+              f'{len(errors)} errors')
+        return errors
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_batch_isolation(engine: str, timeout: float = 10) -> list:
+    """
+    Открытая пачка откладывает изменения своего потока и присоединившихся к ней, но не
+    чужие: на файловых движках они сохраняются сразу, на SQLite ждут фиксации пачки.
+    После переоткрытия изменение другого потока, сделанное позже изменения пачки, остается
+    последним, хотя пачка сохранена после него.
+    """
+    workdir = tempfile.mkdtemp(prefix='maxon-batch-')
+    errors = []
+    try:
+        storage = open_engine(engine, workdir, 'immediate')
+
+        def joined(scope):
+            with storage.batch(scope):
+                storage.add_transaction(1, -100, 'batch', 1_000_000)
+
+        with storage.batch() as scope:
+            storage.set_user_tz(2, 'UTC+1')
+            th = threading.Thread(target=joined, args=(scope,))
+            th.start()
+            th.join()
+            other = threading.Thread(target=storage.set_user_tz, args=(2, 'UTC+5'), daemon=True)
+            other.start()
+            other.join(0.5 if engine == 'sqlite' else timeout)
+            if engine == 'sqlite':
+                if not other.is_alive():
+                    errors.append(f'{engine} batch: write of another thread joined the open transaction')
+            elif other.is_alive():
+                errors.append(f'{engine} batch: write of another thread waits for the batch')
+            else:
+                # «сбой» до закрытия пачки: копия файлов без межпроцессных блокировок
+                crashed = os.path.join(workdir, 'crashed')
+                shutil.copytree(workdir, crashed, ignore=shutil.ignore_patterns('*.lock', 'crashed'))
+                copy = open_engine(engine, crashed, 'immediate')
+                if copy.get_user_tz(2) != 'UTC+5':
+                    errors.append(f'{engine} batch: write of another thread not saved while the batch is open')
+                if engine == 'journal' and copy.get_transactions(1):
+                    errors.append(f'{engine} batch: joined write saved before the batch closed')
+                copy.close()
+        other.join(timeout)
+        storage.close()
+        storage = open_engine(engine, workdir, 'immediate')
+        if storage.get_user_tz(2) != 'UTC+5' or len(storage.get_transactions(1)) != 1:
+            errors.append(f'{engine} batch: state after reopen differs from the order of changes')
+        storage.close()
+        print(f'{engine:>8} batch isolation: {len(errors)} errors')
+        return errors
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_replay() -> list:
+    """Записи журнала после сворачивания (отправка, удаление) применяются к напоминаниям снимка."""
+    workdir = tempfile.mkdtemp(prefix='maxon-replay-')
+    errors = []
+    try:
+        path = os.path.join(workdir, 'replay.json')
+        storage = Storage(path, MAX_PER_USER, engine='journal', compact_every=10**9)
+        for i in range(3):
+            storage.add_reminder(1, 1_000 + i, f'r{i}')
+        storage.compact()
+        storage.mark_sent(storage.list_reminders(1)[0]['id'])
+        storage.delete_reminder_by_index(1, 0)
+        expected = [r['id'] for r in storage.list_reminders(1)]
+        storage.close()
+        reopened = Storage(path, MAX_PER_USER, engine='journal', compact_every=10**9)
+        if [r['id'] for r in reopened.list_reminders(1)] != expected:
+            errors.append('journal replay: changes to snapshot reminders lost')
+        reopened.close()
+        print(f'{"journal":>8} replay: {len(errors)} errors')
+        return errors
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_rollback() -> list:
+    """Исключение в пачке SQLite откатывает все ее изменения вместе с marker, база остается доступной."""
+    workdir = tempfile.mkdtemp(prefix='maxon-rollback-')
+    errors = []
+    try:
+        storage = SQLiteStorage(os.path.join(workdir, 'rollback.db'), MAX_PER_USER)
+        storage.set_marker(1)
+        try:
+            with storage.batch():
+                storage.add_transaction(1, -100, 'food', 1_000_000)
+                storage.add_reminder(1, 2_000_000, 'r')
+                storage.set_marker(2)
+                raise RuntimeError('batch failed')
+        except RuntimeError:
+            pass
+        if storage.get_marker() != 1 or storage.get_transactions(1) or storage.list_reminders(1):
+            errors.append('rollback: changes of failed batch kept')
+        done = threading.Event()
+        threading.Thread(target=lambda: (storage.add_transaction(2, -1, 'x', 1_000_000), done.set()),
+                         daemon=True).start()
+        if not done.wait(10):
+            errors.append('rollback: write lock not released')
+        storage.close()
+        print(f'{"sqlite":>8} rollback: {len(errors)} errors')
+        return errors
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _add_reminders(path: str, start, count: int):
+    storage = SQLiteStorage(path, MAX_PER_USER)
+    start.wait()
+    for i in range(count):
+        storage.add_reminder(1, i, f'r{i}')
+    storage.close()
+
+
+def check_process_limit(processes: int = 6, trials: int = 5) -> list:
+    """Лимит напоминаний на пользователя соблюдается, когда добавляют несколько процессов сразу."""
+    workdir = tempfile.mkdtemp(prefix='maxon-limit-')
+    errors = []
+    try:
+        for trial in range(trials):
+            path = os.path.join(workdir, f'limit{trial}.db')
+            SQLiteStorage(path, MAX_PER_USER).close()
+            start = multiprocessing.Event()
+            workers = [multiprocessing.Process(target=_add_reminders, args=(path, start, MAX_PER_USER * 4))
+                       for _ in range(processes)]
+            for p in workers:
+                p.start()
+            start.set()
+            for p in workers:
+                p.join()
+            storage = SQLiteStorage(path, MAX_PER_USER)
+            count = len(storage.list_reminders(1))
+            storage.close()
+            if count != MAX_PER_USER:
+                errors.append(f'process limit: {count} active reminders, expected {MAX_PER_USER}')
+        print(f'{"sqlite":>8} process limit: {len(errors)} errors')
+        return errors
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_migration(timeout: float = 10) -> list:
+    """Перенос файлового хранилища (JSON или двоичный снимок) с marker в SQLite при первом открытии базы."""
+    errors = []
+    for snapshot_format in ('json', 'binary'):
+        workdir = tempfile.mkdtemp(prefix='maxon-migrate-')
+        try:
+            json_path = os.path.join(workdir, 'reminders.json')
+            source = Storage(json_path, MAX_PER_USER, snapshot_format=snapshot_format)
+            source.add_transaction(1, -100, 'food', 1_000_000)
+            source.add_reminder(1, 2_000_000, 'r')
+            source.set_marker(42)
+            source.close()
+
+            opened = []
+            failed = []
+
+            def migrate():
+                try:
+                    opened.append(SQLiteStorage(os.path.join(workdir, 'reminders.db'), MAX_PER_USER, migrate_from=json_path))
+                except Exception as e:
+                    failed.append(e)
+
+            th = threading.Thread(target=migrate, daemon=True)
+            th.start()
+            th.join(timeout)
+            if failed:
+                errors.append(f'migration ({snapshot_format}): {failed[0]!r}')
+                continue
+            if not opened:
+                errors.append(f'migration ({snapshot_format}): not finished in {timeout:.0f}s')
+                continue
+            storage = opened[0]
+            if storage.get_marker() != 42:
+                errors.append(f'migration ({snapshot_format}): marker {storage.get_marker()!r}, expected 42')
+            if len(storage.get_transactions(1)) != 1 or len(storage.list_reminders(1)) != 1:
+                errors.append(f'migration ({snapshot_format}): data not migrated')
+            storage.close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print(f'{"sqlite":>8} migration: {len(errors)} errors')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--engines', default='json,journal,sqlite')
+    parser.add_argument('--policy', default='immediate', choices=('immediate', 'interval', 'count'))
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=300, help='операций записи на поток-писатель')
+    args = parser.parse_args()
+
+    errors = []
+    for engine in args.engines.split(','):
+        errors += run(engine, args.writers, args.readers, args.ops, args.policy)
+        errors += check_batch_isolation(engine)
+    if 'journal' in args.engines.split(','):
+        errors += check_replay()
+    if 'sqlite' in args.engines.split(','):
+        errors += check_rollback()
+        errors += check_process_limit()
+        errors += check_migration()
+    for err in errors[:20]:
+        print('ERROR', err)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
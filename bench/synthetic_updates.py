@@ -0,0 +1,89 @@
+"""
+Генератор синтетических обновлений Max для нагрузочных тестов: напоминания одной
+строкой и в два шага (время, затем текст), транзакции +N/-N с категорией, запросы
+/cash и нажатия inline-кнопок. Последовательность воспроизводима (seed).
+"""
+
+import random
+import time
+from typing import Iterator, List
+
+CATEGORIES = ('Продукты', 'Такси', 'Кафе', 'Зарплата', 'Подработка', 'Связь')
+REMINDER_TEXTS = ('Покормить кота', 'Позвонить маме', 'Оплатить счет', 'Встреча', 'Выпить воды')
+CASH_QUERIES = ('/cash', '/cash day', '/cash week', '/cash month', '/cash sum', '/cash sum year')
+
+# Доли видов обновлений по умолчанию
+DEFAULT_MIX = {
+    'transaction': 40,
+    'reminder': 15,
+    'time': 10,
+    'cash': 20,
+    'callback': 10,
+    'command': 5,
+}
+
+
+class UpdateGenerator:
+    def __init__(self, users: int, seed: int = 1, mix: dict = None, first_user_id: int = 1000):
+        self.users = users
+        self.first_user_id = first_user_id
+        self._random = random.Random(seed)
+        kinds = mix or DEFAULT_MIX
+        self._kinds = list(kinds)
+        self._weights = [kinds[k] for k in self._kinds]
+        self._seq = 0
+
+    def _next_id(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def message(self, user_id: int, text: str) -> dict:
+        return {
+            'update_type': 'message_created',
+            'timestamp': int(time.time() * 1000),
+            'message': {
+                'sender': {'user_id': user_id},
+                'recipient': {'chat_id': user_id},
+                'body': {'mid': f'bench.{self._next_id()}', 'text': text},
+            },
+        }
+
+    def callback(self, user_id: int, payload: str = 'bench') -> dict:
+        return {
+            'update_type': 'message_callback',
+            'timestamp': int(time.time() * 1000),
+            'callback': {'callback_id': f'bench.{self._next_id()}', 'payload': payload, 'user': {'user_id': user_id}},
+        }
+
+    def _reminder_time(self) -> str:
+        rnd = self._random
+        return f'{rnd.randrange(24):02d}:{rnd.randrange(60):02d}'
+
+    def user_updates(self, user_id: int, kind: str) -> List[dict]:
+        """Обновления одного действия пользователя (двухшаговые сценарии — два обновления)."""
+        rnd = self._random
+        if kind == 'transaction':
+            amount = rnd.randint(1, 5000)
+            sign = '+' if rnd.random() < 0.3 else '-'
+            if rnd.random() < 0.8:
+                return [self.message(user_id, f'{sign}{amount} {rnd.choice(CATEGORIES)}')]
+            return [self.message(user_id, f'{sign}{amount}'), self.message(user_id, rnd.choice(CATEGORIES))]
+        if kind == 'reminder':
+            return [self.message(user_id, f'{self._reminder_time()} {rnd.choice(REMINDER_TEXTS)}')]
+        if kind == 'time':
+            return [self.message(user_id, self._reminder_time()), self.message(user_id, rnd.choice(REMINDER_TEXTS))]
+        if kind == 'cash':
+            return [self.message(user_id, rnd.choice(CASH_QUERIES))]
+        if kind == 'callback':
+            return [self.callback(user_id)]
+        return [self.message(user_id, rnd.choice(('/help', '/time', '/note', '/gettz')))]
+
+    def generate(self, count: int) -> Iterator[dict]:
+        """Не меньше count обновлений от случайных пользователей в случайном порядке действий."""
+        produced = 0
+        while produced < count:
+            user_id = self.first_user_id + self._random.randrange(self.users)
+            kind = self._random.choices(self._kinds, self._weights)[0]
+            for update in self.user_updates(user_id, kind):
+                produced += 1
+                yield update
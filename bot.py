@@ -1,73 +1,80 @@
-import json
+import functools
+import queue
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import requests
 from dateutil import tz
 import os
 import logging
 import re
+import signal
+import sys
+
+import recurrence
+import startup
+from config import access_token, api_base, load_config
+from dedupe import SeenUpdates, update_key
+from delivery import ReminderDelivery
+from dispatcher import UpdateDispatcher, update_user_id
+from leader import LeaderLease
+from metrics import Histogram
+from router import Context, Router, split_command
+from max_api import MaxApiClient
+from storage import Storage, open_storage
+from timezones import local_time_formatter, tz_to_utc_offset, utc_offset_to_tz
+
+cfg = load_config()
 
-from storage import Storage
+# базовое логирование
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+logger = logging.getLogger(__name__)
 
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
+_api = None
+_api_lock = threading.Lock()
+
+
+def get_api() -> MaxApiClient:
+    """Общий клиент Max API: пул keep-alive соединений и повторы с учетом 429 (создается при первом обращении)."""
+    global _api
+    if _api is None:
+        with _api_lock:
+            if _api is None:
+                _api = MaxApiClient(
+                    api_base(),
+                    access_token(),
+                    pool_size=cfg.get('api_pool_size', 10),
+                    max_retries=cfg.get('api_max_retries', 3),
+                    backoff_seconds=cfg.get('api_backoff_seconds', 0.5),
+                )
+    return _api
 
-with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
-    cfg = json.load(f)
 
-API_BASE = 'https://platform-api.max.ru'
-# Предпочтительно использовать переменную окружения для токена (не храните токены в репозитории)
-TOKEN = os.environ.get('MAX_ACCESS_TOKEN') or cfg.get('access_token')
-if not TOKEN:
-    print('Ошибка: токен доступа не предоставлен. Установите переменную окружения MAX_ACCESS_TOKEN или добавьте access_token в config.json')
-    raise SystemExit(1)
+UPDATE_SECONDS = Histogram('maxon_update_handle_seconds', 'Время обработки обновления', ('update_type', 'command'))
+# Запас HTTP-таймаута GET /updates сверх времени ожидания обновлений на сервере
+LONG_POLL_TIMEOUT_MARGIN_SECONDS = 5
 
-# базовое логирование
-logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
-logger = logging.getLogger(__name__)
+POLL_BATCH_SIZE = Histogram('maxon_long_poll_batch_size', 'Число обновлений в ответе long-polling',
+                            buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
 
-def utc_offset_to_tz(utc_str: str):
-    """Преобразует строку UTC+N или UTC-N в объект tzoffset."""
-    try:
-        utc_str = utc_str.strip().upper()
-        if utc_str.startswith('UTC'):
-            offset_part = utc_str[3:]
-            if offset_part.startswith('+'):
-                offset_part = offset_part[1:]
-            if ':' in offset_part:
-                hours, minutes = offset_part.split(':')
-                total_seconds = int(hours) * 3600 + int(minutes) * 60 * (1 if int(hours) >= 0 else -1)
-            else:
-                total_seconds = int(offset_part) * 3600
-            return tz.tzoffset(None, total_seconds)
-        return tz.gettz(utc_str)
-    except Exception:
-        return None
+# Вызовы Max API из обработчиков пачки long-polling: копятся в потоке-обработчике и
+# выполняются после сохранения пачки (Bot.process_batch), чтобы транзакция не ждала сеть
+_outbox = threading.local()
 
 
-def tz_to_utc_offset(tz_str: str) -> str:
-    """Преобразует строку временной зоны IANA или UTC+N в формат UTC+N."""
-    try:
-        if tz_str.upper().startswith('UTC'):
-            return tz_str.upper()
-        tz_obj = tz.gettz(tz_str)
-        if not tz_obj:
-            return tz_str
-        now_utc = datetime.now(tz=tz.tzutc())
-        now_local = now_utc.astimezone(tz_obj)
-        offset = now_local.utcoffset().total_seconds() / 3600
-        offset_int = int(offset)
-        if offset == offset_int:
-            return f"UTC+{offset_int}" if offset_int >= 0 else f"UTC{offset_int}"
-        else:
-            minutes = int((offset - offset_int) * 60)
-            return f"UTC+{offset_int}:{minutes:02d}" if offset_int >= 0 else f"UTC{offset_int}:{minutes:02d}"
-    except Exception:
-        return tz_str
+def _deferred_in_batch(fn):
+    """Внутри пачки long-polling вызов откладывается (возвращает None), вне ее выполняется сразу."""
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        calls = getattr(_outbox, 'calls', None)
+        if calls is None:
+            return fn(*args, **kwargs)
+        calls.append(functools.partial(fn, *args, **kwargs))
+    return call
 
 
+@_deferred_in_batch
 def send_message(chat_id=None, user_id=None, text='', attachments=None, fmt=None):
-    url = API_BASE + '/messages'
     params = {}
     if chat_id:
         params['chat_id'] = chat_id
@@ -79,8 +86,7 @@ def send_message(chat_id=None, user_id=None, text='', attachments=None, fmt=None
     if fmt in ('markdown', 'html'):
         body['format'] = fmt
     try:
-        headers = {'Authorization': TOKEN}
-        resp = requests.post(url, params=params, json=body, headers=headers, timeout=10)
+        resp = get_api().post('/messages', params=params, json=body)
         if resp.status_code != 200:
             logger.warning('send_message failed %s %s', resp.status_code, resp.text)
         else:
@@ -91,9 +97,9 @@ def send_message(chat_id=None, user_id=None, text='', attachments=None, fmt=None
         return None
 
 
+@_deferred_in_batch
 def answer_callback(callback_id: str, message_body: dict = None, notification: str = None):
     """Отправить ответ на callback: опционально отредактировать сообщение и/или отправить одноразовое уведомление."""
-    url = API_BASE + '/answers'
     params = {'callback_id': callback_id}
     body = {}
     if message_body is not None:
@@ -101,8 +107,7 @@ def answer_callback(callback_id: str, message_body: dict = None, notification: s
     if notification is not None:
         body['notification'] = notification
     try:
-        headers = {'Authorization': TOKEN}
-        resp = requests.post(url, params=params, json=body, headers=headers, timeout=10)
+        resp = get_api().post('/answers', params=params, json=body)
         if resp.status_code != 200:
             logger.warning('answer_callback failed %s %s', resp.status_code, resp.text)
         else:
@@ -135,33 +140,445 @@ def build_main_keyboard(notifications_on: bool, transactions_on: bool):
     return attachments
 
 
+def format_summary(totals: dict) -> str:
+    """Текст итогов /cash sum: доходы, расходы, баланс и строки по категориям."""
+    if not totals:
+        return 'Нет транзакций'
+    income = sum(t[0] for t in totals.values())
+    expense = sum(t[1] for t in totals.values())
+    count = sum(t[2] for t in totals.values())
+    balance = income + expense
+    lines = [
+        f'Доходы: +{income}',
+        f'Расходы: -{abs(expense)}',
+        f"Баланс: {'+' if balance >= 0 else '-'}{abs(balance)} ({count} транзакций)",
+        '',
+    ]
+    for category, (cat_income, cat_expense, cat_count) in sorted(totals.items(), key=lambda item: -(item[1][0] - item[1][1])):
+        amount = cat_income + cat_expense
+        lines.append(f"{category}: {'+' if amount >= 0 else '-'}{abs(amount)} ({cat_count})")
+    return '\n'.join(lines)
+
+
+# Обработчики обновлений: команды выбираются по первому слову, остальные сообщения
+# проверяются по порядку (транзакция, категория, время, напоминание одной строкой, текст)
+router = Router()
+
+TRANSACTION_RE = re.compile(r'^([+-])(\d+)(?:\s+(.+))?$')
+TIME_TEXT_RE = re.compile(r'^(\d{1,2}:\d{2})\s+(.+)$')
+# Принимаются форматы dd.mm.yy и dd-mm-yy, а также диапазоны с опциональными пробелами вокруг '-'
+DATE_RE = re.compile(r'^(\d{1,2})([.-])(\d{1,2})\2(\d{2,4})$')
+DATE_RANGE_RE = re.compile(r'^(\d{1,2}([.-])\d{1,2}\2\d{2,4})\s*-\s*(\d{1,2}([.-])\d{1,2}\4\d{2,4})$')
+
+HELP_TEXT = (
+    "Доступные команды:\n"
+    "/help — показать это сообщение\n"
+    "/time или /now — показать текущее время\n"
+    "/note — показать ваши активные напоминания (только при notifications on)\n"
+    "/notedel N — удалить напоминание с номером N (только при notifications on)\n"
+    "/cash [day|week|month|year|dd-mm-yy|dd-mm-yy - dd-mm-yy] — показать историю транзакций (только при transactions on)\n"
+    "/cash sum [day|week|month|year|dd-mm-yy|dd-mm-yy - dd-mm-yy] — итоги по категориям за период (по умолчанию month)\n"
+    "/settz <UTC+N> — установить временную зону (пример: /settz UTC+3)\n"
+    "/gettz — показать вашу временную зону\n"
+    "/main — управление функционалом (Уведомления, Транзакции)\n\n"
+    "Создание напоминаний (notifications on):\n"
+    "• 16:30 Покормить кота — одной строкой\n"
+    "• 16:30 — затем следующим сообщением текст\n"
+    "• 09:00 по будням Зарядка — повторяющееся (ежедневно, по будням, еженедельно [пн..вс], ежемесячно [1..31])\n"
+    "Форматы времени: hh:mm | hh:mm dd-mm | hh:mm dd-mm-yyyy\n\n"
+    "Финансовые транзакции (transactions on):\n"
+    "• +300 Продукты — одной строкой\n"
+    "• +300 — затем следующим сообщением категория\n"
+    "Отрицательные значения для расходов: -200 Такси"
+)
+
+
+def update_command(update: dict) -> str:
+    """Вид сообщения для метрик: команда, 'transaction' (+N/-N) или 'text'."""
+    if update.get('update_type') != 'message_created':
+        return ''
+    text = (((update.get('message') or {}).get('body') or {}).get('text') or '').strip()
+    token, _ = split_command(text)
+    if token.startswith('/'):
+        # незарегистрированные команды сводятся к одной метке, чтобы не плодить ряды
+        return token if token in router.commands else '/other'
+    if TRANSACTION_RE.match(text):
+        return 'transaction'
+    return 'text'
+
+
+def user_tz_str(ctx: Context) -> str:
+    return ctx.state['tz'] or cfg.get('timezone', 'UTC+3')
+
+
+def user_tz(ctx: Context, fallback):
+    """Часовой пояс пользователя (из кэша хранилища), иначе глобальный из конфигурации, иначе fallback."""
+    return ctx.storage.get_user_tzinfo(ctx.user_id) or utc_offset_to_tz(cfg.get('timezone', 'UTC+3')) or fallback
+
+
+def main_menu_text(notif: bool, trans: bool) -> str:
+    return (
+        "Главное меню\n\n"
+        f"Уведомления: {'on' if notif else 'off'}\n"
+        f"Транзакции: {'on' if trans else 'off'}\n\n"
+        "Нажмите кнопку, чтобы переключить"
+    )
+
+
+@router.command('/note', exact=True)
+def note_command(ctx: Context):
+    if not ctx.feature('notifications'):
+        send_message(user_id=ctx.user_id, text='Функционал уведомлений отключен')
+        return
+    items = ctx.storage.list_reminders(ctx.user_id)
+    if not items:
+        send_message(user_id=ctx.user_id, text='Нет напоминаний')
+        return
+    local_time = local_time_formatter(user_tz(ctx, tz.tzlocal()))
+    lines = []
+    for i, it in enumerate(items, 1):
+        ts = local_time(it['time'])
+        if it.get('repeat'):
+            # правило и ближайшее срабатывание
+            lines.append(f"{i}. {ts.strftime('%H:%M')} {recurrence.describe(it['repeat'])} "
+                         f"(след. {ts.strftime('%d.%m')}) — {it['text']}")
+        else:
+            lines.append(f"{i}. {ts.strftime('%H:%M')} — {it['text']}")
+    send_message(user_id=ctx.user_id, text='\n'.join(lines))
+
+
+@router.command('/notedel')
+def notedel_command(ctx: Context):
+    if not ctx.feature('notifications'):
+        send_message(user_id=ctx.user_id, text='Функционал уведомлений отключен')
+        return
+    parts = ctx.args.split()
+    if parts and parts[0].isdigit():
+        ok = ctx.storage.delete_reminder_by_index(ctx.user_id, int(parts[0]) - 1)
+        send_message(user_id=ctx.user_id, text='Удалено' if ok else 'Не найдено')
+    else:
+        send_message(user_id=ctx.user_id, text='Использование: /notedel N')
+
+
+@router.command('/time', '/now', exact=True)
+def time_command(ctx: Context):
+    """Текущее время в часовом поясе пользователя."""
+    now_local = datetime.now(tz=tz.tzutc()).astimezone(user_tz(ctx, tz.tzutc()))
+    send_message(user_id=ctx.user_id, text=now_local.strftime('%H:%M'))
+
+
+@router.command('/settz')
+def settz_command(ctx: Context):
+    if not ctx.args:
+        send_message(user_id=ctx.user_id, text='Использование: /settz UTC+3 или /settz UTC-5')
+        return
+    if not utc_offset_to_tz(ctx.args):
+        send_message(user_id=ctx.user_id, text='Неверная временная зона. Примеры: UTC+3, UTC-5, UTC+5:30')
+        return
+    ctx.storage.set_user_tz(ctx.user_id, ctx.args)
+    send_message(user_id=ctx.user_id, text=f'Временная зона установлена: {ctx.args}')
+
+
+@router.command('/gettz', exact=True)
+def gettz_command(ctx: Context):
+    if ctx.state['tz']:
+        send_message(user_id=ctx.user_id, text=f"Ваша временная зона: {tz_to_utc_offset(ctx.state['tz'])}")
+        return
+    global_tz = cfg.get("timezone", "UTC+3")
+    utc_offset = tz_to_utc_offset(global_tz) if not global_tz.startswith('UTC') else global_tz
+    send_message(user_id=ctx.user_id, text=f'Используется глобальная временная зона: {utc_offset}')
+
+
+@router.command('/help', exact=True)
+def help_command(ctx: Context):
+    """Список доступных команд и форматов."""
+    send_message(user_id=ctx.user_id, text=HELP_TEXT)
+
+
+@router.command('/main')
+def main_command(ctx: Context):
+    """Флаги функций: /main (меню с кнопками) или /main <feature> on|off."""
+    parts = ctx.args.split()
+    if not parts:
+        notif = ctx.feature('notifications')
+        trans = ctx.feature('transactions')
+        send_message(user_id=ctx.user_id, text=main_menu_text(notif, trans), attachments=build_main_keyboard(notif, trans))
+        return
+    if len(parts) < 2:
+        # /main с одним аргументом — не команда, сообщение обрабатывается дальше
+        return False
+    feature, val = parts[0].lower(), parts[1].lower()
+    if feature not in ('notifications', 'transactions'):
+        send_message(user_id=ctx.user_id, text='Неверный флаг. Допустимо: notifications, transactions')
+        return
+    if val in ('on', '1', 'true'):
+        ctx.storage.set_feature(feature, True)
+        send_message(user_id=ctx.user_id, text=f'{feature} включен')
+        return
+    if val in ('off', '0', 'false'):
+        ctx.storage.set_feature(feature, False)
+        send_message(user_id=ctx.user_id, text=f'{feature} отключен')
+        return
+    send_message(user_id=ctx.user_id, text='Использование: /main <feature> on|off')
+
+
+def _parse_date(match, user_tz):
+    d, _, mo, y = match.groups()
+    year = int(y)
+    return datetime(2000 + year if year < 100 else year, int(mo), int(d), tzinfo=user_tz)
+
+
+def cash_period(arg: str, now_local: datetime, user_tz):
+    """Границы периода /cash в часовом поясе пользователя; ValueError при неверном формате."""
+    start_of_day = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
+    if arg in ('day', 'сегодня'):
+        return start_of_day, now_local
+    if arg == 'week':
+        # понедельник = 0
+        return start_of_day - timedelta(days=now_local.weekday()), now_local
+    if arg == 'month':
+        return start_of_day.replace(day=1), now_local
+    if arg == 'year':
+        return start_of_day.replace(month=1, day=1), now_local
+    m_range = DATE_RANGE_RE.match(arg)
+    if m_range:
+        end = _parse_date(DATE_RE.match(m_range.group(3)), user_tz)
+        return _parse_date(DATE_RE.match(m_range.group(1)), user_tz), end.replace(hour=23, minute=59, second=59, microsecond=999000)
+    m = DATE_RE.match(arg)
+    if not m:
+        raise ValueError('bad date')
+    return _parse_date(m, user_tz), now_local
+
+
+@router.command('/cash')
+def cash_command(ctx: Context):
+    """/cash [sum] [day|week|month|year|dd-mm-yy|dd-mm-yy - dd-mm-yy]"""
+    if not ctx.feature('transactions'):
+        send_message(user_id=ctx.user_id, text='Функционал транзакций отключен')
+        return
+    cash_tz = user_tz(ctx, tz.tzlocal())
+    arg = ctx.args
+    # /cash sum <период>: итоги по категориям вместо списка транзакций
+    summary = False
+    if arg and arg.lower().split()[0] in ('sum', 'итого'):
+        summary = True
+        sum_parts = arg.split(maxsplit=1)
+        arg = sum_parts[1] if len(sum_parts) > 1 else 'month'
+    if not arg:
+        # по умолчанию: последние 10 записей
+        tx = ctx.storage.get_transactions(ctx.user_id, limit=10)
+    else:
+        try:
+            start_local, end_local = cash_period(arg.strip().lower(), datetime.now(tz=cash_tz), cash_tz)
+        except Exception:
+            send_message(user_id=ctx.user_id, text='Неверный формат. Примеры: day | week | month | year | 01-10-25 | 01-10-25 - 14-10-25')
+            return
+        start_ms = int(start_local.astimezone(tz.tzutc()).timestamp() * 1000)
+        end_ms = int(end_local.astimezone(tz.tzutc()).timestamp() * 1000)
+        if summary:
+            send_message(user_id=ctx.user_id, text=format_summary(ctx.storage.get_transaction_summary(ctx.user_id, start_ms, end_ms)))
+            return
+        # хранилище возвращает диапазон уже отсортированным по времени
+        tx = ctx.storage.get_transactions_in_range(ctx.user_id, start_ms, end_ms)[::-1]
+    if not tx:
+        send_message(user_id=ctx.user_id, text='Нет транзакций')
+        return
+    local_time = local_time_formatter(cash_tz)
+    lines = []
+    for t in tx:
+        ts = local_time(t['timestamp'])
+        amount_str = f"+{t['amount']}" if t['amount'] > 0 else f"-{abs(t['amount'])}"
+        lines.append(f"{ts.strftime('%d.%m')} {amount_str} — {t['category']}")
+    send_message(user_id=ctx.user_id, text='\n'.join(lines))
+
+
+@router.pattern(TRANSACTION_RE)
+def transaction_message(ctx: Context):
+    """Транзакция: +300 [Категория] или -200 [Категория]."""
+    if not ctx.feature('transactions'):
+        send_message(user_id=ctx.user_id, text='Функционал транзакций отключен')
+        return
+    sign, amount, category = ctx.match.groups()
+    amount = int(amount) if sign == '+' else -int(amount)
+    if category:
+        timestamp_ms = int(datetime.now(tz=tz.tzutc()).timestamp() * 1000)
+        ctx.storage.add_transaction(ctx.user_id, amount, category.strip(), timestamp_ms)
+        send_message(user_id=ctx.user_id, text=f'Транзакция записана: {sign}{abs(amount)} ({category.strip()})')
+        return
+    ctx.storage.set_pending_transaction_amount(ctx.user_id, amount)
+    send_message(user_id=ctx.user_id, text='Укажите категорию (например, "Подработка" или "Продукты")')
+
+
+@router.pattern()
+def transaction_category(ctx: Context):
+    """Категория для суммы, отправленной предыдущим сообщением."""
+    amount = ctx.state['pending_transaction']
+    if amount is None:
+        return False
+    if not ctx.feature('transactions'):
+        ctx.storage.clear_pending_transaction(ctx.user_id)
+        send_message(user_id=ctx.user_id, text='Функционал транзакций отключен — транзакция отменена')
+        return
+    timestamp_ms = int(datetime.now(tz=tz.tzutc()).timestamp() * 1000)
+    with ctx.storage.batch():
+        ctx.storage.add_transaction(ctx.user_id, amount, ctx.text, timestamp_ms)
+        ctx.storage.clear_pending_transaction(ctx.user_id)
+    sign = '+' if amount > 0 else '-'
+    send_message(user_id=ctx.user_id, text=f'Транзакция записана: {sign}{abs(amount)} ({ctx.text})')
+
+
+# try_parse_time принимает только «часы:минуты [дата] [правило]»: остальной текст отсекается без разбора
+@router.pattern(r'^[+-]?\d[\d_]*:')
+def reminder_time(ctx: Context):
+    """Время напоминания (и правило повторения); текст придет следующим сообщением."""
+    parsed = try_parse_time(ctx.text, user_tz_str(ctx))
+    if not parsed:
+        return False
+    if not ctx.feature('notifications'):
+        send_message(user_id=ctx.user_id, text='Функционал уведомлений отключен')
+        return
+    ctx.storage.set_pending_text(ctx.user_id, *parsed)
+    send_message(user_id=ctx.user_id, text='Отправьте текст напоминания в следующем сообщении')
+
+
+@router.pattern(TIME_TEXT_RE)
+def reminder_inline(ctx: Context):
+    """Напоминание одной строкой: HH:MM [правило] <текст>."""
+    if not ctx.feature('notifications'):
+        send_message(user_id=ctx.user_id, text='Функционал уведомлений отключен')
+        return
+    spec, text = recurrence.split_spec(ctx.match.group(2).strip())
+    parsed = try_parse_time(f'{ctx.match.group(1)} {spec}', user_tz_str(ctx))
+    if not parsed:
+        return False
+    dt, repeat = parsed
+    dt_ms = int(dt.astimezone(tz.tzutc()).timestamp() * 1000)
+    success, msg = ctx.storage.add_reminder(ctx.user_id, dt_ms, text, repeat)
+    send_message(user_id=ctx.user_id, text=msg)
+
+
+@router.pattern()
+def reminder_text(ctx: Context):
+    """Текст напоминания для времени, отправленного предыдущим сообщением."""
+    pending = ctx.state['pending']
+    if not pending:
+        return False
+    if not ctx.feature('notifications'):
+        ctx.storage.clear_pending(ctx.user_id)
+        send_message(user_id=ctx.user_id, text='Функционал уведомлений отключен — создание отменено')
+        return
+    with ctx.storage.batch():
+        success, msg = ctx.storage.add_reminder(ctx.user_id, int(pending.timestamp() * 1000), ctx.text,
+                                                ctx.state['pending_repeat'])
+        ctx.storage.clear_pending(ctx.user_id)
+    send_message(user_id=ctx.user_id, text=msg)
+
+
+@router.callback('toggle')
+def toggle_callback(ctx: Context):
+    """Кнопки /main: переключить функцию и обновить сообщение с меню."""
+    cb_id = ctx.callback.get('callback_id') or ctx.callback.get('id')
+    feature = (ctx.callback.get('payload') or ctx.callback.get('data')).partition(':')[2]
+    if not cb_id or feature not in ('notifications', 'transactions'):
+        return False
+    ctx.storage.set_feature(feature, not ctx.feature(feature))
+    notif = ctx.storage.get_feature('notifications')
+    trans = ctx.storage.get_feature('transactions')
+    answer_callback(cb_id, message_body={'text': main_menu_text(notif, trans), 'attachments': build_main_keyboard(notif, trans)})
+
+
+@router.callback()
+def unknown_callback(ctx: Context):
+    """Неизвестный payload: подтвердить молча, чтобы убрать загрузчик."""
+    cb_id = ctx.callback.get('callback_id') or ctx.callback.get('id')
+    if cb_id:
+        answer_callback(cb_id, message_body=None, notification=None)
+
+
 class Bot:
-    def __init__(self, storage: Storage):
+    def __init__(self, storage: Storage, router: Router = router):
         self.storage = storage
+        # обработчики обновлений (по умолчанию — команды бота, см. router выше)
+        self.router = router
+        # Позиция опроса (может опережать обработку) и ее поколение: откат опроса после
+        # ошибки пачки меняет поколение, и уже полученные следом пачки отбрасываются
         self.marker = None
+        self._poll_generation = 0
+        self._poll_lock = threading.Lock()
+        # marker последней пачки, сохраненной этим процессом
+        self._saved_marker = None
+        # уже принятые обновления (общий кэш для long-polling и webhook; с SQLite — общий
+        # для всех процессов, иначе повтор, доставленный другому воркеру, обработался бы дважды)
+        self.seen_updates = SeenUpdates(
+            max_size=cfg.get('dedupe_max_size', 10000),
+            ttl_seconds=cfg.get('dedupe_ttl_seconds', 3600),
+            store=storage if cfg.get('storage_engine', 'json') == 'sqlite' else None,
+        )
+        # пачка хранилища текущей пачки long-polling (к ней присоединяются потоки обработки)
+        # и ее отложенные вызовы API: (user_id, [вызов, ...])
+        self._batch = None
+        self._outgoing = []
+        self._outgoing_lock = threading.Lock()
+        self._senders = ThreadPoolExecutor(max_workers=max(1, cfg.get('long_poll_workers', 4)),
+                                           thread_name_prefix='long-poll-send')
 
     def long_poll(self):
-        url = API_BASE + '/updates'
+        """
+        Получение обновлений конвейером: поток опроса запрашивает следующую пачку, пока
+        текущая обрабатывается; обновления разных пользователей обрабатываются параллельно
+        (одного пользователя — по порядку), изменения хранилища от пачки сохраняются вместе.
+        """
+        # продолжить с последней сохраненной пачки: обработанное не повторяется, необработанное не теряется
+        if self.marker is None:
+            self.marker = self.storage.get_marker()
+            if self.marker is not None:
+                logger.info('Resuming long polling from marker %s', self.marker)
+        self._saved_marker = self.marker
+        # не больше long_poll_prefetch пачек впереди обработки: при отставании опрос ждет
+        batches = queue.Queue(maxsize=max(1, cfg.get('long_poll_prefetch', 1)))
+        threading.Thread(target=self._poll_updates, args=(batches,), name='long-poll', daemon=True).start()
+        dispatcher = UpdateDispatcher(
+            self._handle_in_batch,
+            workers=cfg.get('long_poll_workers', 4),
+            queue_size=cfg.get('webhook_queue_size', 1000),
+        )
+        dispatcher.start()
+        while True:
+            generation, updates, marker = batches.get()
+            if generation != self._poll_generation:
+                # получена до отката опроса: будет получена заново
+                continue
+            try:
+                self.process_batch(updates, dispatcher, marker)
+            except Exception:
+                logger.exception('Error processing long poll batch')
+                time.sleep(2)
+
+    def _poll_updates(self, batches: queue.Queue):
         while True:
+            with self._poll_lock:
+                generation, position = self._poll_generation, self.marker
             params = {'timeout': cfg.get('updates_timeout_seconds', 30)}
-            if self.marker is not None:
-                params['marker'] = self.marker
+            if position is not None:
+                params['marker'] = position
             try:
                 logger.debug('Long polling %s', params)
-                headers = {'Authorization': TOKEN}
-                r = requests.get(url, params=params, headers=headers, timeout=cfg.get('updates_timeout_seconds', 35))
+                # запас сверх времени ожидания на сервере, иначе пустой ответ обрывается таймаутом
+                r = get_api().get('/updates', params=params, timeout=params['timeout'] + LONG_POLL_TIMEOUT_MARGIN_SECONDS)
                 if r.status_code == 200:
                     data = r.json()
                     updates = data.get('updates', [])
+                    POLL_BATCH_SIZE.observe(len(updates))
                     logger.info('Received %d updates (marker=%s)', len(updates), data.get('marker'))
                     if updates:
-                        for u in updates:
-                            try:
-                                logger.debug('Update: %s', u)
-                                self.handle_update(u)
-                            except Exception:
-                                logger.exception('Error handling update')
-                        self.marker = data.get('marker', self.marker)
+                        # в хранилище marker попадает только вместе с обработанной пачкой
+                        marker = data.get('marker', position)
+                        with self._poll_lock:
+                            if generation != self._poll_generation:
+                                # опрос откатан, пока шел запрос: ответ получен со старой позиции
+                                continue
+                            self.marker = marker
+                        batches.put((generation, updates, marker))
                 else:
                     logger.warning('Long poll returned %s: %s', r.status_code, r.text[:200])
                     time.sleep(1)
@@ -169,341 +586,124 @@ class Bot:
                 logger.exception('Exception in long_poll')
                 time.sleep(2)
 
+    def process_batch(self, updates: list, dispatcher: UpdateDispatcher, marker=None):
+        """
+        Обработать пачку пулом потоков и сохранить изменения хранилища одной записью
+        вместе с marker пачки: после перезапуска опрос продолжится со следующей пачки,
+        а пачка, не успевшая сохраниться, будет получена и обработана заново целиком.
+        Ответы пользователям отправляются после сохранения: запись (для sqlite — транзакция,
+        блокирующая другие процессы) не ждет сетевых запросов, а ответ не подтверждает
+        несохраненное изменение. Обновления пачки запоминаются как принятые тоже после него.
+        """
+        self._outgoing = []
+        keys = set()
+        try:
+            with self.storage.batch() as self._batch:
+                try:
+                    for u in updates:
+                        key = update_key(u)
+                        if (key is None or key not in keys) and self.seen_updates.claim(key):
+                            keys.add(key)
+                            dispatcher.submit(u, block=True)
+                        else:
+                            logger.info('Skipping duplicate update %s', key)
+                finally:
+                    # потоки обработки присоединены к пачке: она закрывается только после них
+                    dispatcher.join()
+                if marker is not None:
+                    self.storage.set_marker(marker)
+        except Exception:
+            saved = self._stored_marker()
+            if marker is None or saved != marker:
+                # изменения пачки не сохранились (sqlite откатывает транзакцию): получить
+                # ее заново; ответы отправит повторная обработка
+                self._outgoing = []
+                self._rewind_polling(saved)
+                raise
+            # файловые движки: изменения и marker пачки остались в памяти, на диск
+            # их запишет следующий полный снимок — пачка считается обработанной
+            logger.exception('Failed to save long poll batch, changes are kept in memory')
+        if marker is not None:
+            self._saved_marker = marker
+        self.seen_updates.remember(keys)
+        self._send_outgoing()
+
+    def _stored_marker(self):
+        """marker в хранилище; если его не прочитать — последний сохраненный этим процессом."""
+        try:
+            return self.storage.get_marker()
+        except Exception:
+            logger.exception('Failed to read long polling marker')
+            return self._saved_marker
+
+    def _rewind_polling(self, marker):
+        """Продолжить опрос с marker; пачки, полученные до отката, отбрасываются."""
+        with self._poll_lock:
+            self._poll_generation += 1
+            self.marker = marker
+        logger.warning('Long polling rewound to marker %s', marker)
+
+    def _handle_in_batch(self, update):
+        """
+        Обработчик пачки long-polling: изменения хранилища входят в пачку, а вызовы API
+        обработчика копятся до ее сохранения.
+        """
+        _outbox.calls = []
+        try:
+            with self.storage.batch(self._batch):
+                self.handle_update(update)
+        finally:
+            calls, _outbox.calls = _outbox.calls, None
+            if calls:
+                with self._outgoing_lock:
+                    self._outgoing.append((update_user_id(update), calls))
+
+    def _send_outgoing(self):
+        """Выполнить отложенные вызовы: пользователи параллельно, вызовы одного пользователя — по порядку."""
+        by_user = {}
+        for user_id, calls in self._outgoing:
+            by_user.setdefault(user_id, []).extend(calls)
+        self._outgoing = []
+        for f in [self._senders.submit(self._run_calls, calls) for calls in by_user.values()]:
+            f.result()
+
+    @staticmethod
+    def _run_calls(calls: list):
+        for call in calls:
+            try:
+                call()
+            except Exception:
+                logger.exception('Deferred API call failed')
+
     def handle_update(self, update):
-        ut = update.get('update_type')
-        logger.info('Handle update type=%s', ut)
-        if ut == 'message_created':
-            msg = update.get('message', {})
-            body = msg.get('body', {})
-            text = body.get('text') or ''
-            chat = msg.get('recipient', {})
-            chat_id = chat.get('chat_id')
-            user = msg.get('sender', {})
-            user_id = user.get('user_id')
-
-            # обработка простых команд
-            text_stripped = text.strip()
-            if text_stripped.lower() == '/note':
-                if not self.storage.get_feature('notifications'):
-                    send_message(user_id=user_id, text='Функционал уведомлений отключен')
-                    return
-                items = self.storage.list_reminders(user_id)
-                if not items:
-                    send_message(user_id=user_id, text='Нет напоминаний')
-                else:
-                    lines = []
-                    user_tz_str = self.storage.get_user_tz(user_id) or cfg.get('timezone', 'UTC+3')
-                    user_tz = utc_offset_to_tz(user_tz_str) or tz.tzlocal()
-                    for i, it in enumerate(items, 1):
-                        ts = datetime.fromtimestamp(it['time'] / 1000, tz=tz.tzutc()).astimezone(user_tz)
-                        time_str = ts.strftime('%H:%M')
-                        lines.append(f"{i}. {time_str} — {it['text']}")
-                    send_message(user_id=user_id, text='\n'.join(lines))
-                return
-
-            if text_stripped.lower().startswith('/notedel'):
-                if not self.storage.get_feature('notifications'):
-                    send_message(user_id=user_id, text='Функционал уведомлений отключен')
-                    return
-                parts = text_stripped.split()
-                if len(parts) >= 2 and parts[1].isdigit():
-                    idx = int(parts[1]) - 1
-                    ok = self.storage.delete_reminder_by_index(user_id, idx)
-                    send_message(user_id=user_id, text='Удалено' if ok else 'Не найдено')
-                else:
-                    send_message(user_id=user_id, text='Использование: /notedel N')
-                return
-
-            # Показать текущее время в часовом поясе пользователя
-            if text_stripped.lower() in ('/time', '/now'):
-                now_utc = datetime.now(tz=tz.tzutc())
-                user_tz_str = self.storage.get_user_tz(user_id) or cfg.get('timezone', 'UTC+3')
-                user_tz = utc_offset_to_tz(user_tz_str)
-                if not user_tz:
-                    user_tz = tz.tzutc()
-                now_local = now_utc.astimezone(user_tz)
-                local_time = now_local.strftime('%H:%M')
-                send_message(user_id=user_id, text=local_time)
-                return
-
-            # Команды для часового пояса: /settz <UTC+N> и /gettz
-            if text_stripped.lower().startswith('/settz'):
-                parts = text_stripped.split(maxsplit=1)
-                if len(parts) < 2 or not parts[1]:
-                    send_message(user_id=user_id, text='Использование: /settz UTC+3 или /settz UTC-5')
-                    return
-                tz_candidate = parts[1].strip()
-                if not utc_offset_to_tz(tz_candidate):
-                    send_message(user_id=user_id, text='Неверная временная зона. Примеры: UTC+3, UTC-5, UTC+5:30')
-                    return
-                self.storage.set_user_tz(user_id, tz_candidate)
-                send_message(user_id=user_id, text=f'Временная зона установлена: {tz_candidate}')
-                return
-
-            if text_stripped.lower() == '/gettz':
-                user_tz = self.storage.get_user_tz(user_id)
-                if user_tz:
-                    utc_offset = tz_to_utc_offset(user_tz)
-                    send_message(user_id=user_id, text=f'Ваша временная зона: {utc_offset}')
-                else:
-                    global_tz = cfg.get("timezone", "UTC+3")
-                    utc_offset = tz_to_utc_offset(global_tz) if not global_tz.startswith('UTC') else global_tz
-                    send_message(user_id=user_id, text=f'Используется глобальная временная зона: {utc_offset}')
-                return
-
-            # Команда помощи: список доступных команд и форматов
-            if text_stripped.lower() == '/help':
-                help_text = (
-                    "Доступные команды:\n"
-                    "/help — показать это сообщение\n"
-                    "/time или /now — показать текущее время\n"
-                    "/note — показать ваши активные напоминания (только при notifications on)\n"
-                    "/notedel N — удалить напоминание с номером N (только при notifications on)\n"
-                    "/cash [day|week|month|year|dd-mm-yy|dd-mm-yy - dd-mm-yy] — показать историю транзакций (только при transactions on)\n"
-                    "/settz <UTC+N> — установить временную зону (пример: /settz UTC+3)\n"
-                    "/gettz — показать вашу временную зону\n"
-                    "/main — управление функционалом (Уведомления, Транзакции)\n\n"
-                    "Создание напоминаний (notifications on):\n"
-                    "• 16:30 Покормить кота — одной строкой\n"
-                    "• 16:30 — затем следующим сообщением текст\n"
-                    "Форматы времени: hh:mm | hh:mm dd-mm | hh:mm dd-mm-yyyy\n\n"
-                    "Финансовые транзакции (transactions on):\n"
-                    "• +300 Продукты — одной строкой\n"
-                    "• +300 — затем следующим сообщением категория\n"
-                    "Отрицательные значения для расходов: -200 Такси"
-                )
-                send_message(user_id=user_id, text=help_text)
-                return
-
-            # Команда /main для переключения функций: /main notifications on/off, /main transactions on/off
-            if text_stripped.lower().startswith('/main'):
-                parts = text_stripped.split()
-                if len(parts) == 1:
-                    # показать текущие флаги с inline клавиатурой
-                    notif = self.storage.get_feature('notifications')
-                    trans = self.storage.get_feature('transactions')
-                    text_main = (
-                        "Главное меню\n\n"
-                        f"Уведомления: {'on' if notif else 'off'}\n"
-                        f"Транзакции: {'on' if trans else 'off'}\n\n"
-                        "Нажмите кнопку, чтобы переключить"
-                    )
-                    send_message(user_id=user_id, text=text_main, attachments=build_main_keyboard(notif, trans))
-                    return
-                if len(parts) >= 3:
-                    feature = parts[1].lower()
-                    val = parts[2].lower()
-                    if feature not in ('notifications', 'transactions'):
-                        send_message(user_id=user_id, text='Неверный флаг. Допустимо: notifications, transactions')
-                        return
-                    if val in ('on', '1', 'true'):
-                        self.storage.set_feature(feature, True)
-                        send_message(user_id=user_id, text=f'{feature} включен')
-                        return
-                    if val in ('off', '0', 'false'):
-                        self.storage.set_feature(feature, False)
-                        send_message(user_id=user_id, text=f'{feature} отключен')
-                        return
-                    send_message(user_id=user_id, text='Использование: /main <feature> on|off')
-                    return
-
-            # Транзакции: /cash [day|week|month|year|dd-mm-yy|dd-mm-yy-dd-mm-yy]
-            if text_stripped.lower().startswith('/cash'):
-                if not self.storage.get_feature('transactions'):
-                    send_message(user_id=user_id, text='Функционал транзакций отключен')
-                    return
-                # определить диапазон
-                parts = text_stripped.split(maxsplit=1)
-                user_tz_str = self.storage.get_user_tz(user_id) or cfg.get('timezone', 'UTC+3')
-                user_tz = utc_offset_to_tz(user_tz_str) or tz.tzlocal()
-                now_local = datetime.now(tz=user_tz)
-
-                def start_of_day(dt):
-                    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
-
-                def end_of_day(dt):
-                    return dt.replace(hour=23, minute=59, second=59, microsecond=999000)
-
-                start_local = None
-                end_local = None
-                if len(parts) == 1:
-                    # по умолчанию: последние 10 записей
-                    tx = self.storage.get_transactions(user_id, limit=10)
-                else:
-                    arg = parts[1].strip().lower()
-                    if arg in ('day', 'сегодня'):
-                        start_local = start_of_day(now_local)
-                        end_local = now_local
-                    elif arg == 'week':
-                        dow = now_local.weekday()  # Monday=0
-                        start_local = start_of_day(now_local - timedelta(days=dow))
-                        end_local = now_local
-                    elif arg == 'month':
-                        start_local = start_of_day(now_local.replace(day=1))
-                        end_local = now_local
-                    elif arg == 'year':
-                        start_local = start_of_day(now_local.replace(month=1, day=1))
-                        end_local = now_local
-                    else:
-                        # дата или диапазон дат
-                        try:
-                            # Принимаются форматы dd.mm.yy и dd-mm-yy, а также диапазоны с опциональными пробелами вокруг '-'
-                            date_re = r"^(\d{1,2})([.-])(\d{1,2})\2(\d{2,4})$"
-                            range_re = r"^(\d{1,2}([.-])\d{1,2}\2\d{2,4})\s*-\s*(\d{1,2}([.-])\d{1,2}\4\d{2,4})$"
-                            m_range = re.match(range_re, arg)
-                            if m_range:
-                                left = m_range.group(1)
-                                right = m_range.group(3)
-                                m1 = re.match(date_re, left)
-                                m2 = re.match(date_re, right)
-                                d1, sep1, mo1, y1 = m1.group(1), m1.group(2), m1.group(3), m1.group(4)
-                                d2, sep2, mo2, y2 = m2.group(1), m2.group(2), m2.group(3), m2.group(4)
-                                y1i = int(y1); y2i = int(y2)
-                                y1i = 2000 + y1i if y1i < 100 else y1i
-                                y2i = 2000 + y2i if y2i < 100 else y2i
-                                start_local = datetime(y1i, int(mo1), int(d1), tzinfo=user_tz)
-                                end_local = end_of_day(datetime(y2i, int(mo2), int(d2), tzinfo=user_tz))
-                            else:
-                                m = re.match(date_re, arg)
-                                if not m:
-                                    raise ValueError('bad date')
-                                d, sep, mo, y = m.group(1), m.group(2), m.group(3), m.group(4)
-                                yi = int(y)
-                                yi = 2000 + yi if yi < 100 else yi
-                                start_local = datetime(yi, int(mo), int(d), tzinfo=user_tz)
-                                end_local = now_local
-                        except Exception:
-                            send_message(user_id=user_id, text='Неверный формат. Примеры: day | week | month | year | 01-10-25 | 01-10-25 - 14-10-25')
-                            return
-
-                    if start_local and end_local:
-                        start_ms = int(start_local.astimezone(tz.tzutc()).timestamp() * 1000)
-                        end_ms = int(end_local.astimezone(tz.tzutc()).timestamp() * 1000)
-                        tx = sorted(self.storage.get_transactions_in_range(user_id, start_ms, end_ms), key=lambda x: x['timestamp'], reverse=True)
-                    else:
-                        tx = self.storage.get_transactions(user_id, limit=10)
-
-                if not tx:
-                    send_message(user_id=user_id, text='Нет транзакций')
-                else:
-                    lines = []
-                    for t in tx:
-                        ts = datetime.fromtimestamp(t['timestamp'] / 1000, tz=tz.tzutc()).astimezone(user_tz)
-                        date_str = ts.strftime('%d.%m')
-                        amount_str = f"+{t['amount']}" if t['amount'] > 0 else f"-{abs(t['amount'])}"
-                        lines.append(f"{date_str} {amount_str} — {t['category']}")
-                    send_message(user_id=user_id, text='\n'.join(lines))
-                return
-
-            # Резервные обработчики: транзакции и напоминания
-            # 1) Транзакции: +300 [Категория] или -200 [Категория]
-            trans_match_inline = re.match(r'^([+-])(\d+)(?:\s+(.+))?$', text_stripped)
-            if trans_match_inline:
-                if not self.storage.get_feature('transactions'):
-                    send_message(user_id=user_id, text='Функционал транзакций отключен')
-                    return
-                sign = trans_match_inline.group(1)
-                amount = int(trans_match_inline.group(2))
-                if sign == '-':
-                    amount = -amount
-                category_inline = trans_match_inline.group(3)
-                if category_inline:
-                    timestamp_ms = int(datetime.now(tz=tz.tzutc()).timestamp() * 1000)
-                    self.storage.add_transaction(user_id, amount, category_inline.strip(), timestamp_ms)
-                    send_message(user_id=user_id, text=f'Транзакция записана: {sign}{abs(amount)} ({category_inline.strip()})')
-                    return
-                self.storage.set_pending_transaction_amount(user_id, amount)
-                send_message(user_id=user_id, text='Укажите категорию (например, "Подработка" или "Продукты")')
-                return
-
-            # 2) Ожидание категории транзакции
-            pending_trans_amount = self.storage.get_pending_transaction_amount(user_id)
-            if pending_trans_amount is not None:
-                if not self.storage.get_feature('transactions'):
-                    self.storage.clear_pending_transaction(user_id)
-                    send_message(user_id=user_id, text='Функционал транзакций отключен — транзакция отменена')
-                    return
-                timestamp_ms = int(datetime.now(tz=tz.tzutc()).timestamp() * 1000)
-                self.storage.add_transaction(user_id, pending_trans_amount, text_stripped, timestamp_ms)
-                self.storage.clear_pending_transaction(user_id)
-                sign = '+' if pending_trans_amount > 0 else '-'
-                send_message(user_id=user_id, text=f'Транзакция записана: {sign}{abs(pending_trans_amount)} ({text_stripped})')
-                return
-
-            # 3) Напоминания: разбор времени и опциональный встроенный текст
-            user_tz_for_parse = self.storage.get_user_tz(user_id) or cfg.get('timezone', 'UTC+3')
-            parsed = try_parse_time(text_stripped, user_tz_for_parse)
-            if parsed:
-                if not self.storage.get_feature('notifications'):
-                    send_message(user_id=user_id, text='Функционал уведомлений отключен')
-                    return
-                self.storage.set_pending_text(user_id, parsed)
-                send_message(user_id=user_id, text='Отправьте текст напоминания в следующем сообщении')
-                return
-
-            # 3a) Напоминание одной строкой: HH:MM <текст>
-            m_time_text = re.match(r'^(\d{1,2}:\d{2})\s+(.+)$', text_stripped)
-            if m_time_text:
-                if not self.storage.get_feature('notifications'):
-                    send_message(user_id=user_id, text='Функционал уведомлений отключен')
-                    return
-                hhmm = m_time_text.group(1)
-                rem_text = m_time_text.group(2).strip()
-                parsed_time_only = try_parse_time(hhmm, user_tz_for_parse)
-                if parsed_time_only:
-                    dt_ms = int(parsed_time_only.astimezone(tz.tzutc()).timestamp() * 1000)
-                    success, msg = self.storage.add_reminder(user_id, dt_ms, rem_text)
-                    send_message(user_id=user_id, text=msg)
-                    return
-
-            # 4) Ожидание напоминания: следующее сообщение — текст
-            pending = self.storage.get_pending(user_id)
-            if pending:
-                if not self.storage.get_feature('notifications'):
-                    self.storage.clear_pending(user_id)
-                    send_message(user_id=user_id, text='Функционал уведомлений отключен — создание отменено')
-                    return
-                dt_ms = int(pending.timestamp() * 1000)
-                success, msg = self.storage.add_reminder(user_id, dt_ms, text_stripped)
-                self.storage.clear_pending(user_id)
-                send_message(user_id=user_id, text=msg)
-                return
-
-        # Обработка callback'ов от inline клавиатуры
-        if ut == 'message_callback':
-            cb = update.get('callback', {})
-            cb_id = cb.get('callback_id') or cb.get('id')
-            payload = cb.get('payload') or cb.get('data') or ''
-            # Переключить функции при нажатии кнопки
-            if isinstance(payload, str) and payload.startswith('toggle:') and cb_id:
-                feature = payload.split(':', 1)[1]
-                if feature in ('notifications', 'transactions'):
-                    current = self.storage.get_feature(feature)
-                    self.storage.set_feature(feature, not current)
-                    # Построить обновленное тело сообщения
-                    notif = self.storage.get_feature('notifications')
-                    trans = self.storage.get_feature('transactions')
-                    text_main = (
-                        "Главное меню\n\n"
-                        f"Уведомления: {'on' if notif else 'off'}\n"
-                        f"Транзакции: {'on' if trans else 'off'}\n\n"
-                        "Нажмите кнопку, чтобы переключить"
-                    )
-                    message_body = {
-                        'text': text_main,
-                        'attachments': build_main_keyboard(notif, trans)
-                    }
-                    answer_callback(cb_id, message_body=message_body, notification=None)
-                    return
-            # Если payload неизвестен, просто подтвердить молча, чтобы убрать загрузчик
-            if cb_id:
-                answer_callback(cb_id, message_body=None, notification=None)
-            return
+        start = time.perf_counter()
+        try:
+            self._handle_update(update)
+        finally:
+            startup.first_update()
+            UPDATE_SECONDS.labels(update.get('update_type') or 'unknown', update_command(update)).observe(time.perf_counter() - start)
+
+    def _handle_update(self, update):
+        logger.info('Handle update type=%s', update.get('update_type'))
+        self.router.dispatch(Context(self.storage, update))
 
 
 def try_parse_time(text: str, tz_str='UTC+3'):
-    # Принимает: HH:MM, HH:MM DD.MM, HH:MM DD.MM.YYYY
-    parts = text.split()
+    # Принимает: HH:MM, HH:MM DD.MM, HH:MM DD.MM.YYYY и сразу за ними необязательное правило повторения
+    # (ежедневно, по будням, еженедельно [пн..вс], ежемесячно [1..31]; английские формы — с разделителем
+    # в конце: '09:00 weekly mon |'). Текст после разделителя — это напоминание одной строкой, не время.
+    # Возвращает (первое срабатывание, строка правила или None) или None, если разобрать не удалось.
+    head, sep, rest = text.partition(recurrence.SPEC_SEPARATOR)
+    if sep and rest.strip():
+        return None
+    parts = head.split()
+    spec = None
+    for start in (1, 2):
+        if len(parts) > start:
+            spec = recurrence.parse_spec(parts[start:], separated=bool(sep))
+            if spec:
+                parts = parts[:start]
+                break
     try:
         time_part = parts[0]
         dt = None
@@ -535,38 +735,91 @@ def try_parse_time(text: str, tz_str='UTC+3'):
                 hh, mm = map(int, time_part.split(':'))
                 candidate = datetime(y, m, d, hh, mm, tzinfo=user_tz)
                 dt = candidate
-        return dt
+        if dt is None:
+            return None
+        if not spec:
+            return dt, None
+        # первое срабатывание правила не раньше указанного времени (например, ближайший будний день)
+        rule = recurrence.make_rule(spec[0], spec[1], dt, tz_str)
+        after_ms = max(int(dt.timestamp() * 1000) - 1, int(now.timestamp() * 1000))
+        return datetime.fromtimestamp(recurrence.next_occurrence(rule, after_ms) / 1000, tz=user_tz), rule
     except Exception:
         return None
 
 
+# Верхняя граница сна планировщика (страховка от переводов системных часов)
+SCHEDULER_MAX_SLEEP_SECONDS = 60
+
+
+def send_reminder(rem: dict):
+    return send_message(user_id=rem['user_id'], text=f"Напоминание: {rem['text']}")
+
+
 def scheduler_thread(storage: Storage):
+    delivery = ReminderDelivery(
+        send_reminder,
+        workers=cfg.get('delivery_workers', 8),
+        rate_per_second=cfg.get('delivery_rate_per_second', 25),
+        per_chat_rate_per_second=cfg.get('delivery_per_chat_rate_per_second', 1),
+    )
+    # Доставляет только держатель аренды 'scheduler': при нескольких процессах или репликах
+    # на общем хранилище остальные ждут и подхватывают работу, если ведущий пропал
+    lease = LeaderLease(storage, 'scheduler', ttl_seconds=cfg.get('scheduler_lease_seconds', 30))
+    lease.start()
+    claim_ttl_ms = int(cfg.get('reminder_claim_seconds', 300) * 1000)
+    # сон ограничен, чтобы вовремя заметить потерю аренды и истекшие чужие захваты
+    max_sleep = min(SCHEDULER_MAX_SLEEP_SECONDS, lease.renew_interval)
     while True:
-        now_ms = int(datetime.now(tz=tz.tzlocal()).timestamp() * 1000)
-        due = storage.get_due(now_ms)
-        for rem in due:
-            # Проверить глобальный флаг функции перед отправкой уведомлений
-            if storage.get_feature('notifications'):
-                send_message(user_id=rem['user_id'], text=f"Напоминание: {rem['text']}")
-                storage.mark_sent(rem['id'])
-        time.sleep(cfg.get('poll_interval_seconds', 5))
+        if not lease.is_leader():
+            lease.wait_for_leadership()
+            continue
+        now_ms = int(time.time() * 1000)
+        # Проверить глобальный флаг функции перед отправкой уведомлений
+        notifications_on = storage.get_feature('notifications')
+        if notifications_on:
+            # claim -> send -> mark_sent: захваченное не выдается другим планировщикам,
+            # а захват, брошенный упавшим процессом, истекает через reminder_claim_seconds
+            due = storage.claim_due(now_ms, lease.holder, claim_ttl_ms)
+            if due:
+                # Параллельная доставка с лимитами, затем одна запись в хранилище на всю пачку
+                delivered = delivery.deliver(due)
+                storage.mark_sent_many([rid for rid, _ in delivered])
+        else:
+            due = storage.get_due(now_ms)
+        # Спать ровно до ближайшего срока; добавление напоминания или смена флага будит раньше
+        next_ms = storage.next_due_ms()
+        if due and not notifications_on:
+            timeout = cfg.get('poll_interval_seconds', 5)
+        elif next_ms is None:
+            timeout = max_sleep
+        else:
+            timeout = min(max(0, next_ms - int(time.time() * 1000)) / 1000, max_sleep)
+        storage.wait_for_reminders(timeout)
 
 
 # Глобальный экземпляр бота (используется обработчиком webhook)
 _bot_instance = None
+# get_bot вызывают одновременно webhook, long-polling и планировщик: хранилище открывается один раз
+_bot_lock = threading.Lock()
 
 
 def get_bot():
     """Получить или создать глобальный экземпляр бота."""
     global _bot_instance
-    if _bot_instance is None:
-        os.makedirs(os.path.join(os.path.dirname(__file__), 'data'), exist_ok=True)
-        storage = Storage(cfg['storage_file'], cfg['max_reminders_per_user'])
-        _bot_instance = Bot(storage)
+    with _bot_lock:
+        if _bot_instance is None:
+            os.makedirs(os.path.join(os.path.dirname(__file__), 'data'), exist_ok=True)
+            start = time.perf_counter()
+            storage = open_storage(cfg)
+            logger.info('Storage opened in %.3fs', time.perf_counter() - start)
+            startup.mark('storage_loaded')
+            _bot_instance = Bot(storage)
     return _bot_instance
 
 
 def main():
+    # без токена — выход сразу, до загрузки хранилища
+    get_api()
     bot = get_bot()
     storage = bot.storage
 
@@ -574,14 +827,23 @@ def main():
     th.start()
     sch = threading.Thread(target=scheduler_thread, args=(storage,), daemon=True)
     sch.start()
+    startup.set_ready()
+
+    if threading.current_thread() is threading.main_thread():
+        # SIGTERM (docker stop) завершает так же, как Ctrl+C: с сохранением данных
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
 
     print('Bot started. Ctrl+C to stop.')
     try:
         while True:
             time.sleep(1)
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, SystemExit):
         print('Stopping...')
+    finally:
+        storage.close()
+
 
+startup.mark('bot_imported')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,40 @@
+"""
+Настройки бота из config.json и токен доступа Max API.
+Файл читается один раз; токен проверяется только там, где нужен клиент API,
+поэтому модули можно импортировать (для WebHook-сервера, выгрузки данных, бенчмарков)
+без токена и без побочных эффектов.
+"""
+
+import json
+import os
+import threading
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
+
+_cfg = None
+_cfg_lock = threading.Lock()
+
+
+def load_config() -> dict:
+    """Настройки из config.json (один общий словарь на процесс)."""
+    global _cfg
+    with _cfg_lock:
+        if _cfg is None:
+            with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+                _cfg = json.load(f)
+    return _cfg
+
+
+def api_base() -> str:
+    # MAX_API_BASE позволяет направить бота на другой адрес API (например, на тестовый сервер из bench/)
+    return os.environ.get('MAX_API_BASE') or load_config().get('api_base', 'https://platform-api.max.ru')
+
+
+def access_token() -> str:
+    """Токен Max API; без него процесс завершается с подсказкой."""
+    # Предпочтительно использовать переменную окружения для токена (не храните токены в репозитории)
+    token = os.environ.get('MAX_ACCESS_TOKEN') or load_config().get('access_token')
+    if not token:
+        print('Ошибка: токен доступа не предоставлен. Установите переменную окружения MAX_ACCESS_TOKEN или добавьте access_token в config.json')
+        raise SystemExit(1)
+    return token
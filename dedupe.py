@@ -0,0 +1,126 @@
+"""
+Кэш уже принятых обновлений: Max повторяет доставку WebHook, если не дождался 200,
+а long-polling может вернуть обновление повторно после сбоя. Повтор отбрасывается
+до обработки, поэтому транзакции и напоминания не дублируются.
+Кэш ограничен по размеру и времени жизни записей. С хранилищем SQLite (store) принятые
+обновления запоминаются еще и в базе: повтор, доставленный в другой процесс WebHook,
+тоже отбрасывается.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from dispatcher import update_user_id
+
+
+def update_key(update: dict) -> Optional[str]:
+    """Идентичность обновления: id callback, id сообщения (mid) или пользователь + timestamp."""
+    ut = update.get('update_type')
+    callback_id = (update.get('callback') or {}).get('callback_id')
+    if callback_id:
+        return f'callback:{callback_id}'
+    mid = ((update.get('message') or {}).get('body') or {}).get('mid')
+    if mid:
+        return f'{ut}:{mid}'
+    if update.get('timestamp') is not None:
+        return f'{ut}:{update_user_id(update)}:{update["timestamp"]}'
+    return None
+
+
+class SeenUpdates:
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 3600, store=None):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        # общее хранилище (mark_update_seen/forget_update) или None — только память процесса
+        self.store = store
+        # ключ -> момент истечения (monotonic), в порядке добавления: самые старые — в начале
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _evict(self, now: float):
+        seen = self._seen
+        while seen and (len(seen) > self.max_size or next(iter(seen.values())) <= now):
+            seen.popitem(last=False)
+            self.evictions += 1
+
+    def add(self, key: Optional[str]) -> bool:
+        """Запомнить обновление; False, если оно уже встречалось (повтор). Без ключа — всегда True."""
+        if key is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            expires = self._seen.get(key)
+            if expires is not None and expires > now:
+                self.hits += 1
+                return False
+            if self.store is None:
+                self._remember(key, now)
+                return True
+        # с общим хранилищем повтор определяет база (атомарно между потоками и процессами);
+        # запись идет вне self._lock, чтобы не задерживать проверки других потоков
+        if not self.store.mark_update_seen(key, int(self.ttl * 1000)):
+            with self._lock:
+                self.hits += 1
+            return False
+        with self._lock:
+            self._remember(key, now)
+        return True
+
+    def claim(self, key: Optional[str]) -> bool:
+        """
+        Как add(), но в памяти процесса ключ не запоминается до remember(): для обновлений
+        пачки, которая может не сохраниться. Запись в общем хранилище делается в открытой
+        транзакции пачки и откатывается вместе с ней.
+        """
+        if key is None:
+            return True
+        with self._lock:
+            expires = self._seen.get(key)
+            if expires is not None and expires > time.monotonic():
+                self.hits += 1
+                return False
+        if self.store is not None and not self.store.mark_update_seen(key, int(self.ttl * 1000)):
+            with self._lock:
+                self.hits += 1
+            return False
+        return True
+
+    def remember(self, keys):
+        """Запомнить ключи, принятые claim(), после сохранения их пачки."""
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                if key is not None:
+                    self._remember(key, now)
+
+    def _remember(self, key: str, now: float):
+        self._seen.pop(key, None)
+        self._seen[key] = now + self.ttl
+        self.misses += 1
+        self._evict(now)
+
+    def discard(self, key: Optional[str]):
+        """Забыть обновление (оно не было принято в обработку и будет доставлено снова)."""
+        if key is None:
+            return
+        with self._lock:
+            self._seen.pop(key, None)
+        if self.store is not None:
+            self.store.forget_update(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._seen),
+                'shared': self.store is not None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,103 @@
+"""
+Параллельная доставка напоминаний с ограничением скорости.
+Наступившие напоминания раздаются пулу потоков. Общий лимит (сообщений в секунду
+на бота) — token bucket, лимит на чат — минимальный интервал между сообщениями
+одному пользователю (моменты отправки бронируются заранее, без гонок между потоками).
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_LAG = Histogram('maxon_reminder_delivery_lag_seconds', 'Опоздание доставки напоминания (now - reminder.time)',
+                         buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300, 900))
+
+
+class RateLimiter:
+    """Потокобезопасный token bucket. rate <= 0 — без ограничения."""
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ReminderDelivery:
+    def __init__(self, send: Callable[[dict], object], workers: int = 8, rate_per_second: float = 25,
+                 per_chat_rate_per_second: float = 1):
+        self.send = send
+        self.limiter = RateLimiter(rate_per_second)
+        self.per_chat_interval = 1 / per_chat_rate_per_second if per_chat_rate_per_second > 0 else 0
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='delivery')
+        # ближайший свободный момент отправки каждому пользователю (monotonic), для лимита на чат
+        self._next_slot = {}
+        self._slot_lock = threading.Lock()
+
+    def _reserve_chat_slot(self, user_id) -> float:
+        """Забронировать момент отправки пользователю; возвращает, сколько секунд подождать."""
+        if not self.per_chat_interval:
+            return 0
+        with self._slot_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(user_id, now))
+            self._next_slot[user_id] = slot + self.per_chat_interval
+        return slot - now
+
+    def _deliver_one(self, rem: dict) -> tuple:
+        wait = self._reserve_chat_slot(rem['user_id'])
+        if wait > 0:
+            time.sleep(wait)
+        self.limiter.acquire()
+        try:
+            self.send(rem)
+        except Exception:
+            logger.exception('Reminder %s delivery failed', rem['id'])
+        lateness = int(time.time() * 1000) - rem['time']
+        DELIVERY_LAG.observe(lateness / 1000)
+        return rem['id'], lateness
+
+    def deliver(self, reminders: List[dict]) -> List[tuple]:
+        """Доставить напоминания; возвращает [(id, опоздание в ms)] для всех обработанных."""
+        # Чередовать пользователей (первые напоминания всех, затем вторые, ...),
+        # чтобы потоки не простаивали в ожидании лимита одного чата
+        rank = {}
+        order = []
+        for rem in sorted(reminders, key=lambda r: r['time']):
+            n = rank.get(rem['user_id'], 0)
+            rank[rem['user_id']] = n + 1
+            order.append((n, rem['time'], rem))
+        order.sort(key=lambda item: item[:2])
+        results = list(self._executor.map(self._deliver_one, [rem for _, _, rem in order]))
+        self._forget_idle_chats()
+        if results:
+            lateness = [late for _, late in results]
+            logger.info('Delivered %d reminders to %d users, lateness avg=%dms max=%dms',
+                        len(results), len(rank), sum(lateness) // len(lateness), max(lateness))
+        return results
+
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        with self._slot_lock:
+            self._next_slot = {u: t for u, t in self._next_slot.items() if t > now}
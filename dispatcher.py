@@ -0,0 +1,126 @@
+"""
+Асинхронная обработка обновлений: ограниченные очереди и пул рабочих потоков.
+Обновления одного пользователя всегда попадают в один поток, поэтому двухшаговые
+сценарии (время -> текст, сумма -> категория) обрабатываются строго по порядку.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def update_user_id(update: dict):
+    """Получить user_id автора обновления (или None, если его нет)."""
+    ut = update.get('update_type')
+    if ut == 'message_created':
+        return (update.get('message') or {}).get('sender', {}).get('user_id')
+    if ut == 'message_callback':
+        cb = update.get('callback') or {}
+        return (cb.get('user') or {}).get('user_id')
+    return (update.get('user') or {}).get('user_id')
+
+
+class UpdateDispatcher:
+    def __init__(self, handler: Callable[[dict], None], workers: int = 4, queue_size: int = 1000):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self._threads = []
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+    def start(self):
+        for i, q in enumerate(self._queues):
+            th = threading.Thread(target=self._worker, args=(q,), name=f'update-worker-{i}', daemon=True)
+            th.start()
+            self._threads.append(th)
+
+    def stop(self, timeout: Optional[float] = 10):
+        """Дождаться обработки уже принятых обновлений и остановить потоки."""
+        for q in self._queues:
+            q.put(_STOP)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for th in self._threads:
+            th.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, update: dict, block: bool = False) -> bool:
+        """
+        Поставить обновление в очередь. Без block не ждет места: False — очередь переполнена.
+        С block ждет, пока воркер освободит место (для long-polling, где отказ некуда вернуть).
+        """
+        user_id = update_user_id(update)
+        q = self._queues[hash(user_id) % self.workers]
+        try:
+            q.put((time.monotonic(), update), block=block)
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            return False
+        with self._stats_lock:
+            self.submitted += 1
+        return True
+
+    def _worker(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is _STOP:
+                q.task_done()
+                return
+            enqueued_at, update = item
+            lag_ms = (time.monotonic() - enqueued_at) * 1000
+            try:
+                self.handler(update)
+                failed = False
+            except Exception:
+                logger.exception('Error handling update in bot')
+                failed = True
+            with self._stats_lock:
+                self.processed += 1
+                self.errors += failed
+                self.last_lag_ms = lag_ms
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            q.task_done()
+
+    def join(self):
+        """Дождаться обработки всех поставленных в очередь обновлений."""
+        for q in self._queues:
+            q.join()
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def oldest_wait_ms(self) -> float:
+        """Сколько ждет самое старое необработанное обновление."""
+        now = time.monotonic()
+        oldest = 0.0
+        for q in self._queues:
+            with q.mutex:
+                if q.queue and q.queue[0] is not _STOP:
+                    oldest = max(oldest, (now - q.queue[0][0]) * 1000)
+        return oldest
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.queue_depth(),
+                'oldest_wait_ms': round(self.oldest_wait_ms(), 1),
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'rejected': self.rejected,
+                'errors': self.errors,
+                'last_lag_ms': round(self.last_lag_ms, 1),
+                'max_lag_ms': round(self.max_lag_ms, 1),
+            }
@@ -2,6 +2,22 @@
 """
 Скрипт точки входа, который запускает бота с long-polling и WebHook-сервер.
 Позволяет гибкое развертывание: можно запустить только бота, только webhook или оба.
+
+WebHook-сервер может работать в нескольких процессах (webhook_processes в config.json):
+воркеры uvicorn только принимают обновления, а планировщик напоминаний запускается
+в этом (родительском) процессе. Общие данные процессы видят через хранилище SQLite
+("storage_engine": "sqlite"); при нескольких репликах рассылает только держатель
+аренды планировщика (см. leader.py).
+
+Выгрузка данных файлового хранилища в JSON (например, при двоичном snapshot_format;
+бот должен быть остановлен — файл хранилища открывается эксклюзивно):
+    python entrypoint.py export-json data/export.json
+
+Выгрузка и загрузка истории транзакций (CSV или JSONL по расширению, см. ledger.py;
+для движков json/journal бот должен быть остановлен, SQLite можно при работающем боте):
+    python entrypoint.py export-ledger data/ledger.csv [user_id]
+    python entrypoint.py export-ledger - --format jsonl > ledger.jsonl
+    python entrypoint.py import-ledger data/ledger.csv
 """
 
 import os
@@ -18,12 +34,38 @@ def run_bot():
     from bot import main
     main()
 
+def run_scheduler():
+    """Запустить планировщик напоминаний (без long-polling)"""
+    logger.info('Starting reminder scheduler...')
+    from bot import get_bot, scheduler_thread
+    scheduler_thread(get_bot().storage)
+
 def run_webhook():
     """Запустить WebHook FastAPI сервер"""
-    logger.info('Starting WebHook server...')
     import uvicorn
+    from config import load_config
+
+    cfg = load_config()
+
+    processes = int(cfg.get('webhook_processes', 1))
+    if processes > 1:
+        # Файловые движки держат данные в памяти одного процесса
+        if cfg.get('storage_engine', 'json') != 'sqlite':
+            logger.error('webhook_processes > 1 requires "storage_engine": "sqlite" in config.json')
+            sys.exit(1)
+        logger.info('Starting WebHook server with %d worker processes...', processes)
+        # воркеры запускаются заново и импортируют приложение по строке
+        uvicorn.run(
+            'webhook:app',
+            host='0.0.0.0',
+            port=int(os.environ.get('PORT', 8000)),
+            log_level='info',
+            workers=processes,
+        )
+        return
+
+    logger.info('Starting WebHook server...')
     from webhook import app
-    
     uvicorn.run(
         app,
         host='0.0.0.0',
@@ -31,9 +73,73 @@ def run_webhook():
         log_level='info'
     )
 
+def run_export_json(path: str):
+    """Выгрузить данные файлового хранилища (json/journal) в JSON-снимок."""
+    from config import load_config
+    from storage import Storage
+
+    cfg = load_config()
+    engine = cfg.get('storage_engine', 'json')
+    if engine == 'sqlite':
+        logger.error('export-json is for the json and journal engines; SQLite data is in %s', cfg.get('sqlite_file'))
+        sys.exit(1)
+    # без фоновых потоков хранения: выгрузка только читает данные; снимок читается в любом формате
+    storage = Storage(cfg['storage_file'], cfg['max_reminders_per_user'], engine=engine, snapshot_format='binary')
+    try:
+        storage.export_json(path)
+    finally:
+        storage.close()
+    logger.info('Exported %s to %s', cfg['storage_file'], path)
+
+def run_export_ledger(path: str, user_id=None, fmt=None):
+    """Выгрузить историю транзакций (всех пользователей или одного) в файл или stdout ('-')."""
+    import ledger
+    from config import load_config
+    from storage import open_storage
+
+    fmt = fmt or ledger.format_for(path)
+    storage = open_storage(load_config(), retention=False)
+    try:
+        if path == '-':
+            count = ledger.export_ledger(storage, sys.stdout, fmt, user_id)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                count = ledger.export_ledger(storage, f, fmt, user_id)
+    finally:
+        storage.close()
+    logger.info('Exported %d transactions to %s', count, path)
+
+def run_import_ledger(path: str, fmt=None):
+    """Загрузить историю транзакций из файла пачками (повторная загрузка пропускает известные id)."""
+    import ledger
+    from config import load_config
+    from storage import open_storage
+
+    fmt = fmt or ledger.format_for(path)
+    storage = open_storage(load_config(), retention=False)
+    try:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            added, skipped = ledger.import_ledger(storage, f, fmt)
+    except ValueError as e:
+        logger.error('Import failed, nothing loaded: %s', e)
+        sys.exit(1)
+    finally:
+        storage.close()
+    logger.info('Imported %d transactions from %s (%d already present)', added, path, skipped)
+
+def _ledger_args(args):
+    """Позиционные аргументы и значение --format из командной строки export-/import-ledger."""
+    fmt = None
+    if '--format' in args:
+        i = args.index('--format')
+        fmt = args[i + 1] if i + 1 < len(args) else None
+        args = args[:i] + args[i + 2:]
+    return args, fmt
+
 if __name__ == '__main__':
     # Получить режим из переменной окружения или командной строки
-    # Допустимые режимы: 'bot', 'webhook', 'both' (по умолчанию: 'both')
+    # Допустимые режимы: 'bot', 'webhook', 'both' (по умолчанию: 'both'), 'export-json [файл]',
+    # 'export-ledger <файл|-> [user_id] [--format csv|jsonl]', 'import-ledger <файл> [--format csv|jsonl]'
     mode = os.environ.get('BOT_MODE', 'both').lower()
     if len(sys.argv) > 1:
         mode = sys.argv[1].lower()
@@ -45,7 +151,9 @@ if __name__ == '__main__':
         run_bot()
     
     elif mode == 'webhook':
-        # Запустить только WebHook-сервер
+        # WebHook-сервер и единственный планировщик напоминаний в фоновом потоке
+        scheduler = threading.Thread(target=run_scheduler, daemon=True)
+        scheduler.start()
         run_webhook()
     
     elif mode == 'both':
@@ -55,6 +163,19 @@ if __name__ == '__main__':
         logger.info('Bot thread started, running WebHook server on main thread...')
         run_webhook()
     
+    elif mode == 'export-json':
+        run_export_json(sys.argv[2] if len(sys.argv) > 2 else 'data/export.json')
+
+    elif mode in ('export-ledger', 'import-ledger'):
+        args, fmt = _ledger_args(sys.argv[2:])
+        if not args or (fmt and fmt not in ('csv', 'jsonl')):
+            logger.error('Usage: %s <file> %s[--format csv|jsonl]', mode, '[user_id] ' if mode == 'export-ledger' else '')
+            sys.exit(1)
+        if mode == 'export-ledger':
+            run_export_ledger(args[0], int(args[1]) if len(args) > 1 else None, fmt)
+        else:
+            run_import_ledger(args[0], fmt)
+
     else:
-        logger.error(f'Unknown mode: {mode}. Use: bot, webhook, or both')
+        logger.error(f'Unknown mode: {mode}. Use: bot, webhook, both, export-json, export-ledger or import-ledger')
         sys.exit(1)
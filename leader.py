@@ -0,0 +1,79 @@
+"""
+Выбор ведущего через аренду (lease) в общем хранилище.
+Каждый кандидат периодически пытается захватить или продлить аренду с заданным именем;
+ведущим считается тот, кто успешно продлил ее не позже ttl назад. Если ведущий
+упал или завис, аренда истекает и ее забирает другой процесс.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLease:
+    def __init__(self, storage, name: str, ttl_seconds: float = 30, holder: Optional[str] = None):
+        self.storage = storage
+        self.name = name
+        self.ttl = ttl_seconds
+        self.holder = holder or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        # аренда продлевается трижды за ttl: один пропуск не приводит к смене ведущего
+        self.renew_interval = ttl_seconds / 3
+        # до какого момента (monotonic) мы гарантированно ведущий
+        self._valid_until = 0.0
+        self._changed = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._renew()
+        self._thread = threading.Thread(target=self._run, name=f'lease-{self.name}', daemon=True)
+        self._thread.start()
+
+    def _renew(self):
+        started = time.monotonic()
+        was_leader = self.is_leader()
+        try:
+            acquired = self.storage.acquire_lease(self.name, self.holder, int(self.ttl * 1000))
+        except Exception:
+            logger.exception('Lease %s renewal failed', self.name)
+            acquired = False
+        if acquired:
+            # отсчет от момента запроса: хранилище могло ответить с задержкой
+            self._valid_until = started + self.ttl
+        if acquired != was_leader:
+            logger.info('Lease %s %s by %s', self.name, 'acquired' if acquired else 'lost', self.holder)
+            self._changed.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.renew_interval):
+            self._renew()
+
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    def wait_for_leadership(self, timeout: Optional[float] = None) -> bool:
+        """Ждать, пока этот процесс станет ведущим, не дольше timeout секунд."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.is_leader():
+            wait = self.renew_interval if deadline is None else min(self.renew_interval, deadline - time.monotonic())
+            if wait <= 0:
+                return False
+            self._changed.wait(wait)
+            self._changed.clear()
+        return True
+
+    def stop(self):
+        """Остановить продление и освободить аренду, чтобы другой процесс не ждал ее истечения."""
+        self._stopped.set()
+        if self.is_leader():
+            self._valid_until = 0.0
+            try:
+                self.storage.release_lease(self.name, self.holder)
+            except Exception:
+                logger.exception('Lease %s release failed', self.name)
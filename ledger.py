@@ -0,0 +1,123 @@
+"""
+Потоковая выгрузка и загрузка истории транзакций в CSV или JSONL.
+
+Строка: id, user_id, amount (со знаком: + доход, - расход), category, timestamp (ms UTC).
+Выгрузка читает хранилище порциями (iter_transactions) и отдает текст кусками, загрузка
+разбирает файл построчно и передает хранилищу пачками (import_transactions: одно сохранение
+на пачку) — память не зависит от числа строк. Перед загрузкой файл проверяется целиком,
+поэтому ошибка в строке не оставляет половину файла загруженной. Строки без id получают
+новый id; строки с уже известным id пропускаются.
+
+Используется командами entrypoint.py (export-ledger, import-ledger) и эндпоинтами
+/ledger/export и /ledger/import WebHook-сервера.
+"""
+
+import csv
+import io
+import json
+from typing import IO, Iterable, Iterator, Optional, Tuple
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('id', 'user_id', 'amount', 'category', 'timestamp')
+# строк в одном куске выгружаемого текста
+DUMP_CHUNK_ROWS = 1000
+
+
+def format_for(path: str, default: str = 'csv') -> str:
+    """Формат по расширению файла (.csv, .jsonl/.ndjson)."""
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        return 'csv'
+    if lower.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return default
+
+
+def dump(rows: Iterable[dict], fmt: str) -> Iterator[str]:
+    """Текст выгрузки кусками по DUMP_CHUNK_ROWS строк (для CSV первый кусок начинается с заголовка)."""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown ledger format: {fmt}')
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n') if fmt == 'csv' else None
+    if writer:
+        writer.writerow(FIELDS)
+    n = 0
+    for t in rows:
+        if writer:
+            writer.writerow([t[f] for f in FIELDS])
+        else:
+            buf.write(json.dumps({f: t[f] for f in FIELDS}, ensure_ascii=False, separators=(',', ':')) + '\n')
+        n += 1
+        if n % DUMP_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def load(lines: Iterable[str], fmt: str) -> Iterator[dict]:
+    """Проверенные строки файла; ValueError с номером строки при первой ошибке."""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        missing = set(FIELDS[1:]) - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f'CSV header is missing columns: {", ".join(sorted(missing))}')
+        for row in reader:
+            yield _transaction(row, reader.line_num)
+    elif fmt == 'jsonl':
+        for n, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise ValueError(f'Line {n}: invalid JSON') from None
+            yield _transaction(row, n)
+    else:
+        raise ValueError(f'Unknown ledger format: {fmt}')
+
+
+def _transaction(row, line: int) -> dict:
+    try:
+        t = {
+            'id': str(row['id']) if row.get('id') else None,
+            'user_id': int(row['user_id']),
+            'amount': int(row['amount']),
+            'category': row['category'],
+            'timestamp': int(row['timestamp']),
+        }
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise ValueError(f'Line {line}: expected user_id, amount, category, timestamp (id optional); got {row!r}') from None
+    if not isinstance(t['category'], str) or not t['category']:
+        raise ValueError(f'Line {line}: empty category')
+    return t
+
+
+def export_ledger(storage, out: IO[str], fmt: str, user_id: Optional[int] = None) -> int:
+    """Выгрузить транзакции (пользователя или все) в текстовый файл; возвращает число строк."""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for t in storage.iter_transactions(user_id):
+            count += 1
+            yield t
+
+    for piece in dump(counted(), fmt):
+        out.write(piece)
+    return count
+
+
+def import_ledger(storage, fp: IO[str], fmt: str, chunk_size: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Проверить файл целиком (fp должен поддерживать seek), затем загрузить пачками.
+    Возвращает (добавлено, пропущено).
+    """
+    for _ in load(fp, fmt):
+        pass
+    fp.seek(0)
+    rows = load(fp, fmt)
+    if chunk_size:
+        return storage.import_transactions(rows, chunk_size)
+    return storage.import_transactions(rows)
@@ -0,0 +1,111 @@
+"""
+Общий HTTP-клиент Max Bot API: одна requests.Session с пулом keep-alive соединений
+и повтором запросов с экспоненциальной задержкой (с учетом Retry-After при 429).
+Неидемпотентные запросы (POST /messages, /answers) повторяются, только если сервер их
+точно не выполнил: иначе пользователь получил бы сообщение дважды.
+"""
+
+import logging
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+REQUEST_SECONDS = Histogram('maxon_max_api_request_seconds', 'Длительность запроса к Max API (одна попытка)', ('method', 'path'))
+RESPONSES = Counter('maxon_max_api_responses_total', 'Ответы Max API по статусам (error — ошибка соединения)', ('path', 'status'))
+
+# Статусы, при которых повторяется идемпотентный запрос (GET /updates)
+RETRY_STATUSES = (429, 502, 503, 504)
+# Для остальных методов — только статусы, означающие, что сервер запрос не выполнил:
+# при 502/504 или обрыве после отправки сообщение могло уже уйти
+UNSAFE_RETRY_STATUSES = (429, 503)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+# Верхняя граница ожидания между попытками, даже если Retry-After больше
+MAX_RETRY_DELAY_SECONDS = 30
+
+
+def _not_sent(exc: requests.ConnectionError) -> bool:
+    """Соединение не установлено (отказ, DNS, таймаут подключения): запрос до сервера не дошел."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+class MaxApiClient:
+    def __init__(self, base_url: str, token: str, pool_size: int = 10, max_retries: int = 3,
+                 backoff_seconds: float = 0.5, timeout: float = 10):
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['Authorization'] = token
+        # Повторы делаем сами (нужен учет Retry-After и журналирование), поэтому max_retries=0
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _retry_delay(self, attempt: int, resp: Optional[requests.Response]) -> float:
+        delay = self.backoff_seconds * (2 ** attempt)
+        if resp is not None and resp.status_code == 429:
+            retry_after = resp.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+        return min(delay, MAX_RETRY_DELAY_SECONDS)
+
+    def _send(self, method: str, path: str, url: str, params, json, timeout) -> requests.Response:
+        """Одна попытка запроса с учетом длительности и статуса в метриках."""
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            resp = self.session.request(method, url, params=params, json=json, timeout=timeout)
+            status = resp.status_code
+            return resp
+        finally:
+            REQUEST_SECONDS.labels(method, path).observe(time.perf_counter() - start)
+            RESPONSES.labels(path, status).inc()
+
+    def request(self, method: str, path: str, params: dict = None, json: dict = None,
+                timeout: float = None, retries: int = None) -> requests.Response:
+        """
+        Выполнить запрос с повторами. Исключение пробрасывается, если все попытки исчерпаны
+        или запрос неидемпотентный и мог быть выполнен (обрыв после отправки, таймаут чтения).
+        """
+        url = self.base_url + path
+        retries = self.max_retries if retries is None else retries
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        statuses = RETRY_STATUSES if idempotent else UNSAFE_RETRY_STATUSES
+        attempt = 0
+        while True:
+            resp = None
+            try:
+                resp = self._send(method, path, url, params, json, timeout or self.timeout)
+            except requests.ConnectionError as e:
+                # соединение не установлено или разорвано (в т.ч. устаревшее keep-alive соединение);
+                # после разрыва неидемпотентный запрос не повторяется — сервер мог его выполнить
+                if attempt >= retries or not (idempotent or _not_sent(e)):
+                    raise
+            else:
+                if resp.status_code not in statuses or attempt >= retries:
+                    return resp
+            delay = self._retry_delay(attempt, resp)
+            logger.warning('%s %s: %s, retry %d/%d in %.1fs', method, path,
+                           resp.status_code if resp is not None else 'connection error', attempt + 1, retries, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
@@ -0,0 +1,66 @@
+"""
+Межпроцессная блокировка на файле (flock). Снимается ядром при завершении процесса,
+поэтому «зависших» блокировок после падения не бывает.
+На платформах без fcntl (Windows) блокировка всегда считается захваченной.
+"""
+
+import os
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class ProcessLock:
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def _lock(self, blocking: bool) -> bool:
+        if self._file is not None:
+            return True
+        f = open(self.path, 'a+', encoding='utf-8')
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                f.close()
+                return False
+        # записать pid владельца для диагностики
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def acquire(self):
+        """Захватить блокировку, дождавшись ее освобождения другим процессом."""
+        self._lock(blocking=True)
+
+    def try_acquire(self) -> bool:
+        """Захватить блокировку без ожидания; False, если она занята другим процессом."""
+        return self._lock(blocking=False)
+
+    def release(self):
+        if self._file is not None:
+            # файл не удаляется: иначе два процесса могли бы заблокировать разные inode
+            self._file.close()
+            self._file = None
+
+    def owner(self) -> Optional[str]:
+        """pid процесса, последним захватившего блокировку (для сообщений об ошибке)."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
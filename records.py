@@ -0,0 +1,109 @@
+"""
+Компактное представление напоминаний и транзакций в памяти файлового хранилища.
+
+Запись — объект со __slots__ вместо словаря: без таблицы ключей в каждой записи.
+UUID хранится 128-битным целым (cid) вместо строки из 36 символов, категории
+интернируются — одна строка на все транзакции с той же категорией. Наружу
+(API хранилища, снимок, журнал, архив) записи отдаются словарями прежнего вида
+(to_dict); для кода, читающего поля по ключу, есть r['field'] и r.get('field').
+"""
+
+import sys
+
+
+def compact_id(rid):
+    """Строка UUID -> целое; прочие id (не в каноническом виде UUID) остаются как есть."""
+    if type(rid) is str and len(rid) == 36 and rid[8] == rid[13] == rid[18] == rid[23] == '-':
+        digits = rid.replace('-', '')
+        try:
+            value = int(digits, 16)
+        except ValueError:
+            return rid
+        # только канонический вид (32 строчные hex-цифры): expand_id должен вернуть ту же строку
+        if digits == f'{value:032x}':
+            return value
+    return rid
+
+
+def expand_id(cid) -> str:
+    if type(cid) is not int:
+        return cid
+    h = f'{cid:032x}'
+    return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+
+
+class _Record:
+    __slots__ = ()
+
+    @property
+    def id(self) -> str:
+        return expand_id(self.cid)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self) -> dict:
+        raise NotImplementedError
+
+    def astuple(self) -> tuple:
+        """Поля в порядке аргументов конструктора (для двоичного снимка): cls(*r.astuple())."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+class Reminder(_Record):
+    # repeat — строка правила повторения (recurrence.py) или None для разового напоминания
+    __slots__ = ('cid', 'user_id', 'time', 'text', 'sent', 'repeat')
+
+    def __init__(self, cid, user_id: int, time: int, text: str, sent: bool = False, repeat: str = None):
+        self.cid = cid
+        self.user_id = user_id
+        self.time = time
+        self.text = text
+        self.sent = sent
+        self.repeat = repeat
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'Reminder':
+        return cls(compact_id(d['id']), d['user_id'], d['time'], d['text'], bool(d.get('sent')), d.get('repeat'))
+
+    def to_dict(self) -> dict:
+        d = {'id': expand_id(self.cid), 'user_id': self.user_id, 'time': self.time, 'text': self.text, 'sent': self.sent}
+        # ключ есть только у повторяющихся: разовые сохраняются в прежнем виде
+        if self.repeat:
+            d['repeat'] = self.repeat
+        return d
+
+
+class Transaction(_Record):
+    __slots__ = ('cid', 'user_id', 'amount', 'category', 'timestamp')
+
+    def __init__(self, cid, user_id: int, amount: int, category: str, timestamp: int):
+        self.cid = cid
+        self.user_id = user_id
+        self.amount = amount
+        self.category = sys.intern(category) if type(category) is str else category
+        self.timestamp = timestamp
+
+    @classmethod
+    def from_dict(cls, d: dict) -> 'Transaction':
+        return cls(compact_id(d['id']), d['user_id'], d['amount'], d['category'], d['timestamp'])
+
+    def to_dict(self) -> dict:
+        return {'id': expand_id(self.cid), 'user_id': self.user_id, 'amount': self.amount, 'category': self.category,
+                'timestamp': self.timestamp}
+
+
+def record_json(obj):
+    """default= для json.dumps: записи сериализуются словарями прежнего формата."""
+    if isinstance(obj, _Record):
+        return obj.to_dict()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
@@ -0,0 +1,150 @@
+"""
+Повторяющиеся напоминания: правило хранится в напоминании одной строкой, а срабатывания
+не создаются заранее — после доставки хранилище переводит напоминание на следующее
+(next_occurrence), поэтому память и работа планировщика растут с числом правил, а не повторов.
+
+Строка правила: '<вид>[:<день>] HH:MM <пояс>', например 'daily 09:00 UTC+3',
+'weekly:0 18:30 Europe/Moscow' (0 — понедельник), 'monthly:31 10:00 UTC+3'.
+Время суток и пояс (UTC±N или имя IANA) хранятся в правиле: срабатывание остается в 09:00
+местного времени при переходе на летнее время, а 31-е число в коротком месяце сдвигается на последний день
+и возвращается на 31-е в следующем.
+"""
+
+import calendar
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from dateutil import tz
+
+from timezones import utc_offset_to_tz
+
+KINDS = ('daily', 'weekdays', 'weekly', 'monthly')
+
+# Слова правила в сообщении пользователя (без учета регистра), сразу после времени или даты
+KIND_WORDS = {
+    ('ежедневно',): 'daily',
+    ('будни',): 'weekdays',
+    ('по', 'будням'): 'weekdays',
+    ('еженедельно',): 'weekly',
+    ('ежемесячно',): 'monthly',
+}
+# Английские слова обычны в тексте напоминания ('18:00 weekly report'), поэтому правилом
+# считаются только перед разделителем: '18:00 weekly mon | report'
+SEPARATED_KIND_WORDS = {
+    **KIND_WORDS,
+    ('daily',): 'daily',
+    ('weekdays',): 'weekdays',
+    ('weekly',): 'weekly',
+    ('monthly',): 'monthly',
+}
+SPEC_SEPARATOR = '|'
+WEEKDAY_WORDS = {
+    'пн': 0, 'вт': 1, 'ср': 2, 'чт': 3, 'пт': 4, 'сб': 5, 'вс': 6,
+    'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4, 'sat': 5, 'sun': 6,
+}
+WEEKDAY_NAMES = ('пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс')
+
+Rule = namedtuple('Rule', 'kind day hour minute tz_str')
+
+
+def parse_spec(words: List[str], separated: bool = False) -> Optional[Tuple[str, Optional[int]]]:
+    """
+    Правило из слов сообщения: ['ежедневно'], ['по', 'будням'], ['еженедельно', 'пн'], ['ежемесячно', '15'];
+    английские формы (['weekly', 'mon']) — только если за правилом стоит разделитель (separated).
+    Возвращает (вид, день или None) или None, если слова не составляют правило целиком.
+    """
+    words = [w.lower() for w in words]
+    kind_words = SEPARATED_KIND_WORDS if separated else KIND_WORDS
+    for n in (2, 1):
+        kind = kind_words.get(tuple(words[:n]))
+        if kind is None:
+            continue
+        rest = words[n:]
+        if not rest:
+            return kind, None
+        if len(rest) == 1:
+            if kind == 'weekly' and rest[0] in WEEKDAY_WORDS:
+                return kind, WEEKDAY_WORDS[rest[0]]
+            if kind == 'monthly' and rest[0].isdigit() and 1 <= int(rest[0]) <= 31:
+                return kind, int(rest[0])
+        return None
+    return None
+
+
+def split_spec(text: str) -> Tuple[str, str]:
+    """
+    Отделить правило в начале текста: 'ежедневно Покормить кота' -> ('ежедневно', 'Покормить кота'),
+    'weekly mon | Отчет' -> ('weekly mon |', 'Отчет'). Правило возвращается с разделителем,
+    если он был, — в таком виде его принимает bot.try_parse_time.
+    """
+    head, sep, rest = text.partition(SPEC_SEPARATOR)
+    if sep and parse_spec(head.split(), separated=True):
+        return f'{head.strip()} {SPEC_SEPARATOR}', rest.strip()
+    for n in (2, 1):
+        parts = text.split(None, n)
+        if len(parts) > n and parse_spec(parts[:n]):
+            return ' '.join(parts[:n]), parts[n].strip()
+    return '', text
+
+
+def make_rule(kind: str, day: Optional[int], start: datetime, tz_str: str) -> str:
+    """Строка правила с временем суток start; день недели или месяца по умолчанию — как у start."""
+    if kind == 'weekly':
+        kind = f'weekly:{start.weekday() if day is None else day}'
+    elif kind == 'monthly':
+        kind = f'monthly:{start.day if day is None else day}'
+    return f'{kind} {start.hour:02d}:{start.minute:02d} {tz_str}'
+
+
+@lru_cache(maxsize=4096)
+def parse_rule(rule: str) -> Rule:
+    kind, clock, tz_str = rule.split(' ', 2)
+    kind, _, day = kind.partition(':')
+    if kind not in KINDS:
+        raise ValueError(f'Unknown recurrence: {rule!r}')
+    hour, minute = map(int, clock.split(':'))
+    return Rule(kind, int(day) if day else None, hour, minute, tz_str)
+
+
+def _days(rule: Rule, start: date):
+    """Дни срабатывания начиная с start (включительно)."""
+    if rule.kind == 'monthly':
+        year, month = start.year, start.month
+        while True:
+            day = min(rule.day, calendar.monthrange(year, month)[1])
+            if (year, month) != (start.year, start.month) or day >= start.day:
+                yield date(year, month, day)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    d = start
+    while True:
+        if (rule.kind == 'daily' or (rule.kind == 'weekdays' and d.weekday() < 5)
+                or (rule.kind == 'weekly' and d.weekday() == rule.day)):
+            yield d
+        d += timedelta(days=1)
+
+
+def next_occurrence(rule: str, after_ms: int) -> int:
+    """Первое срабатывание правила строго позже after_ms (ms UTC)."""
+    r = parse_rule(rule)
+    zone = utc_offset_to_tz(r.tz_str) or tz.tzlocal()
+    start = datetime.fromtimestamp(after_ms / 1000, tz=zone).date()
+    for d in _days(r, start):
+        # несуществующее время (перевод часов вперед) сдвигается на час позже
+        local = tz.resolve_imaginary(datetime(d.year, d.month, d.day, r.hour, r.minute, tzinfo=zone))
+        ms = int(local.timestamp() * 1000)
+        if ms > after_ms:
+            return ms
+
+
+def describe(rule: str) -> str:
+    """Правило для списка /note: 'ежедневно', 'по будням', 'еженедельно, пн', 'ежемесячно, 31-го'."""
+    r = parse_rule(rule)
+    if r.kind == 'daily':
+        return 'ежедневно'
+    if r.kind == 'weekdays':
+        return 'по будням'
+    if r.kind == 'weekly':
+        return f'еженедельно, {WEEKDAY_NAMES[r.day]}'
+    return f'ежемесячно, {r.day}-го'
@@ -0,0 +1,86 @@
+"""
+Предагрегированные итоги транзакций (rollups) для /cash sum.
+Для каждого пользователя хранятся итоги по дням и месяцам UTC в разрезе категорий:
+{категория: [сумма доходов, сумма расходов (<= 0), число транзакций]}.
+Итог за диапазон складывается из целых месяцев и дней (O(дней в диапазоне)),
+а неполные дни на краях диапазона досчитываются по самим транзакциям.
+"""
+
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+DAY_MS = 24 * 60 * 60 * 1000
+_EPOCH = date(1970, 1, 1)
+
+
+def day_key(ts_ms: int) -> str:
+    """Ключ дневного итога: номер дня UTC от эпохи."""
+    return str(ts_ms // DAY_MS)
+
+
+def month_key(ts_ms: int) -> str:
+    d = _EPOCH + timedelta(days=ts_ms // DAY_MS)
+    return f'{d.year:04d}-{d.month:02d}'
+
+
+def add_amount(totals: Dict[str, list], category: str, amount: int):
+    t = totals.setdefault(category, [0, 0, 0])
+    if amount >= 0:
+        t[0] += amount
+    else:
+        t[1] += amount
+    t[2] += 1
+
+
+def merge_totals(totals: Dict[str, list], other: Dict[str, list]):
+    for category, (income, expense, count) in other.items():
+        t = totals.setdefault(category, [0, 0, 0])
+        t[0] += income
+        t[1] += expense
+        t[2] += count
+
+
+def add_to_rollups(rollups: dict, trans: dict):
+    """Учесть транзакцию в итогах пользователя: {'d': {день: итоги}, 'm': {месяц: итоги}}."""
+    ts = trans['timestamp']
+    add_amount(rollups.setdefault('d', {}).setdefault(day_key(ts), {}), trans['category'], trans['amount'])
+    add_amount(rollups.setdefault('m', {}).setdefault(month_key(ts), {}), trans['category'], trans['amount'])
+
+
+def plan_range(start_ts_ms: int, end_ts_ms: int) -> Tuple[List[tuple], List[str], List[str]]:
+    """
+    Разбить [start, end] на неполные края (диапазоны ms для подсчета по транзакциям),
+    целые месяцы и целые дни UTC (ключи итогов).
+    """
+    first = -(-start_ts_ms // DAY_MS)
+    last = (end_ts_ms + 1) // DAY_MS
+    if first >= last:
+        return [(start_ts_ms, end_ts_ms)], [], []
+    edges = []
+    if start_ts_ms < first * DAY_MS:
+        edges.append((start_ts_ms, first * DAY_MS - 1))
+    if last * DAY_MS <= end_ts_ms:
+        edges.append((last * DAY_MS, end_ts_ms))
+    months, days = [], []
+    d = first
+    while d < last:
+        day = _EPOCH + timedelta(days=d)
+        if day.day == 1:
+            next_month = date(day.year + day.month // 12, day.month % 12 + 1, 1)
+            month_end = (next_month - _EPOCH).days
+            if month_end <= last:
+                months.append(f'{day.year:04d}-{day.month:02d}')
+                d = month_end
+                continue
+        days.append(str(d))
+        d += 1
+    return edges, months, days
+
+
+def rollup_rows(rollups_by_user: dict):
+    """Развернуть итоги {user_id: {'d'|'m': {ключ: итоги}}} в строки (user_id, period, bucket, category, income, expense, count)."""
+    for user_id, rollups in rollups_by_user.items():
+        for period, buckets in rollups.items():
+            for bucket, totals in buckets.items():
+                for category, (income, expense, count) in totals.items():
+                    yield int(user_id), period, bucket, category, income, expense, count
@@ -0,0 +1,130 @@
+"""
+Маршрутизация обновлений по обработчикам.
+
+Команда берется из первого слова сообщения и ищется в словаре — одно обращение вместо
+цепочки startswith. Сообщения без известной команды проходят по списку обработчиков
+с заранее скомпилированными шаблонами; обработчик может отказаться (вернуть False),
+тогда пробуется следующий. Callback'и выбираются по префиксу payload до ':'.
+Состояние пользователя (часовой пояс, ожидаемый ввод) и флаги функций читаются
+из хранилища один раз на обновление — при первом обращении.
+
+    router = Router()
+
+    @router.command('/help', exact=True)
+    def help_command(ctx):
+        ...
+
+    @router.pattern(r'^([+-])(\\d+)$')
+    def amount(ctx):
+        amount = int(ctx.match.group(2))
+"""
+
+import re
+from typing import Callable, Dict, List, Optional, Pattern, Tuple, Union
+
+from dispatcher import update_user_id
+
+Handler = Callable[['Context'], Optional[bool]]
+
+
+def split_command(text: str) -> Tuple[str, str]:
+    """Первое слово сообщения в нижнем регистре и остаток строки."""
+    parts = text.split(maxsplit=1)
+    if not parts:
+        return '', ''
+    return parts[0].lower(), parts[1].strip() if len(parts) > 1 else ''
+
+
+class Context:
+    """Обновление, разобранное один раз, и лениво загружаемое состояние пользователя."""
+
+    def __init__(self, storage, update: dict):
+        self.storage = storage
+        self.update = update
+        self.update_type = update.get('update_type')
+        self.user_id = update_user_id(update)
+        msg = update.get('message') or {}
+        self.chat_id = (msg.get('recipient') or {}).get('chat_id')
+        self.text = ((msg.get('body') or {}).get('text') or '').strip()
+        self.command, self.args = split_command(self.text)
+        self.callback = update.get('callback') or {}
+        # результат шаблона для обработчиков из Router.pattern
+        self.match = None
+        self._state = None
+        self._features = None
+
+    @property
+    def state(self) -> dict:
+        """{'tz', 'pending', 'pending_repeat', 'pending_transaction'} — одним чтением из хранилища."""
+        if self._state is None:
+            self._state = self.storage.get_user_state(self.user_id)
+        return self._state
+
+    def feature(self, name: str) -> bool:
+        if self._features is None:
+            self._features = self.storage.get_features()
+        return self._features.get(name, False)
+
+
+class Router:
+    def __init__(self):
+        # команда -> (обработчик, только без аргументов)
+        self.commands: Dict[str, Tuple[Handler, bool]] = {}
+        # обработчики прочих сообщений в порядке проверки
+        self.patterns: List[Tuple[Optional[Pattern], Handler]] = []
+        # префикс payload -> обработчик
+        self.callbacks: Dict[str, Handler] = {}
+        self.default_callback: Optional[Handler] = None
+
+    def command(self, *names: str, exact: bool = False):
+        """Зарегистрировать команду. exact — только без аргументов (иначе сообщение идет дальше)."""
+        def register(handler: Handler) -> Handler:
+            for name in names:
+                self.commands[name.lower()] = (handler, exact)
+            return handler
+        return register
+
+    def pattern(self, regex: Union[str, Pattern, None] = None):
+        """Обработчик сообщений без команды (по regex или готовому шаблону); без regex — для любого текста."""
+        compiled = re.compile(regex) if regex else None
+
+        def register(handler: Handler) -> Handler:
+            self.patterns.append((compiled, handler))
+            return handler
+        return register
+
+    def callback(self, prefix: Optional[str] = None):
+        """Обработчик callback по префиксу payload ('toggle' для 'toggle:...'); без префикса — по умолчанию."""
+        def register(handler: Handler) -> Handler:
+            if prefix is None:
+                self.default_callback = handler
+            else:
+                self.callbacks[prefix] = handler
+            return handler
+        return register
+
+    def dispatch(self, ctx: Context) -> bool:
+        """Передать обновление подходящему обработчику; False, если ни один его не принял."""
+        if ctx.update_type == 'message_created':
+            entry = self.commands.get(ctx.command)
+            if entry is not None:
+                handler, exact = entry
+                if not (exact and ctx.args) and handler(ctx) is not False:
+                    return True
+            for regex, handler in self.patterns:
+                if regex is not None:
+                    ctx.match = regex.match(ctx.text)
+                    if ctx.match is None:
+                        continue
+                if handler(ctx) is not False:
+                    return True
+            return False
+        if ctx.update_type == 'message_callback':
+            payload = ctx.callback.get('payload') or ctx.callback.get('data') or ''
+            if isinstance(payload, str):
+                handler = self.callbacks.get(payload.split(':', 1)[0])
+                if handler is not None and handler(ctx) is not False:
+                    return True
+            if self.default_callback is not None:
+                return self.default_callback(ctx) is not False
+        return False
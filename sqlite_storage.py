@@ -0,0 +1,782 @@
+"""
+Хранилище на SQLite (WAL) с тем же публичным интерфейсом, что и storage.Storage.
+Включается в config.json: "storage_engine": "sqlite", путь к базе — "sqlite_file".
+При первом открытии пустой базы данные однократно переносятся из JSON-файла (storage_file).
+
+Ручная миграция: python sqlite_storage.py data/reminders.json data/reminders.db
+"""
+
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple
+from dateutil import tz
+
+from process_lock import ProcessLock
+from recurrence import next_occurrence
+from storage import EXPORT_CHUNK_SIZE, IMPORT_CHUNK_SIZE, LOCK_WAIT, PERSIST_SECONDS, BatchScope, Storage, chunked
+from archive import ArchivedIds, TransactionArchive, merge_latest, merge_range, needs_archive, retention_cutoffs
+from rollups import add_amount, add_to_rollups, day_key, month_key, plan_range, rollup_rows
+from timezones import UserTzCache
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 6
+
+# Как часто планировщик проверяет изменения базы другими процессами (webhook-воркерами)
+CHANGE_POLL_SECONDS = 1
+# Как часто (раз в столько принятых обновлений) удаляются истекшие записи seen_updates
+SEEN_UPDATES_PURGE_EVERY = 1000
+# Сколько живет разрешенный пояс пользователя в кэше: изменение, сделанное другим
+# процессом, становится видно не позже чем через это время
+USER_TZ_CACHE_SECONDS = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reminders (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    -- захват к доставке (claim_due): до этого момента (ms) напоминание не выдается другим
+    claimed_until INTEGER NOT NULL DEFAULT 0,
+    -- правило повторения (recurrence.py): после доставки time переводится на следующее срабатывание
+    repeat TEXT
+);
+CREATE INDEX IF NOT EXISTS reminders_user_time ON reminders (user_id, time);
+CREATE INDEX IF NOT EXISTS reminders_due ON reminders (time) WHERE sent = 0;
+
+CREATE TABLE IF NOT EXISTS transactions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    timestamp INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_user_ts ON transactions (user_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS pending (user_id INTEGER PRIMARY KEY, ts REAL NOT NULL, repeat TEXT);
+CREATE TABLE IF NOT EXISTS pending_transactions (user_id INTEGER PRIMARY KEY, amount INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS user_timezones (user_id INTEGER PRIMARY KEY, tz TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS features (name TEXT PRIMARY KEY, enabled INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires INTEGER NOT NULL);
+-- принятые обновления (dedupe.update_key) до момента expires (ms): общий дедуп процессов WebHook
+CREATE TABLE IF NOT EXISTS seen_updates (key TEXT PRIMARY KEY, expires INTEGER NOT NULL) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS seen_updates_expires ON seen_updates (expires);
+
+-- итоги транзакций по дням ('d', номер дня UTC) и месяцам ('m', YYYY-MM) в разрезе категорий
+CREATE TABLE IF NOT EXISTS rollups (
+    user_id INTEGER NOT NULL,
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    category TEXT NOT NULL,
+    income INTEGER NOT NULL DEFAULT 0,
+    expense INTEGER NOT NULL DEFAULT 0,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, period, bucket, category)
+) WITHOUT ROWID;
+"""
+
+ROLLUP_UPSERT = (
+    'INSERT INTO rollups (user_id, period, bucket, category, income, expense, count) VALUES (?, ?, ?, ?, ?, ?, ?) '
+    'ON CONFLICT (user_id, period, bucket, category) DO UPDATE SET '
+    'income = income + excluded.income, expense = expense + excluded.expense, count = count + excluded.count'
+)
+
+
+_WRITE_WAIT = LOCK_WAIT.labels('write')
+_COMMIT_SECONDS = PERSIST_SECONDS.labels('sqlite')
+
+
+class _TimedLock:
+    """threading.Lock, учитывающий время ожидания в метрике блокировки хранилища."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._lock.acquire()
+        _WRITE_WAIT.observe(time.perf_counter() - start)
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+
+def _reminder_row(row):
+    r = {'id': row[0], 'user_id': row[1], 'time': row[2], 'text': row[3], 'sent': bool(row[4])}
+    if row[5]:
+        r['repeat'] = row[5]
+    return r
+
+
+def _transaction_row(row):
+    return {'id': row[0], 'user_id': row[1], 'amount': row[2], 'category': row[3], 'timestamp': row[4]}
+
+
+class SQLiteStorage:
+    def __init__(self, path: str, max_per_user: int = 10, migrate_from: Optional[str] = None,
+                 persist_policy: str = 'immediate', archive_dir: Optional[str] = None,
+                 retention_sent_days: float = 0, retention_transactions_days: float = 0,
+                 retention_interval_minutes: float = 60):
+        self.path = path
+        self.max_per_user = max_per_user
+        # Хранение и архив — как в storage.Storage (общий формат архива)
+        self.archive = TransactionArchive(archive_dir or os.path.join(os.path.dirname(path), 'archive'))
+        self.retention_sent_days = retention_sent_days
+        self.retention_transactions_days = retention_transactions_days
+        self.retention_interval = retention_interval_minutes * 60
+        self._closed = False
+        # проход хранения выполняет только один из процессов, открывших базу
+        self._retention_lock = ProcessLock(path + '.retention.lock')
+        self.lock = _TimedLock()
+        self._reminders_changed = threading.Event()
+        self._user_tz = UserTzCache(ttl_seconds=USER_TZ_CACHE_SECONDS)
+        # Открытая транзакция пачки batch(): соединение записи одно, поэтому ее держит
+        # открывший пачку поток, а записи вне пачки ждут фиксации (см. _writing)
+        self._txn_lock = threading.Lock()
+        self._seen_writes = 0
+        # пачка потока (BatchScope) и соединение для чтения, по одному на поток (см. _read);
+        # соединения чтения по потокам — закрываются в close() и после завершения потока
+        self._local = threading.local()
+        self._readers = {}
+        self._readers_lock = threading.Lock()
+        # autocommit: многошаговые изменения открывают транзакцию явно (BEGIN ... COMMIT)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        # Политика сохранения: 'immediate' — fsync на каждый COMMIT (FULL); отложенные политики
+        # отдаются SQLite: в режиме WAL с NORMAL fsync выполняется при checkpoint,
+        # потеряться могут только последние транзакции при сбое ОС, но не целостность базы
+        self._conn.execute('PRAGMA synchronous=' + ('FULL' if persist_policy == 'immediate' else 'NORMAL'))
+        self._conn.execute('PRAGMA busy_timeout=5000')
+        self._init_schema(migrate_from)
+        self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if (retention_sent_days > 0 or retention_transactions_days > 0) and self.retention_interval > 0:
+            threading.Thread(target=self._retention, daemon=True).start()
+
+    def _init_schema(self, migrate_from: Optional[str]):
+        """
+        Создать или обновить схему. Версия записывается в той же транзакции, что и обновление
+        и перенос данных из JSON: если они не завершились, следующий запуск повторит их.
+        Межпроцессная блокировка не дает двум процессам, открывшим базу одновременно,
+        выполнить перенос и пересчет итогов дважды.
+        """
+        with ProcessLock(self.path + '.schema.lock'), self.lock:
+            version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            # CREATE ... IF NOT EXISTS повторяемы; executescript фиксирует открытую транзакцию,
+            # поэтому выполняется до BEGIN
+            self._conn.executescript(SCHEMA)
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if version:
+                    # обновление схемы существующей базы: новые таблицы и пересчет итогов
+                    if version < 3:
+                        self._backfill_rollups()
+                    if version < 4:
+                        self._conn.execute('ALTER TABLE reminders ADD COLUMN claimed_until INTEGER NOT NULL DEFAULT 0')
+                    if version < 5:
+                        self._conn.execute('ALTER TABLE reminders ADD COLUMN repeat TEXT')
+                        self._conn.execute('ALTER TABLE pending ADD COLUMN repeat TEXT')
+                else:
+                    self._conn.execute("INSERT OR IGNORE INTO features (name, enabled) VALUES ('notifications', 1), ('transactions', 1)")
+                    if migrate_from and (os.path.exists(migrate_from) or os.path.exists(migrate_from + '.wal')):
+                        self._import_json(migrate_from)
+                self._conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _backfill_rollups(self):
+        """Посчитать итоги по всем транзакциям, включая архив (вызывать под self.lock)."""
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'archived_before'").fetchone()
+        archived_before = row[0] if row else 0
+        rollups = {}
+        sources = [map(_transaction_row, self._conn.execute(
+            'SELECT id, user_id, amount, category, timestamp FROM transactions'))]
+        if archived_before:
+            hot_ids = {r[0] for r in self._conn.execute('SELECT id FROM transactions')}
+            sources.append(t for t in self.archive.scan(archived_before) if t['id'] not in hot_ids)
+        for source in sources:
+            for t in source:
+                add_to_rollups(rollups.setdefault(t['user_id'], {}), t)
+        self._conn.executemany(ROLLUP_UPSERT, rollup_rows(rollups))
+
+    def _in_batch(self) -> bool:
+        return getattr(self._local, 'batch', None) is not None
+
+    @contextmanager
+    def _writing(self):
+        """Доступ к соединению записи; вне batch() — после фиксации пачки, открытой другим потоком."""
+        if self._in_batch():
+            with self.lock:
+                yield
+        else:
+            with self._txn_lock, self.lock:
+                yield
+
+    def _write(self, sql: str, params=()):
+        if self._in_batch():
+            return self._conn.execute(sql, params)
+        # вне batch() каждая запись — отдельная транзакция с фиксацией на диск
+        start = time.perf_counter()
+        cursor = self._conn.execute(sql, params)
+        _COMMIT_SECONDS.observe(time.perf_counter() - start)
+        return cursor
+
+    def _read(self, sql: str, params=()) -> list:
+        """
+        Выполнить чтение. Вне batch() — через отдельное соединение потока: в режиме WAL
+        читатели не блокируют друг друга и писателя и видят последнее зафиксированное
+        состояние. Внутри batch() — через общее соединение, чтобы видеть еще не
+        зафиксированные изменения пачки.
+        """
+        if self._in_batch():
+            with self.lock:
+                return self._conn.execute(sql, params).fetchall()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA busy_timeout=5000')
+            conn.execute('PRAGMA query_only=1')
+            self._local.conn = conn
+            with self._readers_lock:
+                # потоки пулов (uvicorn, доставка) сменяются: соединения завершившихся закрываются
+                for thread in [t for t in self._readers if not t.is_alive()]:
+                    self._readers.pop(thread).close()
+                self._readers[threading.current_thread()] = conn
+        return conn.execute(sql, params).fetchall()
+
+    def _read_one(self, sql: str, params=()):
+        rows = self._read(sql, params)
+        return rows[0] if rows else None
+
+    @contextmanager
+    def batch(self, scope: Optional[BatchScope] = None):
+        """
+        Сгруппировать изменения потока в одну транзакцию SQLite (COMMIT при закрытии
+        внешнего блока). Как и в Storage.batch, пачка принадлежит открывшему ее потоку,
+        другой поток присоединяется к ней, передав scope, который возвращает batch().
+        Записи остальных потоков ждут фиксации пачки. В отличие от Storage.batch,
+        исключение из внешнего блока откатывает всю транзакцию.
+        """
+        previous = getattr(self._local, 'batch', None)
+        scope = scope or previous
+        if scope is None:
+            scope = BatchScope()
+            self._txn_lock.acquire()
+            try:
+                with self.lock:
+                    self._conn.execute('BEGIN IMMEDIATE')
+            except BaseException:
+                self._txn_lock.release()
+                raise
+        with self.lock:
+            scope.depth += 1
+        self._local.batch = scope
+        failed = False
+        try:
+            yield scope
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._local.batch = previous
+            with self.lock:
+                scope.depth -= 1
+                if not scope.depth:
+                    self._end_transaction(commit=not failed)
+
+    def _end_transaction(self, commit: bool):
+        """Зафиксировать или откатить транзакцию пачки (под self.lock); неудачный COMMIT откатывается."""
+        try:
+            if commit:
+                start = time.perf_counter()
+                self._conn.execute('COMMIT')
+                _COMMIT_SECONDS.observe(time.perf_counter() - start)
+        finally:
+            try:
+                if self._conn.in_transaction:
+                    self._conn.execute('ROLLBACK')
+            finally:
+                self._txn_lock.release()
+
+    def flush(self):
+        """Перенести WAL в файл базы с fsync (изменения уже зафиксированы в COMMIT)."""
+        with self._writing():
+            self._conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+    def close(self):
+        """Хук остановки: checkpoint и закрытие соединений (записи и чтения всех потоков)."""
+        self._closed = True
+        self.flush()
+        with self._writing():
+            self._conn.close()
+        with self._readers_lock:
+            readers, self._readers = self._readers, {}
+        for conn in readers.values():
+            conn.close()
+
+    def migrate_from_json(self, json_path: str):
+        """Однократно перенести данные из JSON-хранилища (включая журнал, если он есть). Повторный запуск безопасен."""
+        with self.batch(), self.lock:
+            self._import_json(json_path)
+
+    def _import_json(self, json_path: str):
+        """
+        Скопировать данные файлового хранилища в открытую транзакцию (вызывать под self.lock).
+        Источник — явно указанный файл хранилища, поэтому читается и двоичный снимок.
+        """
+        engine = 'journal' if os.path.exists(json_path + '.wal') else 'json'
+        source = Storage(json_path, engine=engine, snapshot_format='binary')
+        data = source._data
+        source.close()
+        self._conn.executemany(
+            'INSERT OR IGNORE INTO reminders (id, user_id, time, text, sent, repeat) VALUES (?, ?, ?, ?, ?, ?)',
+            ((r['id'], r['user_id'], r['time'], r['text'], int(bool(r.get('sent'))), r.get('repeat'))
+             for r in data.get('reminders', [])),
+        )
+        self._conn.executemany(
+            'INSERT OR IGNORE INTO transactions (id, user_id, amount, category, timestamp) VALUES (?, ?, ?, ?, ?)',
+            ((t['id'], t['user_id'], t['amount'], t['category'], t['timestamp']) for t in data.get('transactions', [])),
+        )
+        pending_repeat = data.get('pending_repeat', {})
+        self._conn.executemany('INSERT OR REPLACE INTO pending (user_id, ts, repeat) VALUES (?, ?, ?)',
+                               ((int(k), v, pending_repeat.get(k)) for k, v in data.get('pending', {}).items()))
+        self._conn.executemany('INSERT OR REPLACE INTO pending_transactions (user_id, amount) VALUES (?, ?)',
+                               ((int(k), v) for k, v in data.get('pending_transactions', {}).items()))
+        self._conn.executemany('INSERT OR REPLACE INTO user_timezones (user_id, tz) VALUES (?, ?)',
+                               ((int(k), v) for k, v in data.get('user_timezones', {}).items()))
+        self._conn.executemany('INSERT OR REPLACE INTO features (name, enabled) VALUES (?, ?)',
+                               ((k, int(bool(v))) for k, v in data.get('features', {}).items()))
+        self._conn.executemany(ROLLUP_UPSERT, rollup_rows(data.get('rollups', {})))
+        if data.get('archived_before'):
+            self._set_archived_before(data['archived_before'])
+        if data.get('long_poll_marker') is not None:
+            # напрямую: set_marker берет self.lock, который уже захвачен
+            self._conn.execute("INSERT INTO meta (key, value) VALUES ('long_poll_marker', ?) "
+                               "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                               (data['long_poll_marker'],))
+        logger.info('Migrated %d reminders and %d transactions from %s',
+                    len(data.get('reminders', [])), len(data.get('transactions', [])), json_path)
+
+    def _retention(self):
+        while not self._closed:
+            try:
+                self.apply_retention()
+            except Exception:
+                logger.exception('Retention pass failed')
+            time.sleep(self.retention_interval)
+
+    def _archived_before(self) -> int:
+        row = self._read_one("SELECT value FROM meta WHERE key = 'archived_before'")
+        return row[0] if row else 0
+
+    def _set_archived_before(self, ts_ms: int):
+        """Сдвинуть границу архива вперед (вызывать под self.lock)."""
+        self._write("INSERT INTO meta (key, value) VALUES ('archived_before', ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)", (ts_ms,))
+
+    def apply_retention(self, now_ms: Optional[int] = None) -> tuple:
+        """
+        Удалить отправленные напоминания старше срока хранения и перенести холодные
+        транзакции в архив. Возвращает (удалено напоминаний, перенесено транзакций).
+        """
+        if not self._retention_lock.try_acquire():
+            return 0, 0
+        try:
+            return self._apply_retention(now_ms)
+        finally:
+            self._retention_lock.release()
+
+    def _apply_retention(self, now_ms: Optional[int]) -> tuple:
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        sent_before, archived_before = retention_cutoffs(now_ms, self.retention_sent_days, self.retention_transactions_days)
+        purged = self._read_one('SELECT COUNT(*) FROM reminders WHERE sent = 1 AND time < ?', (sent_before,))[0]
+        cold = [_transaction_row(r) for r in self._read(
+            'SELECT id, user_id, amount, category, timestamp FROM transactions WHERE timestamp < ? ORDER BY timestamp, seq',
+            (archived_before,)
+        )]
+        if not purged and not cold:
+            return 0, 0
+        # Архив пишется (с fsync) до удаления из базы: сбой между шагами оставляет лишь дубли в архиве
+        self.archive.append(cold)
+        with self.batch(), self.lock:
+            self._write('DELETE FROM reminders WHERE sent = 1 AND time < ?', (sent_before,))
+            self._conn.executemany('DELETE FROM transactions WHERE id = ?', ((t['id'],) for t in cold))
+            self._set_archived_before(archived_before)
+        logger.info('Retention: purged %d sent reminders, archived %d transactions', purged, len(cold))
+        return purged, len(cold)
+
+    def compact(self):
+        """Перенести WAL в основной файл базы (аналог сворачивания журнала)."""
+        with self._writing():
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def set_pending_text(self, user_id: int, dt, repeat: Optional[str] = None):
+        with self._writing():
+            # Сохранить как UTC timestamp (dt ожидается timezone-aware)
+            self._write('INSERT OR REPLACE INTO pending (user_id, ts, repeat) VALUES (?, ?, ?)',
+                        (user_id, dt.astimezone(tz.tzutc()).timestamp(), repeat))
+
+    def get_pending(self, user_id: int):
+        row = self._read_one('SELECT ts FROM pending WHERE user_id = ?', (user_id,))
+        if row and row[0]:
+            # вернуть timezone-aware UTC datetime для ожидающего времени
+            return datetime.fromtimestamp(row[0], tz=tz.tzutc())
+        return None
+
+    def clear_pending(self, user_id: int):
+        with self._writing():
+            self._write('DELETE FROM pending WHERE user_id = ?', (user_id,))
+
+    def set_user_tz(self, user_id: int, tz_str: str):
+        """Установить строку часового пояса пользователя (IANA или UTC offset)."""
+        with self._writing():
+            self._write('INSERT OR REPLACE INTO user_timezones (user_id, tz) VALUES (?, ?)', (user_id, tz_str))
+        self._user_tz.invalidate(user_id)
+
+    def get_user_tz(self, user_id: int):
+        """Получить строку часового пояса пользователя или None."""
+        row = self._read_one('SELECT tz FROM user_timezones WHERE user_id = ?', (user_id,))
+        return row[0] if row else None
+
+    def get_user_tzinfo(self, user_id: int):
+        """Часовой пояс пользователя как tzinfo (None, если не задан); строка разбирается один раз."""
+        return self._user_tz.get(user_id, lambda: self.get_user_tz(user_id))
+
+    def get_user_state(self, user_id: int) -> dict:
+        """Часовой пояс и ожидаемый ввод пользователя одним запросом (для обработки обновления)."""
+        tz_str, ts, repeat, amount = self._read_one(
+            'SELECT (SELECT tz FROM user_timezones WHERE user_id = ?), (SELECT ts FROM pending WHERE user_id = ?), '
+            '(SELECT repeat FROM pending WHERE user_id = ?), (SELECT amount FROM pending_transactions WHERE user_id = ?)',
+            (user_id, user_id, user_id, user_id)
+        )
+        return {
+            'tz': tz_str,
+            'pending': datetime.fromtimestamp(ts, tz=tz.tzutc()) if ts else None,
+            'pending_transaction': amount,
+            'pending_repeat': repeat,
+        }
+
+    def clear_user_tz(self, user_id: int):
+        with self._writing():
+            self._write('DELETE FROM user_timezones WHERE user_id = ?', (user_id,))
+        self._user_tz.invalidate(user_id)
+
+    def add_reminder(self, user_id: int, time_ms: int, text: str, repeat: Optional[str] = None):
+        """
+        Разовое напоминание или, с repeat (строка правила recurrence), повторяющееся — одна строка на правило.
+        Проверка лимита и вставка — одна транзакция BEGIN IMMEDIATE: другой процесс не добавит между ними.
+        """
+        with self.batch(), self.lock:
+            count = self._conn.execute('SELECT COUNT(*) FROM reminders WHERE user_id = ? AND sent = 0', (user_id,)).fetchone()[0]
+            if count >= self.max_per_user:
+                return False, f'Достигнут лимит напоминаний ({self.max_per_user})'
+            self._write('INSERT INTO reminders (id, user_id, time, text, sent, repeat) VALUES (?, ?, ?, ?, 0, ?)',
+                        (str(uuid.uuid4()), user_id, time_ms, text, repeat))
+            self._reminders_changed.set()
+            return True, 'Напоминание установлено'
+
+    def list_reminders(self, user_id: int):
+        rows = self._read(
+            'SELECT id, user_id, time, text, sent, repeat FROM reminders WHERE user_id = ? AND sent = 0 ORDER BY seq', (user_id,)
+        )
+        return [_reminder_row(r) for r in rows]
+
+    def delete_reminder_by_index(self, user_id: int, idx: int):
+        if idx < 0:
+            return False
+        # выбор по номеру и удаление — одна транзакция: номер не сдвигается удалением в другом процессе
+        with self.batch(), self.lock:
+            row = self._conn.execute(
+                'SELECT seq FROM reminders WHERE user_id = ? AND sent = 0 ORDER BY seq LIMIT 1 OFFSET ?', (user_id, idx)
+            ).fetchone()
+            if not row:
+                return False
+            self._write('DELETE FROM reminders WHERE seq = ?', (row[0],))
+            return True
+
+    def get_due(self, now_ms: int):
+        rows = self._read(
+            'SELECT id, user_id, time, text, sent, repeat FROM reminders WHERE sent = 0 AND time <= ? ORDER BY time', (now_ms,)
+        )
+        return [_reminder_row(r) for r in rows]
+
+    def claim_due(self, now_ms: int, holder: str, ttl_ms: int):
+        """
+        Атомарно (BEGIN IMMEDIATE, в том числе между процессами) захватить наступившие
+        напоминания для доставки: claim -> send -> mark_sent. Захват, не завершенный
+        отметкой об отправке за ttl_ms, истекает, и напоминание выдается снова.
+        """
+        with self.batch(), self.lock:
+            rows = self._conn.execute(
+                'SELECT id, user_id, time, text, sent, repeat FROM reminders '
+                'WHERE sent = 0 AND time <= ? AND claimed_until <= ? ORDER BY time', (now_ms, now_ms)
+            ).fetchall()
+            self._conn.executemany('UPDATE reminders SET claimed_until = ? WHERE id = ?',
+                                   ((now_ms + ttl_ms, r[0]) for r in rows))
+        return [_reminder_row(r) for r in rows]
+
+    def acquire_lease(self, name: str, holder: str, ttl_ms: int) -> bool:
+        """Захватить или продлить аренду name; False, если ее держит другой владелец."""
+        now_ms = int(time.time() * 1000)
+        with self.batch(), self.lock:
+            row = self._conn.execute('SELECT holder, expires FROM leases WHERE name = ?', (name,)).fetchone()
+            if row and row[0] != holder and row[1] > now_ms:
+                return False
+            self._write('INSERT OR REPLACE INTO leases (name, holder, expires) VALUES (?, ?, ?)', (name, holder, now_ms + ttl_ms))
+            return True
+
+    def release_lease(self, name: str, holder: str):
+        with self._writing():
+            self._write('DELETE FROM leases WHERE name = ? AND holder = ?', (name, holder))
+
+    def mark_update_seen(self, key: str, ttl_ms: int) -> bool:
+        """Запомнить принятое обновление на ttl_ms; False, если его уже принял этот или другой процесс."""
+        now_ms = int(time.time() * 1000)
+        with self._writing():
+            cursor = self._write('INSERT INTO seen_updates (key, expires) VALUES (?, ?) '
+                                 'ON CONFLICT (key) DO UPDATE SET expires = excluded.expires WHERE expires <= ?',
+                                 (key, now_ms + ttl_ms, now_ms))
+            self._seen_writes += 1
+            if self._seen_writes % SEEN_UPDATES_PURGE_EVERY == 0:
+                self._write('DELETE FROM seen_updates WHERE expires <= ?', (now_ms,))
+            return cursor.rowcount > 0
+
+    def forget_update(self, key: str):
+        """Забыть обновление, не принятое в обработку (mark_update_seen снова вернет True)."""
+        with self._writing():
+            self._write('DELETE FROM seen_updates WHERE key = ?', (key,))
+
+    def next_due_ms(self) -> Optional[int]:
+        """
+        Время (ms) ближайшего неотправленного и не захваченного напоминания или None.
+        Наступившие учитываются тоже: напоминание, срок которого пришел между claim_due
+        и этим вызовом, иначе ждало бы до следующего пробуждения планировщика.
+        """
+        now_ms = int(datetime.now(tz=tz.tzutc()).timestamp() * 1000)
+        row = self._read_one('SELECT MIN(time) FROM reminders WHERE sent = 0 AND claimed_until <= ?', (now_ms,))
+        return row[0] if row else None
+
+    def wait_for_reminders(self, timeout: Optional[float]) -> bool:
+        """
+        Ждать добавления напоминания (или смены флагов) не дольше timeout секунд.
+        Изменения, сделанные другими процессами, замечаются по PRAGMA data_version
+        не позже чем через CHANGE_POLL_SECONDS.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = CHANGE_POLL_SECONDS if deadline is None else min(CHANGE_POLL_SECONDS, max(0, deadline - time.monotonic()))
+            if self._reminders_changed.wait(wait):
+                self._reminders_changed.clear()
+                return True
+            if self._changed_by_others():
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def _changed_by_others(self) -> bool:
+        with self.lock:
+            version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        changed = version != self._data_version
+        self._data_version = version
+        return changed
+
+    def mark_sent(self, rid: str):
+        self.mark_sent_many([rid])
+
+    def mark_sent_many(self, rids: List[str]):
+        """
+        Отметить отправленными сразу несколько напоминаний одной транзакцией.
+        Повторяющиеся остаются активными и переводятся на следующее срабатывание
+        (пропущенные за время простоя не наверстываются).
+        """
+        if not rids:
+            return
+        now_ms = int(time.time() * 1000)
+        with self.batch(), self.lock:
+            rearm = []
+            for rid in rids:
+                row = self._conn.execute(
+                    'SELECT time, repeat FROM reminders WHERE id = ? AND sent = 0 AND repeat IS NOT NULL', (rid,)
+                ).fetchone()
+                # уже переведенное вперед (повторная отметка) не трогаем
+                if row and row[0] <= now_ms:
+                    rearm.append((next_occurrence(row[1], now_ms), rid))
+            self._conn.executemany('UPDATE reminders SET sent = 1 WHERE id = ? AND repeat IS NULL', ((rid,) for rid in rids))
+            self._conn.executemany('UPDATE reminders SET time = ?, claimed_until = 0 WHERE id = ?', rearm)
+        if rearm:
+            self._reminders_changed.set()
+
+    def set_pending_transaction_amount(self, user_id: int, amount: int):
+        """Сохранить сумму (+/-) и ожидать категорию."""
+        with self._writing():
+            self._write('INSERT OR REPLACE INTO pending_transactions (user_id, amount) VALUES (?, ?)', (user_id, amount))
+
+    def get_pending_transaction_amount(self, user_id: int):
+        """Получить ожидающую сумму транзакции или None."""
+        row = self._read_one('SELECT amount FROM pending_transactions WHERE user_id = ?', (user_id,))
+        return row[0] if row else None
+
+    def clear_pending_transaction(self, user_id: int):
+        with self._writing():
+            self._write('DELETE FROM pending_transactions WHERE user_id = ?', (user_id,))
+
+    def add_transaction(self, user_id: int, amount: int, category: str, timestamp_ms: int):
+        """Добавить транзакцию в историю."""
+        income, expense = (amount, 0) if amount >= 0 else (0, amount)
+        with self.batch(), self.lock:
+            self._write('INSERT INTO transactions (id, user_id, amount, category, timestamp) VALUES (?, ?, ?, ?, ?)',
+                        (str(uuid.uuid4()), user_id, amount, category, timestamp_ms))
+            self._conn.executemany(ROLLUP_UPSERT, (
+                (user_id, 'd', day_key(timestamp_ms), category, income, expense, 1),
+                (user_id, 'm', month_key(timestamp_ms), category, income, expense, 1),
+            ))
+            return True
+
+    def import_transactions(self, rows: Iterable[dict], chunk_size: int = IMPORT_CHUNK_SIZE) -> Tuple[int, int]:
+        """
+        Загрузить транзакции пачками по chunk_size: одна транзакция SQLite на пачку, итоги
+        обновляются одной группой строк. Строки с id, который уже есть в базе или в архиве,
+        пропускаются. Возвращает (добавлено, пропущено); см. Storage.import_transactions.
+        """
+        archived = ArchivedIds(self.archive)
+        added = skipped = 0
+        for chunk in chunked(rows, chunk_size):
+            archived_before = self._archived_before()
+            fresh = [t for t in chunk if not archived.contains(t, archived_before)]
+            rollups, chunk_added = {}, 0
+            with self.batch(), self.lock:
+                for t in fresh:
+                    t = dict(t, id=t.get('id') or str(uuid.uuid4()))
+                    cursor = self._conn.execute(
+                        'INSERT OR IGNORE INTO transactions (id, user_id, amount, category, timestamp) VALUES (?, ?, ?, ?, ?)',
+                        (t['id'], t['user_id'], t['amount'], t['category'], t['timestamp']))
+                    if cursor.rowcount:
+                        add_to_rollups(rollups.setdefault(t['user_id'], {}), t)
+                        chunk_added += 1
+                self._conn.executemany(ROLLUP_UPSERT, rollup_rows(rollups))
+            added += chunk_added
+            skipped += len(chunk) - chunk_added
+        return added, skipped
+
+    def iter_transactions(self, user_id: Optional[int] = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[dict]:
+        """
+        Все транзакции пользователя (по времени) или всей базы (по порядку добавления), включая
+        архив, порциями по chunk_size строк с продолжением по ключу — без OFFSET и без долгого чтения.
+        """
+        if user_id is None:
+            sql = ('SELECT id, user_id, amount, category, timestamp, seq FROM transactions '
+                   'WHERE seq > ? ORDER BY seq LIMIT ?')
+            key = (0,)
+        else:
+            sql = ('SELECT id, user_id, amount, category, timestamp, seq FROM transactions '
+                   'WHERE user_id = ? AND (timestamp, seq) > (?, ?) ORDER BY timestamp, seq LIMIT ?')
+            key = (user_id, -2 ** 63, 0)
+        while True:
+            rows = self._read(sql, key + (chunk_size,))
+            for r in rows:
+                yield _transaction_row(r)
+            if len(rows) < chunk_size:
+                break
+            last = rows[-1]
+            key = (last[5],) if user_id is None else (user_id, last[4], last[5])
+        archived_before = self._archived_before()
+        if archived_before:
+            yield from self.archive.stream(user_id, archived_before)
+
+    def get_transactions(self, user_id: int, limit: int = 10):
+        """Получить последние транзакции пользователя."""
+        rows = self._read(
+            'SELECT id, user_id, amount, category, timestamp FROM transactions WHERE user_id = ? '
+            'ORDER BY timestamp DESC, seq DESC LIMIT ?', (user_id, limit)
+        )
+        latest = [_transaction_row(r) for r in rows]
+        archived_before = self._archived_before()
+        if needs_archive(latest, limit, archived_before):
+            return merge_latest(self.archive.latest(user_id, limit, archived_before), latest, limit)
+        return latest
+
+    def get_transactions_in_range(self, user_id: int, start_ts_ms: int, end_ts_ms: int):
+        """Получить транзакции пользователя в диапазоне [start, end] включительно (временные метки в ms), по возрастанию времени."""
+        rows = self._read(
+            'SELECT id, user_id, amount, category, timestamp FROM transactions '
+            'WHERE user_id = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp, seq', (user_id, start_ts_ms, end_ts_ms)
+        )
+        hot = [_transaction_row(r) for r in rows]
+        archived_before = self._archived_before()
+        if start_ts_ms < archived_before:
+            return merge_range(self.archive.range(user_id, start_ts_ms, end_ts_ms, archived_before), hot)
+        return hot
+
+    def get_transaction_summary(self, user_id: int, start_ts_ms: int, end_ts_ms: int) -> dict:
+        """Итоги за [start, end] по категориям: {категория: [доходы, расходы, число]} (по предагрегированным итогам)."""
+        edges, months, days = plan_range(start_ts_ms, end_ts_ms)
+        totals = {}
+        for period, keys in (('m', months), ('d', days)):
+            if not keys:
+                continue
+            rows = self._read(
+                'SELECT category, SUM(income), SUM(expense), SUM(count) FROM rollups '
+                f'WHERE user_id = ? AND period = ? AND bucket IN ({",".join("?" * len(keys))}) GROUP BY category',
+                (user_id, period, *keys)
+            )
+            for category, income, expense, count in rows:
+                t = totals.setdefault(category, [0, 0, 0])
+                t[0] += income
+                t[1] += expense
+                t[2] += count
+        for start, end in edges:
+            for t in self.get_transactions_in_range(user_id, start, end):
+                add_amount(totals, t['category'], t['amount'])
+        return totals
+
+    # Методы для флагов функций
+    def set_feature(self, name: str, enabled: bool):
+        """Установить флаг функции (глобально). Примеры имен: 'notifications', 'transactions'."""
+        with self._writing():
+            self._write('INSERT OR REPLACE INTO features (name, enabled) VALUES (?, ?)', (name, int(bool(enabled))))
+        self._reminders_changed.set()
+
+    def get_feature(self, name: str) -> bool:
+        """Получить значение флага функции; по умолчанию False, если отсутствует."""
+        row = self._read_one('SELECT enabled FROM features WHERE name = ?', (name,))
+        return bool(row[0]) if row else False
+
+    def get_features(self) -> dict:
+        """Все флаги функций: имя -> bool."""
+        return {name: bool(enabled) for name, enabled in self._read('SELECT name, enabled FROM features')}
+
+    def set_marker(self, marker: int):
+        """Запомнить marker long-polling; внутри batch() фиксируется вместе с изменениями пачки."""
+        with self._writing():
+            self._write("INSERT INTO meta (key, value) VALUES ('long_poll_marker', ?) "
+                        "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (marker,))
+
+    def get_marker(self) -> Optional[int]:
+        """marker последней обработанной пачки long-polling или None."""
+        row = self._read_one("SELECT value FROM meta WHERE key = 'long_poll_marker'")
+        return row[0] if row else None
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if len(sys.argv) != 3:
+        print('Использование: python sqlite_storage.py <reminders.json> <reminders.db>')
+        sys.exit(1)
+    storage = SQLiteStorage(sys.argv[2])
+    storage.migrate_from_json(sys.argv[1])
+    storage.close()
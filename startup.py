@@ -0,0 +1,83 @@
+"""
+Замеры холодного старта и готовность процесса.
+
+Этапы отсчитываются от запуска процесса (по /proc, иначе — от импорта этого модуля):
+bot_imported, storage_loaded, ready (обновления принимаются), first_update (обработано
+первое обновление). Каждый этап пишется в лог один раз и отдается в /metrics
+(maxon_startup_seconds{phase=...}) и /ready.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _process_start_time() -> float:
+    """Время запуска процесса (Unix time); включает старт интерпретатора и импорты."""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # поля после имени процесса в скобках; starttime — 22-е поле stat
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return time.time() - max(0.0, age)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+
+PROCESS_START = _process_start_time()
+
+STARTUP_SECONDS = metrics.Gauge('maxon_startup_seconds', 'Время от запуска процесса до этапа старта', ('phase',))
+
+_phases: Dict[str, float] = {}
+_lock = threading.Lock()
+_ready = threading.Event()
+_failure = None
+
+
+def mark(phase: str) -> float:
+    """Отметить этап старта (повторные отметки игнорируются); секунды от запуска процесса."""
+    with _lock:
+        if phase in _phases:
+            return _phases[phase]
+        seconds = _phases[phase] = time.time() - PROCESS_START
+    STARTUP_SECONDS.labels(phase).set(seconds)
+    logger.info('Startup: %s after %.3fs', phase, seconds)
+    return seconds
+
+
+def first_update():
+    """Вызывается на каждое обработанное обновление; отмечается только первое."""
+    if 'first_update' not in _phases:
+        mark('first_update')
+
+
+def set_ready():
+    mark('ready')
+    _ready.set()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def set_failed(reason: str):
+    """Старт не удался (например, хранилище занято другим процессом): процесс нужно перезапустить."""
+    global _failure
+    _failure = reason
+
+
+def failure():
+    return _failure
+
+
+def phases() -> Dict[str, float]:
+    with _lock:
+        return {phase: round(seconds, 3) for phase, seconds in _phases.items()}
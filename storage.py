@@ -1,37 +1,727 @@
+import bisect
+import gc
+import heapq
+import itertools
 import json
+import logging
+import mmap
+import os
+import pickle
 import threading
+import time
 import uuid
-from typing import List, Optional
+from contextlib import contextmanager
+from operator import attrgetter, itemgetter
+from typing import Iterable, Iterator, List, Optional, Tuple
 from dateutil import tz
 
+from metrics import Counter, Histogram
+from process_lock import ProcessLock
+from archive import ArchivedIds, TransactionArchive, merge_latest, merge_range, needs_archive, retention_cutoffs
+from records import Reminder, Transaction, compact_id, record_json
+from recurrence import next_occurrence
+from rollups import add_amount, add_to_rollups, merge_totals, plan_range
+from timezones import UserTzCache
+
+logger = logging.getLogger(__name__)
+
+# Поддерживаемые движки хранения:
+#   'json'    — весь документ перезаписывается при каждом изменении (исходное поведение)
+#   'journal' — каждое изменение дописывается компактной строкой в журнал (<path>.wal),
+#               журнал периодически сворачивается в снимок (<path>) фоновым потоком
+#   'sqlite'  — отдельная реализация sqlite_storage.SQLiteStorage (см. open_storage)
+ENGINES = ('json', 'journal')
+
+# Политики сохранения (persist_policy):
+#   'immediate' — каждое изменение (или batch) сразу пишется на диск с fsync
+#   'interval'  — фоновый поток сбрасывает накопленные изменения раз в persist_interval_ms
+#   'count'     — сброс после persist_every изменений, но не реже раза в persist_interval_ms
+PERSIST_POLICIES = ('immediate', 'interval', 'count')
+
+# Формат снимка (snapshot_format):
+#   'json'   — документ JSON (читаемый, но медленный при загрузке большой истории)
+#   'binary' — заголовок SNAPSHOT_MAGIC и pickle документа, в котором напоминания и
+#              транзакции — кортежи полей; файл читается через mmap без лишней копии
+# При загрузке формат определяется по содержимому файла, поэтому смена настройки
+# вступает в силу со следующего снимка. Двоичный снимок (pickle) загружается только
+# при snapshot_format 'binary': его не читают прежние версии и внешние инструменты,
+# поэтому он включается явно. JSON остается форматом выгрузки (export_json).
+SNAPSHOT_FORMATS = ('json', 'binary')
+SNAPSHOT_MAGIC = b'MAXON-SNAPSHOT 1\n'
+# протокол фиксирован: снимок, записанный новой версией Python, читается и более старой
+SNAPSHOT_PICKLE_PROTOCOL = 5
+
+# Выгрузка и загрузка истории транзакций (ledger.py): записей за одно взятие блокировки
+# при чтении и на одно изменение (одну строку журнала, одно сохранение) при импорте
+EXPORT_CHUNK_SIZE = 1000
+IMPORT_CHUNK_SIZE = 10000
+
+
+
+
+class BinarySnapshotError(RuntimeError):
+    """Двоичный снимок при snapshot_format 'json': файл не трогается, запуск прерывается."""
+
+
+_tx_time = attrgetter('timestamp')
+_rem_time = attrgetter('time')
+
+LOCK_WAIT = Histogram('maxon_storage_lock_wait_seconds', 'Ожидание блокировки хранилища', ('mode',))
+PERSIST_SECONDS = Histogram('maxon_storage_persist_seconds', 'Длительность сохранения изменений на диск (с fsync)', ('engine',))
+PERSIST_BYTES = Counter('maxon_storage_persist_bytes_total', 'Байт записано при сохранении изменений', ('engine',))
+_READ_WAIT = LOCK_WAIT.labels('read')
+_WRITE_WAIT = LOCK_WAIT.labels('write')
+
+
+class RWLock:
+    """
+    Блокировка «читатели-писатель» с приоритетом писателя.
+    `with lock:` — эксклюзивный доступ (запись), `with lock.read():` — совместное чтение.
+    Не реентерабельна: вложенный захват в том же потоке приводит к взаимоблокировке.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        start = time.perf_counter()
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        _READ_WAIT.observe(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire(self):
+        start = time.perf_counter()
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        _WRITE_WAIT.observe(time.perf_counter() - start)
+
+    def release(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class BatchScope:
+    """Открытая пачка batch(): счетчик открытых блоков всех ее потоков и отложенные изменения."""
+
+    __slots__ = ('depth', 'ops')
+
+    def __init__(self):
+        self.depth = 0
+        self.ops = []
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Отключить сборщик циклов на время загрузки: при создании сотен тысяч записей он
+    запускается многократно и каждый раз обходит уже загруженное (циклов в данных нет).
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _empty_data():
+    return {'reminders': [], 'pending': {}, 'user_timezones': {}, 'transactions': [], 'pending_transactions': {}, 'features': {'notifications': True, 'transactions': True}, 'rollups': {}}
+
 
 class Storage:
-    def __init__(self, path: str, max_per_user: int = 10):
+    def __init__(self, path: str, max_per_user: int = 10, engine: str = 'json', compact_every: int = 1000,
+                 persist_policy: str = 'immediate', persist_interval_ms: int = 500, persist_every: int = 100,
+                 archive_dir: Optional[str] = None, retention_sent_days: float = 0,
+                 retention_transactions_days: float = 0, retention_interval_minutes: float = 60,
+                 snapshot_format: str = 'json'):
+        if engine not in ENGINES:
+            raise ValueError(f'Unknown storage engine: {engine}')
+        if persist_policy not in PERSIST_POLICIES:
+            raise ValueError(f'Unknown persist policy: {persist_policy}')
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f'Unknown snapshot format: {snapshot_format}')
         self.path = path
         self.max_per_user = max_per_user
-        self.lock = threading.Lock()
-        self._data = {'reminders': [], 'pending': {}, 'user_timezones': {}, 'transactions': [], 'pending_transactions': {}, 'features': {'notifications': True, 'transactions': True}}
-        self._load()
+        self.engine = engine
+        self.compact_every = compact_every
+        self.persist_policy = persist_policy
+        self.persist_interval = persist_interval_ms / 1000
+        self.persist_every = persist_every
+        self.snapshot_format = snapshot_format
+        self.journal_path = path + '.wal'
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Данные живут в памяти одного процесса: второй процесс с тем же файлом
+        # затирал бы чужие изменения, поэтому файл захватывается эксклюзивно
+        self._process_lock = ProcessLock(path + '.lock')
+        if not self._process_lock.try_acquire():
+            raise RuntimeError(f'Storage {path} is already in use by process {self._process_lock.owner()}; '
+                               f'use storage_engine "sqlite" to share data between processes')
+        # Хранение: отправленные напоминания старше retention_sent_days удаляются, транзакции
+        # старше retention_transactions_days переносятся в архив по месяцам (0 — не трогать)
+        self.archive = TransactionArchive(archive_dir or os.path.join(os.path.dirname(path), 'archive'))
+        self.retention_sent_days = retention_sent_days
+        self.retention_transactions_days = retention_transactions_days
+        self.retention_interval = retention_interval_minutes * 60
+        # Чтения идут параллельно (self.lock.read()), изменения — эксклюзивно (with self.lock),
+        # запись на диск — вне обеих, под self._io_lock
+        self.lock = RWLock()
+        self._data = _empty_data()
+        # номер последней записи журнала, отраженной в памяти
+        self._seq = 0
+        # записей в журнале с момента последнего снимка
+        self._journal_records = 0
+        # строки журнала, дописанные во время сворачивания (seq > снимка)
+        self._journal_tail = None
+        self._journal = None
+        self._compact_event = threading.Event()
+        self._compact_lock = threading.Lock()
+        # открытый batch() потока (BatchScope) — только его изменения ждут закрытия пачки
+        self._local = threading.local()
+        # Отложенное сохранение: число несохраненных изменений, строки журнала,
+        # еще не записанные на диск, и блокировка дисковых операций (берется до self.lock)
+        self._dirty = 0
+        self._pending_lines = []
+        self._io_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._closed = False
+        # Записи в памяти — records.Reminder/Transaction, ключи индексов — компактные id (cid).
+        # Индексы напоминаний: cid -> запись, min-heap (time, n, cid) для неотправленных,
+        # и уже наступившие, но еще не отмеченные отправленными (cid -> запись)
+        self._reminders_by_id = {}
+        self._due_heap = []
+        self._heap_seq = itertools.count()
+        self._overdue = {}
+        self._reminders_changed = threading.Event()
+        # Индексы по пользователю: активные напоминания (в порядке добавления)
+        # и транзакции, отсортированные по timestamp (для bisect-поиска по диапазону)
+        self._active_by_user = {}
+        self._tx_by_user = {}
+        # Аренды (имя -> (владелец, истекает ms)) и захваченные к доставке напоминания
+        # (id -> истекает ms). Только в памяти: файловое хранилище открыто одним процессом,
+        # а после перезапуска незавершенные доставки повторяются
+        self._leases = {}
+        self._claims = {}
+        # разрешенные часовые пояса пользователей (сбрасываются при set/clear_user_tz)
+        self._user_tz = UserTzCache()
+        with _gc_paused():
+            self._load()
+        if self.engine == 'journal':
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+            threading.Thread(target=self._compactor, daemon=True).start()
+        if self.persist_policy != 'immediate':
+            self._flusher_thread = threading.Thread(target=self._flusher, daemon=True)
+            self._flusher_thread.start()
+        if (retention_sent_days > 0 or retention_transactions_days > 0) and self.retention_interval > 0:
+            threading.Thread(target=self._retention, daemon=True).start()
 
     def _load(self):
         try:
-            with open(self.path, 'r', encoding='utf-8') as f:
-                self._data = json.load(f)
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = _decode_snapshot(mm, binary=self.snapshot_format == 'binary')
+            self._seq = int(data.pop('journal_seq', 0))
+            self._data = data
+        except FileNotFoundError:
+            self._data = _empty_data()
+        except BinarySnapshotError:
+            self._process_lock.release()
+            raise
         except Exception:
-            self._data = {'reminders': [], 'pending': {}, 'user_timezones': {}, 'transactions': [], 'pending_transactions': {}, 'features': {'notifications': True, 'transactions': True}}
+            # Не затирать данные: отложить поврежденный файл в сторону для ручного разбора
+            broken = f'{self.path}.corrupt-{int(time.time())}'
+            logger.exception('Storage file %s is unreadable, moved to %s', self.path, broken)
+            try:
+                os.replace(self.path, broken)
+            except OSError:
+                logger.exception('Failed to move corrupt storage file')
+            self._data = _empty_data()
+        if 'rollups' not in self._data:
+            self._build_rollups()
+        # индексы — до проигрывания журнала: его записи ищут напоминания снимка по id
+        self._rebuild_indexes()
+        if self.engine == 'journal':
+            self._replay_journal()
 
-    def _save(self):
-        with open(self.path, 'w', encoding='utf-8') as f:
-            json.dump(self._data, f, ensure_ascii=False, indent=2)
+    def _replay_journal(self):
+        """
+        Проиграть записи журнала поверх снимка в порядке номеров изменений (порядок их
+        применения в памяти). Оборванная последняя строка отбрасывается.
+        """
+        try:
+            f = open(self.journal_path, 'r+', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        records = []
+        with f:
+            good_offset = 0
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                try:
+                    if not line.endswith('\n'):
+                        raise ValueError('torn record')
+                    rec = json.loads(line)
+                    seq = rec.pop('s')
+                    op = rec.pop('op')
+                except Exception:
+                    logger.warning('Journal %s: torn record at offset %d, truncating', self.journal_path, good_offset)
+                    f.truncate(good_offset)
+                    break
+                good_offset = f.tell()
+                self._journal_records += 1
+                if op == 'batch':
+                    # изменения пачки несут свои номера (в журналах старых версий — номер записи)
+                    records.extend((r.pop('s', seq), r.pop('op'), r) for r in rec['ops'])
+                else:
+                    records.append((seq, op, rec))
+        records.sort(key=itemgetter(0))
+        applied = 0
+        for seq, op, rec in records:
+            if seq <= self._seq:
+                # уже отражено в снимке
+                continue
+            self._apply(op, rec)
+            self._seq = seq
+            applied += 1
+        if applied:
+            logger.info('Journal %s: replayed %d records', self.journal_path, applied)
+
+    def _build_rollups(self):
+        """Посчитать итоги по всем транзакциям (для файлов, сохраненных до появления итогов)."""
+        transactions = self._data.get('transactions', [])
+        hot_ids = {t.id for t in transactions}
+        archived_before = self._data.get('archived_before', 0)
+        cold = (t for t in self.archive.scan(archived_before) if t['id'] not in hot_ids) if archived_before else ()
+        rollups = self._data['rollups'] = {}
+        for source in (cold, transactions):
+            for t in source:
+                add_to_rollups(rollups.setdefault(str(t['user_id']), {}), t)
+
+    def _rebuild_indexes(self):
+        self._reminders_by_id = {r.cid: r for r in self._data['reminders']}
+        self._due_heap = [(r.time, next(self._heap_seq), r.cid) for r in self._data['reminders'] if not r.sent]
+        heapq.heapify(self._due_heap)
+        self._overdue = {}
+        self._active_by_user = {}
+        for r in self._data['reminders']:
+            if not r.sent:
+                self._active_by_user.setdefault(r.user_id, []).append(r)
+        self._tx_by_user = {}
+        for t in self._data.get('transactions', []):
+            self._tx_by_user.setdefault(t.user_id, []).append(t)
+        for items in self._tx_by_user.values():
+            items.sort(key=_tx_time)
+
+    def _write_snapshot(self, payload: bytes, path: Optional[str] = None):
+        """Атомарно записать снимок: временный файл, fsync, rename — оборванная запись не портит данные."""
+        path = path or self.path
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _encode_snapshot(self, fmt: str, indent: Optional[int] = None, seq: Optional[int] = None) -> bytes:
+        """Сериализовать данные (вызывать под self.lock.read()); seq — номер журнала, отраженный в снимке."""
+        doc = self._data if seq is None else dict(self._data, journal_seq=seq)
+        if fmt == 'binary':
+            doc = dict(doc, reminders=[r.astuple() for r in doc['reminders']],
+                       transactions=[t.astuple() for t in doc.get('transactions', [])])
+            return SNAPSHOT_MAGIC + pickle.dumps(doc, protocol=SNAPSHOT_PICKLE_PROTOCOL)
+        separators = None if indent else (',', ':')
+        return json.dumps(doc, ensure_ascii=False, indent=indent, separators=separators, default=record_json).encode('utf-8')
+
+    def export_json(self, path: str):
+        """Выгрузить данные в JSON-снимок (читается этим же хранилищем при любом snapshot_format)."""
+        with self.lock.read():
+            payload = self._encode_snapshot('json', indent=2, seq=self._seq)
+        self._write_snapshot(payload, path)
+
+    def _mutate(self, op: str, **rec):
+        """Применить изменение в памяти и сохранить его согласно движку (вызывать под self.lock)."""
+        self._apply(op, rec)
+        if self.engine == 'journal':
+            # номер записи журнала — в порядке применения в памяти: пачка сохраняется при
+            # закрытии, позже изменений других потоков, и при проигрывании встает на свое место
+            self._seq += 1
+            rec = dict(rec, s=self._seq)
+        scope = getattr(self._local, 'batch', None)
+        if scope is not None:
+            # внутри batch(): сохранить все изменения пачки одной записью при ее закрытии
+            scope.ops.append(dict(rec, op=op))
+            return
+        self._persist(op, rec)
+
+    def _persist(self, op: str, rec: dict):
+        """Зарегистрировать изменение для сохранения и записать его согласно политике (под self.lock)."""
+        if self.engine == 'journal':
+            line = json.dumps(dict(rec, op=op), ensure_ascii=False, separators=(',', ':')) + '\n'
+            self._pending_lines.append(line)
+            if self._journal_tail is not None:
+                self._journal_tail.append(line)
+            self._journal_records += 1
+            if self._journal_records >= self.compact_every:
+                self._compact_event.set()
+        self._dirty += 1
+        if self.persist_policy == 'count' and self._dirty >= self.persist_every:
+            self._flush_event.set()
+        # при 'immediate' запись выполняет _writing() после освобождения self.lock
+
+    @contextmanager
+    def _writing(self):
+        """Эксклюзивный доступ для изменения; при политике 'immediate' — сброс на диск после него."""
+        with self.lock:
+            yield
+        if self.persist_policy == 'immediate' and self._dirty:
+            self.flush()
+
+    def _take_dirty(self):
+        """Забрать накопленные изменения для записи (под self._io_lock и self.lock.read())."""
+        self._dirty = 0
+        if self.engine == 'journal':
+            lines, self._pending_lines = self._pending_lines, []
+            return lines
+        return self._encode_snapshot(self.snapshot_format, indent=2)
+
+    def _write_dirty(self, payload):
+        start = time.perf_counter()
+        if self.engine == 'journal':
+            size_before = os.fstat(self._journal.fileno()).st_size
+            self._journal.write(''.join(payload))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            written = os.fstat(self._journal.fileno()).st_size - size_before
+        else:
+            self._write_snapshot(payload)
+            written = os.path.getsize(self.path)
+        PERSIST_SECONDS.labels(self.engine).observe(time.perf_counter() - start)
+        PERSIST_BYTES.labels(self.engine).inc(written)
+
+    def flush(self):
+        """Сбросить накопленные изменения на диск (fsync). Вызывается фоновым потоком и при остановке."""
+        with self._io_lock:
+            # сериализация — под блокировкой чтения: писатели ждут, читатели нет
+            with self.lock.read():
+                if not self._dirty:
+                    return
+                payload = self._take_dirty()
+            # сама запись — вне self.lock, чтобы не блокировать обработку обновлений
+            try:
+                self._write_dirty(payload)
+            except BaseException:
+                # изменения остаются в памяти: их сохранит следующий полный снимок —
+                # сворачивание журнала (оно же убирает недописанные строки) или следующий сброс json
+                if self.engine == 'journal':
+                    self._compact_event.set()
+                else:
+                    with self.lock.read():
+                        self._dirty += 1
+                raise
+
+    def _flusher(self):
+        while not self._closed:
+            self._flush_event.wait(self.persist_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Storage flush failed')
+
+    def close(self):
+        """Сохранить все несохраненные изменения и остановить фоновые потоки (хук остановки)."""
+        if self._closed:
+            return
+        self._closed = True
+        self._flush_event.set()
+        # дождаться идущего сворачивания: иначе оно переписывает файлы уже после освобождения
+        # блокировки процесса, и открывший их следующим читает снимок и журнал разных поколений
+        with self._compact_lock:
+            self.flush()
+        self._process_lock.release()
+        logger.info('Storage %s flushed on shutdown', self.path)
 
-    def set_pending_text(self, user_id: int, dt):
+    @contextmanager
+    def batch(self, scope: Optional['BatchScope'] = None):
+        """
+        Сгруппировать изменения потока в одно сохранение.
+        Изменения видны в памяти сразу, а на диск попадают одной атомарной записью
+        (одна строка журнала или одна перезапись файла), когда закрывается внешний блок.
+        Пачка принадлежит открывшему ее потоку: изменения других потоков сохраняются
+        как обычно и ее не ждут. Другой поток присоединяется к пачке, передав scope,
+        который возвращает batch(); пачка сохраняется, когда закрыты все ее блоки.
+        Отката нет: при исключении уже примененные изменения тоже сохраняются.
+        Движок json сохраняет снимок целиком, поэтому запись вне пачки, сделанная
+        до ее закрытия, сохраняет и уже примененные изменения пачки.
+        """
+        previous = getattr(self._local, 'batch', None)
+        scope = scope or previous or BatchScope()
         with self.lock:
+            scope.depth += 1
+        self._local.batch = scope
+        try:
+            yield scope
+        finally:
+            self._local.batch = previous
+            with self._writing():
+                scope.depth -= 1
+                if not scope.depth and scope.ops:
+                    ops, scope.ops = scope.ops, []
+                    if len(ops) == 1:
+                        rec = ops[0]
+                        self._persist(rec.pop('op'), rec)
+                    elif self.engine == 'journal':
+                        self._persist('batch', {'ops': ops, 's': ops[-1]['s']})
+                    else:
+                        self._persist('batch', {'ops': ops})
+
+    def _apply(self, op: str, rec: dict):
+        getattr(self, '_apply_' + op)(**rec)
+
+    def _retention(self):
+        while not self._closed:
+            try:
+                self.apply_retention()
+            except Exception:
+                logger.exception('Retention pass failed')
+            time.sleep(self.retention_interval)
+
+    def apply_retention(self, now_ms: Optional[int] = None) -> tuple:
+        """
+        Удалить отправленные напоминания старше срока хранения и перенести холодные
+        транзакции в архив. Возвращает (удалено напоминаний, перенесено транзакций).
+        """
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        sent_before, archived_before = retention_cutoffs(now_ms, self.retention_sent_days, self.retention_transactions_days)
+        with self.lock.read():
+            purged = sum(1 for r in self._data['reminders'] if r.sent and r.time < sent_before)
+            cold = [t.to_dict() for t in self._data.get('transactions', []) if t.timestamp < archived_before]
+        if not purged and not cold:
+            return 0, 0
+        # Архив пишется (с fsync) до удаления из оперативных данных: сбой между шагами
+        # оставляет лишь дубли в архиве, которые отсеиваются при чтении
+        self.archive.append(cold)
+        with self._writing():
+            self._mutate('purge', sent_before=sent_before, tx_ids=[t['id'] for t in cold], archived_before=archived_before)
+        logger.info('Retention: purged %d sent reminders, archived %d transactions', purged, len(cold))
+        return purged, len(cold)
+
+    def _compactor(self):
+        while True:
+            self._compact_event.wait()
+            self._compact_event.clear()
+            try:
+                self.compact()
+            except Exception:
+                logger.exception('Journal compaction failed')
+
+    def compact(self):
+        """Свернуть журнал в снимок. Новые изменения во время записи снимка не блокируются."""
+        if self.engine != 'journal':
+            return
+        with self._compact_lock:
+            if not self._closed:
+                self._compact()
+
+    def _compact(self):
+        with self.lock.read():
+            seq = self._seq
+            payload = self._encode_snapshot(self.snapshot_format, seq=seq)
+            self._journal_tail = []
+        try:
+            self._write_snapshot(payload)
+        except Exception:
+            with self.lock:
+                self._journal_tail = None
+            raise
+        with self._io_lock, self.lock:
+            # переписать журнал, оставив только записи новее снимка
+            # (в том числе еще не сброшенные на диск — они пишутся здесь же)
+            tail = self._journal_tail
+            self._journal_tail = None
+            self._pending_lines = []
+            self._dirty = 0
+            tmp = self.journal_path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.writelines(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal.close()
+            os.replace(tmp, self.journal_path)
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+            self._journal_records = len(tail)
+        logger.info('Journal compacted at seq=%d', seq)
+
+    # Применение изменений к self._data (используется и при записи, и при проигрывании журнала)
+    def _apply_set_pending(self, user_id: int, ts: float, repeat: Optional[str] = None):
+        self._data['pending'][str(user_id)] = ts
+        if repeat:
+            self._data.setdefault('pending_repeat', {})[str(user_id)] = repeat
+        else:
+            self._data.get('pending_repeat', {}).pop(str(user_id), None)
+
+    def _apply_clear_pending(self, user_id: int):
+        self._data['pending'].pop(str(user_id), None)
+        self._data.get('pending_repeat', {}).pop(str(user_id), None)
+
+    def _apply_set_user_tz(self, user_id: int, tz_str: str):
+        self._data.setdefault('user_timezones', {})[str(user_id)] = tz_str
+        self._user_tz.invalidate(user_id)
+
+    def _apply_clear_user_tz(self, user_id: int):
+        self._data.get('user_timezones', {}).pop(str(user_id), None)
+        self._user_tz.invalidate(user_id)
+
+    def _apply_set_marker(self, marker: int):
+        self._data['long_poll_marker'] = marker
+
+    def _apply_add_reminder(self, rem: dict):
+        rem = Reminder.from_dict(rem)
+        self._data['reminders'].append(rem)
+        self._reminders_by_id[rem.cid] = rem
+        if not rem.sent:
+            self._active_by_user.setdefault(rem.user_id, []).append(rem)
+            heapq.heappush(self._due_heap, (rem.time, next(self._heap_seq), rem.cid))
+            self._reminders_changed.set()
+
+    def _apply_delete_reminder(self, rid: str):
+        # запись в куче становится устаревшей и отбрасывается при извлечении
+        cid = compact_id(rid)
+        rem = self._reminders_by_id.pop(cid, None)
+        self._overdue.pop(cid, None)
+        self._claims.pop(cid, None)
+        if rem is not None:
+            self._data['reminders'].remove(rem)
+            self._drop_active(rem)
+
+    def _apply_mark_sent(self, rid: str, next_time: Optional[int] = None):
+        cid = compact_id(rid)
+        rem = self._reminders_by_id.get(cid)
+        if rem is not None and not rem.sent:
+            if next_time is not None:
+                # повторяющееся остается активным и переводится на следующее срабатывание;
+                # прежняя запись в куче устаревает (время не совпадает)
+                if next_time != rem.time:
+                    rem.time = next_time
+                    heapq.heappush(self._due_heap, (next_time, next(self._heap_seq), cid))
+                    self._reminders_changed.set()
+            else:
+                rem.sent = True
+                self._drop_active(rem)
+        self._overdue.pop(cid, None)
+        self._claims.pop(cid, None)
+
+    def _apply_mark_sent_many(self, rids: List[str], next_times: Optional[dict] = None):
+        next_times = next_times or {}
+        for rid in rids:
+            self._apply_mark_sent(rid, next_times.get(rid))
+
+    def _drop_active(self, rem: Reminder):
+        items = self._active_by_user.get(rem.user_id)
+        if items and rem in items:
+            items.remove(rem)
+            if not items:
+                del self._active_by_user[rem.user_id]
+
+    def _apply_set_pending_transaction(self, user_id: int, amount: int):
+        self._data.setdefault('pending_transactions', {})[str(user_id)] = amount
+
+    def _apply_clear_pending_transaction(self, user_id: int):
+        self._data.get('pending_transactions', {}).pop(str(user_id), None)
+
+    def _apply_add_transaction(self, trans: dict):
+        add_to_rollups(self._data.setdefault('rollups', {}).setdefault(str(trans['user_id']), {}), trans)
+        trans = Transaction.from_dict(trans)
+        self._data.setdefault('transactions', []).append(trans)
+        bisect.insort(self._tx_by_user.setdefault(trans.user_id, []), trans, key=_tx_time)
+
+    def _apply_add_transactions(self, items: List[dict]):
+        # пачка импорта: дописать в конец и отсортировать каждый затронутый список один раз
+        # (insort на каждую запись сдвигал бы хвост списка)
+        rollups = self._data.setdefault('rollups', {})
+        transactions = self._data.setdefault('transactions', [])
+        touched = set()
+        for trans in items:
+            add_to_rollups(rollups.setdefault(str(trans['user_id']), {}), trans)
+            trans = Transaction.from_dict(trans)
+            transactions.append(trans)
+            self._tx_by_user.setdefault(trans.user_id, []).append(trans)
+            touched.add(trans.user_id)
+        for user_id in touched:
+            self._tx_by_user[user_id].sort(key=_tx_time)
+
+    def _apply_purge(self, sent_before: int, tx_ids: List[str], archived_before: int):
+        if sent_before:
+            kept = []
+            for r in self._data['reminders']:
+                if r.sent and r.time < sent_before:
+                    self._reminders_by_id.pop(r.cid, None)
+                    self._overdue.pop(r.cid, None)
+                else:
+                    kept.append(r)
+            self._data['reminders'] = kept
+        if tx_ids:
+            ids = {compact_id(tid) for tid in tx_ids}
+            users = set()
+            kept = []
+            for t in self._data.get('transactions', []):
+                if t.cid in ids:
+                    users.add(t.user_id)
+                else:
+                    kept.append(t)
+            self._data['transactions'] = kept
+            for user_id in users:
+                items = [t for t in self._tx_by_user.get(user_id, ()) if t.cid not in ids]
+                if items:
+                    self._tx_by_user[user_id] = items
+                else:
+                    self._tx_by_user.pop(user_id, None)
+        # транзакции раньше этой границы (кроме добавленных задним числом) читаются из архива
+        self._data['archived_before'] = max(self._data.get('archived_before', 0), archived_before)
+
+    def _apply_set_feature(self, name: str, enabled: bool):
+        self._data.setdefault('features', {})[name] = enabled
+        self._reminders_changed.set()
+
+    def set_pending_text(self, user_id: int, dt, repeat: Optional[str] = None):
+        with self._writing():
             # Сохранить как UTC timestamp (dt ожидается timezone-aware)
-            self._data['pending'][str(user_id)] = dt.astimezone(tz.tzutc()).timestamp()
-            self._save()
+            ts = dt.astimezone(tz.tzutc()).timestamp()
+            if repeat:
+                self._mutate('set_pending', user_id=user_id, ts=ts, repeat=repeat)
+            else:
+                self._mutate('set_pending', user_id=user_id, ts=ts)
 
     def get_pending(self, user_id: int):
-        ts = self._data['pending'].get(str(user_id))
+        with self.lock.read():
+            ts = self._data['pending'].get(str(user_id))
         if ts:
             from datetime import datetime
             # вернуть timezone-aware UTC datetime для ожидающего времени
@@ -39,108 +729,390 @@ class Storage:
         return None
 
     def clear_pending(self, user_id: int):
-        with self.lock:
+        with self._writing():
             if str(user_id) in self._data['pending']:
-                del self._data['pending'][str(user_id)]
-                self._save()
+                self._mutate('clear_pending', user_id=user_id)
 
     def set_user_tz(self, user_id: int, tz_str: str):
         """Установить строку часового пояса пользователя (IANA или UTC offset)."""
-        with self.lock:
-            self._data.setdefault('user_timezones', {})[str(user_id)] = tz_str
-            self._save()
+        with self._writing():
+            self._mutate('set_user_tz', user_id=user_id, tz_str=tz_str)
 
     def get_user_tz(self, user_id: int):
         """Получить строку часового пояса пользователя или None."""
-        return self._data.get('user_timezones', {}).get(str(user_id))
+        with self.lock.read():
+            return self._data.get('user_timezones', {}).get(str(user_id))
+
+    def get_user_tzinfo(self, user_id: int):
+        """Часовой пояс пользователя как tzinfo (None, если не задан); строка разбирается один раз."""
+        return self._user_tz.get(user_id, lambda: self.get_user_tz(user_id))
+
+    def get_user_state(self, user_id: int) -> dict:
+        """Часовой пояс и ожидаемый ввод пользователя одним чтением (для обработки обновления)."""
+        key = str(user_id)
+        with self.lock.read():
+            ts = self._data['pending'].get(key)
+            state = {
+                'tz': self._data.get('user_timezones', {}).get(key),
+                'pending_transaction': self._data.get('pending_transactions', {}).get(key),
+                'pending_repeat': self._data.get('pending_repeat', {}).get(key),
+            }
+        if ts:
+            from datetime import datetime
+            state['pending'] = datetime.fromtimestamp(ts, tz=tz.tzutc())
+        else:
+            state['pending'] = None
+        return state
 
     def clear_user_tz(self, user_id: int):
-        with self.lock:
+        with self._writing():
             if str(user_id) in self._data.get('user_timezones', {}):
-                del self._data['user_timezones'][str(user_id)]
-                self._save()
+                self._mutate('clear_user_tz', user_id=user_id)
 
-    def add_reminder(self, user_id: int, time_ms: int, text: str):
-        with self.lock:
-            user_rems = [r for r in self._data['reminders'] if r['user_id'] == user_id and not r.get('sent')]
-            if len(user_rems) >= self.max_per_user:
+    def add_reminder(self, user_id: int, time_ms: int, text: str, repeat: Optional[str] = None):
+        """Разовое напоминание или, с repeat (строка правила recurrence), повторяющееся — одна запись на правило."""
+        with self._writing():
+            if len(self._active_by_user.get(user_id, ())) >= self.max_per_user:
                 return False, f'Достигнут лимит напоминаний ({self.max_per_user})'
             rid = str(uuid.uuid4())
             rem = {'id': rid, 'user_id': user_id, 'time': time_ms, 'text': text, 'sent': False}
-            self._data['reminders'].append(rem)
-            self._save()
+            if repeat:
+                rem['repeat'] = repeat
+            self._mutate('add_reminder', rem=rem)
             return True, 'Напоминание установлено'
 
     def list_reminders(self, user_id: int):
-        with self.lock:
-            return [r for r in self._data['reminders'] if r['user_id'] == user_id and not r.get('sent')]
+        with self.lock.read():
+            return [r.to_dict() for r in self._active_by_user.get(user_id, ())]
 
     def delete_reminder_by_index(self, user_id: int, idx: int):
-        with self.lock:
-            items = [r for r in self._data['reminders'] if r['user_id'] == user_id and not r.get('sent')]
+        with self._writing():
+            items = self._active_by_user.get(user_id, ())
             if 0 <= idx < len(items):
-                rid = items[idx]['id']
-                self._data['reminders'] = [r for r in self._data['reminders'] if r['id'] != rid]
-                self._save()
+                self._mutate('delete_reminder', rid=items[idx].id)
                 return True
             return False
 
     def get_due(self, now_ms: int):
+        """Наступившие неотправленные напоминания: O(k log n) по куче вместо полного просмотра."""
         with self.lock:
-            due = [r for r in self._data['reminders'] if not r.get('sent') and r['time'] <= now_ms]
-            return due
+            return [r.to_dict() for r in self._collect_due(now_ms)]
 
-    def mark_sent(self, rid: str):
+    def _collect_due(self, now_ms: int):
+        heap = self._due_heap
+        while heap and heap[0][0] <= now_ms:
+            t, _, cid = heapq.heappop(heap)
+            rem = self._reminders_by_id.get(cid)
+            if rem is not None and not rem.sent and rem.time == t:
+                self._overdue[cid] = rem
+        return sorted(self._overdue.values(), key=_rem_time)
+
+    def claim_due(self, now_ms: int, holder: str, ttl_ms: int):
+        """
+        Атомарно захватить наступившие напоминания для доставки (claim -> send -> mark_sent).
+        Уже захваченные и не истекшие пропускаются; если доставивший не отметил их
+        отправленными за ttl_ms (упал), их заберет следующий вызов.
+        """
         with self.lock:
-            for r in self._data['reminders']:
-                if r['id'] == rid:
-                    r['sent'] = True
-            self._save()
+            claimed = []
+            for rem in self._collect_due(now_ms):
+                if self._claims.get(rem.cid, 0) > now_ms:
+                    continue
+                self._claims[rem.cid] = now_ms + ttl_ms
+                claimed.append(rem.to_dict())
+            return claimed
+
+    def acquire_lease(self, name: str, holder: str, ttl_ms: int) -> bool:
+        """Захватить или продлить аренду name; False, если ее держит другой владелец."""
+        now_ms = int(time.time() * 1000)
+        with self.lock:
+            current = self._leases.get(name)
+            if current and current[0] != holder and current[1] > now_ms:
+                return False
+            self._leases[name] = (holder, now_ms + ttl_ms)
+            return True
+
+    def release_lease(self, name: str, holder: str):
+        with self.lock:
+            if self._leases.get(name, (None,))[0] == holder:
+                del self._leases[name]
+
+    def next_due_ms(self) -> Optional[int]:
+        """Время (ms) ближайшего напоминания, еще не выданного get_due, или None."""
+        with self.lock:
+            heap = self._due_heap
+            while heap:
+                t, _, cid = heap[0]
+                rem = self._reminders_by_id.get(cid)
+                if rem is not None and not rem.sent and rem.time == t:
+                    return t
+                heapq.heappop(heap)
+            return None
+
+    def wait_for_reminders(self, timeout: Optional[float]) -> bool:
+        """Ждать добавления напоминания (или смены флагов) не дольше timeout секунд."""
+        fired = self._reminders_changed.wait(timeout)
+        self._reminders_changed.clear()
+        return fired
+
+    def mark_sent(self, rid: str):
+        with self._writing():
+            next_time = self._next_times([rid]).get(rid)
+            if next_time is not None:
+                self._mutate('mark_sent', rid=rid, next_time=next_time)
+            else:
+                self._mutate('mark_sent', rid=rid)
+
+    def mark_sent_many(self, rids: List[str]):
+        """Отметить отправленными сразу несколько напоминаний одной записью."""
+        if not rids:
+            return
+        with self._writing():
+            next_times = self._next_times(rids)
+            if next_times:
+                self._mutate('mark_sent_many', rids=list(rids), next_times=next_times)
+            else:
+                self._mutate('mark_sent_many', rids=list(rids))
+
+    def _next_times(self, rids: List[str]) -> dict:
+        """
+        Следующие срабатывания доставленных повторяющихся напоминаний (вызывать под self.lock).
+        Вычисляются здесь и пишутся в журнал готовыми: проигрывание не зависит от текущего времени.
+        Пропущенные за время простоя срабатывания не наверстываются, а повторная отметка
+        уже переведенного вперед напоминания ничего не меняет.
+        """
+        now_ms = int(time.time() * 1000)
+        next_times = {}
+        for rid in rids:
+            rem = self._reminders_by_id.get(compact_id(rid))
+            if rem is not None and rem.repeat and not rem.sent:
+                next_times[rid] = next_occurrence(rem.repeat, now_ms) if rem.time <= now_ms else rem.time
+        return next_times
 
     def set_pending_transaction_amount(self, user_id: int, amount: int):
         """Сохранить сумму (+/-) и ожидать категорию."""
-        with self.lock:
-            self._data.setdefault('pending_transactions', {})[str(user_id)] = amount
-            self._save()
+        with self._writing():
+            self._mutate('set_pending_transaction', user_id=user_id, amount=amount)
 
     def get_pending_transaction_amount(self, user_id: int):
         """Получить ожидающую сумму транзакции или None."""
-        return self._data.get('pending_transactions', {}).get(str(user_id))
+        with self.lock.read():
+            return self._data.get('pending_transactions', {}).get(str(user_id))
 
     def clear_pending_transaction(self, user_id: int):
-        with self.lock:
+        with self._writing():
             if str(user_id) in self._data.get('pending_transactions', {}):
-                del self._data['pending_transactions'][str(user_id)]
-                self._save()
+                self._mutate('clear_pending_transaction', user_id=user_id)
 
     def add_transaction(self, user_id: int, amount: int, category: str, timestamp_ms: int):
         """Добавить транзакцию в историю."""
-        with self.lock:
+        with self._writing():
             tid = str(uuid.uuid4())
             trans = {'id': tid, 'user_id': user_id, 'amount': amount, 'category': category, 'timestamp': timestamp_ms}
-            self._data.setdefault('transactions', []).append(trans)
-            self._save()
+            self._mutate('add_transaction', trans=trans)
             return True
 
+    def import_transactions(self, rows: Iterable[dict], chunk_size: int = IMPORT_CHUNK_SIZE) -> Tuple[int, int]:
+        """
+        Загрузить транзакции ({'id'?, 'user_id', 'amount', 'category', 'timestamp'}) пачками по
+        chunk_size: одно изменение и одно сохранение на пачку. Строки с id, который уже есть
+        (в оперативных данных с тем же временем или в архиве), пропускаются — повторный импорт
+        той же выгрузки ничего не добавляет. Возвращает (добавлено, пропущено).
+        """
+        archived = ArchivedIds(self.archive)
+        added = skipped = 0
+        for chunk in chunked(rows, chunk_size):
+            with self.lock.read():
+                archived_before = self._data.get('archived_before', 0)
+            # архив читается вне блокировки: он только дописывается
+            fresh = [t for t in chunk if not archived.contains(t, archived_before)]
+            with self._writing():
+                items, ids = [], set()
+                for t in fresh:
+                    if t.get('id'):
+                        if t['id'] in ids or self._has_transaction(t):
+                            continue
+                        ids.add(t['id'])
+                    items.append(dict(t, id=t.get('id') or str(uuid.uuid4())))
+                if items:
+                    self._mutate('add_transactions', items=items)
+            added += len(items)
+            skipped += len(chunk) - len(items)
+        return added, skipped
+
+    def _has_transaction(self, trans: dict) -> bool:
+        items = self._tx_by_user.get(trans['user_id'], ())
+        cid = compact_id(trans['id'])
+        lo = bisect.bisect_left(items, trans['timestamp'], key=_tx_time)
+        hi = bisect.bisect_right(items, trans['timestamp'], key=_tx_time)
+        return any(t.cid == cid for t in items[lo:hi])
+
+    def iter_transactions(self, user_id: Optional[int] = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[dict]:
+        """
+        Все транзакции пользователя или всего хранилища, включая архив, для потоковой выгрузки:
+        оперативные — по пользователям и времени, блокировка берется на chunk_size записей
+        (продолжение ищется по времени, поэтому изменения между порциями ничего не сдвигают),
+        затем архивные по месяцам. Перенос в архив во время выгрузки может повторить строку, но не потерять.
+        """
+        with self.lock.read():
+            users = [user_id] if user_id is not None else sorted(self._tx_by_user)
+        for uid in users:
+            after, seen = None, set()
+            while True:
+                with self.lock.read():
+                    items = self._tx_by_user.get(uid, ())
+                    i = 0 if after is None else bisect.bisect_left(items, after, key=_tx_time)
+                    chunk = []
+                    while i < len(items) and len(chunk) < chunk_size:
+                        t = items[i]
+                        i += 1
+                        # записи с тем же временем, что и последняя выданная, уже могли быть выданы
+                        if t.timestamp == after and t.cid in seen:
+                            continue
+                        chunk.append(t)
+                    chunk = [(t.cid, t.to_dict()) for t in chunk]
+                if not chunk:
+                    break
+                last = chunk[-1][1]['timestamp']
+                if last != after:
+                    seen = set()
+                seen.update(cid for cid, t in chunk if t['timestamp'] == last)
+                after = last
+                for _, t in chunk:
+                    yield t
+        with self.lock.read():
+            archived_before = self._data.get('archived_before', 0)
+        if archived_before:
+            yield from self.archive.stream(user_id, archived_before)
+
     def get_transactions(self, user_id: int, limit: int = 10):
         """Получить последние транзакции пользователя."""
-        with self.lock:
-            user_trans = [t for t in self._data.get('transactions', []) if t['user_id'] == user_id]
-            return sorted(user_trans, key=lambda x: x['timestamp'], reverse=True)[:limit]
+        with self.lock.read():
+            items = self._tx_by_user.get(user_id, [])
+            latest = [t.to_dict() for t in items[:-limit - 1:-1]] if limit > 0 else []
+            archived_before = self._data.get('archived_before', 0)
+        if needs_archive(latest, limit, archived_before):
+            return merge_latest(self.archive.latest(user_id, limit, archived_before), latest, limit)
+        return latest
 
     def get_transactions_in_range(self, user_id: int, start_ts_ms: int, end_ts_ms: int):
-        """Получить транзакции пользователя в диапазоне [start, end] включительно (временные метки в ms)."""
-        with self.lock:
-            user_trans = [t for t in self._data.get('transactions', []) if t['user_id'] == user_id]
-            return [t for t in user_trans if start_ts_ms <= int(t['timestamp']) <= end_ts_ms]
+        """Получить транзакции пользователя в диапазоне [start, end] включительно (временные метки в ms), по возрастанию времени."""
+        with self.lock.read():
+            items = self._tx_by_user.get(user_id, [])
+            lo = bisect.bisect_left(items, start_ts_ms, key=_tx_time)
+            hi = bisect.bisect_right(items, end_ts_ms, key=_tx_time)
+            hot = [t.to_dict() for t in items[lo:hi]]
+            archived_before = self._data.get('archived_before', 0)
+        if start_ts_ms < archived_before:
+            return merge_range(self.archive.range(user_id, start_ts_ms, end_ts_ms, archived_before), hot)
+        return hot
+
+    def get_transaction_summary(self, user_id: int, start_ts_ms: int, end_ts_ms: int) -> dict:
+        """Итоги за [start, end] по категориям: {категория: [доходы, расходы, число]} (по предагрегированным итогам)."""
+        edges, months, days = plan_range(start_ts_ms, end_ts_ms)
+        totals = {}
+        with self.lock.read():
+            rollups = self._data.get('rollups', {}).get(str(user_id))
+            if rollups:
+                for key in months:
+                    merge_totals(totals, rollups['m'].get(key, {}))
+                for key in days:
+                    merge_totals(totals, rollups['d'].get(key, {}))
+        for start, end in edges:
+            for t in self.get_transactions_in_range(user_id, start, end):
+                add_amount(totals, t['category'], t['amount'])
+        return totals
 
     # Методы для флагов функций
     def set_feature(self, name: str, enabled: bool):
         """Установить флаг функции (глобально). Примеры имен: 'notifications', 'transactions'."""
-        with self.lock:
-            self._data.setdefault('features', {})[name] = bool(enabled)
-            self._save()
+        with self._writing():
+            self._mutate('set_feature', name=name, enabled=bool(enabled))
 
     def get_feature(self, name: str) -> bool:
         """Получить значение флага функции; по умолчанию False, если отсутствует."""
-        return bool(self._data.get('features', {}).get(name, False))
+        with self.lock.read():
+            return bool(self._data.get('features', {}).get(name, False))
+
+    def get_features(self) -> dict:
+        """Все флаги функций: имя -> bool."""
+        with self.lock.read():
+            return {name: bool(enabled) for name, enabled in self._data.get('features', {}).items()}
+
+    def set_marker(self, marker: int):
+        """Запомнить marker long-polling; внутри batch() сохраняется вместе с изменениями пачки."""
+        with self._writing():
+            self._mutate('set_marker', marker=marker)
+
+    def get_marker(self) -> Optional[int]:
+        """marker последней обработанной пачки long-polling или None."""
+        with self.lock.read():
+            return self._data.get('long_poll_marker')
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    """Списки по size элементов из итератора (последний — короче)."""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _decode_snapshot(buf, binary: bool = False) -> dict:
+    """
+    Разобрать снимок (bytes или mmap); записи — в records.Reminder/Transaction.
+    Двоичный снимок разбирается только при binary=True, иначе BinarySnapshotError.
+    """
+    if buf[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC:
+        if not binary:
+            raise BinarySnapshotError(
+                'Storage file is a binary snapshot: set "snapshot_format": "binary" to load it '
+                '(python entrypoint.py export-json converts it to JSON)')
+        with memoryview(buf) as view, view[len(SNAPSHOT_MAGIC):] as body:
+            data = pickle.loads(body)
+        data['reminders'] = [Reminder(*r) for r in data.get('reminders', [])]
+        data['transactions'] = [Transaction(*t) for t in data.get('transactions', [])]
+        return data
+    data = json.loads(buf[:])
+    data['reminders'] = [Reminder.from_dict(r) for r in data.get('reminders', [])]
+    data['transactions'] = [Transaction.from_dict(t) for t in data.get('transactions', [])]
+    return data
+
+
+def open_storage(cfg: dict, retention: bool = True):
+    """
+    Создать хранилище по настройкам config.json (ключ storage_engine).
+    retention=False — без фонового прохода хранения (для разовых команд вроде импорта).
+    """
+    engine = cfg.get('storage_engine', 'json')
+    if engine == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(
+            cfg.get('sqlite_file', 'data/reminders.db'),
+            cfg['max_reminders_per_user'],
+            migrate_from=cfg['storage_file'],
+            persist_policy=cfg.get('persist_policy', 'immediate'),
+            **_retention_options(cfg, retention),
+        )
+    return Storage(
+        cfg['storage_file'],
+        cfg['max_reminders_per_user'],
+        engine=engine,
+        compact_every=cfg.get('journal_compact_every', 1000),
+        persist_policy=cfg.get('persist_policy', 'immediate'),
+        persist_interval_ms=cfg.get('persist_interval_ms', 500),
+        persist_every=cfg.get('persist_every', 100),
+        snapshot_format=cfg.get('snapshot_format', 'json'),
+        **_retention_options(cfg, retention),
+    )
+
+
+def _retention_options(cfg: dict, retention: bool = True) -> dict:
+    return {
+        'archive_dir': cfg.get('archive_dir', 'data/archive'),
+        'retention_sent_days': cfg.get('retention_sent_days', 0) if retention else 0,
+        'retention_transactions_days': cfg.get('retention_transactions_days', 0) if retention else 0,
+        'retention_interval_minutes': cfg.get('retention_interval_minutes', 60),
+    }
@@ -0,0 +1,126 @@
+"""
+Разбор часовых поясов с кэшированием. Строка пояса ('UTC+3', 'UTC-5:30', IANA) разбирается
+один раз: результат хранится в ограниченном LRU-кэше, а разрешенный пояс пользователя —
+в кэше хранилища (UserTzCache), который сбрасывают set_user_tz/clear_user_tz.
+Для поясов с постоянным смещением метки времени форматируются без astimezone на каждую строку.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, tzinfo
+from functools import lru_cache
+from typing import Callable, Optional
+
+from dateutil import tz
+
+# Различных строк поясов немного (UTC±N и десятки IANA), кэш с запасом
+TZ_CACHE_SIZE = 1024
+
+_EPOCH = datetime(1970, 1, 1)
+_UTC = tz.tzutc()
+
+
+@lru_cache(maxsize=TZ_CACHE_SIZE)
+def utc_offset_to_tz(utc_str: str):
+    """Преобразует строку UTC+N или UTC-N (или имя IANA) в объект tzinfo; None, если строка неверна."""
+    try:
+        utc_str = utc_str.strip()
+        # имена IANA регистрозависимы ('Europe/Berlin'), поэтому к верхнему регистру — только префикс
+        if utc_str.upper().startswith('UTC'):
+            offset_part = utc_str[3:] or '0'
+            if offset_part.startswith('+'):
+                offset_part = offset_part[1:]
+            if ':' in offset_part:
+                hours, minutes = offset_part.split(':')
+                total_seconds = int(hours) * 3600 + int(minutes) * 60 * (1 if int(hours) >= 0 else -1)
+            else:
+                total_seconds = int(offset_part) * 3600
+            return tz.tzoffset(None, total_seconds)
+        return tz.gettz(utc_str)
+    except Exception:
+        return None
+
+
+def tz_to_utc_offset(tz_str: str) -> str:
+    """Преобразует строку временной зоны IANA или UTC+N в формат UTC+N."""
+    # смещение IANA-пояса зависит от даты (летнее время): кэш действует в пределах часа
+    return _utc_offset_label(tz_str, int(time.time() // 3600))
+
+
+@lru_cache(maxsize=TZ_CACHE_SIZE)
+def _utc_offset_label(tz_str: str, hour: int) -> str:
+    try:
+        if tz_str.upper().startswith('UTC'):
+            return tz_str.upper()
+        tz_obj = tz.gettz(tz_str)
+        if not tz_obj:
+            return tz_str
+        offset = datetime.fromtimestamp(hour * 3600, tz=tz_obj).utcoffset().total_seconds() / 3600
+        offset_int = int(offset)
+        if offset == offset_int:
+            return f"UTC+{offset_int}" if offset_int >= 0 else f"UTC{offset_int}"
+        else:
+            minutes = int((offset - offset_int) * 60)
+            return f"UTC+{offset_int}:{minutes:02d}" if offset_int >= 0 else f"UTC{offset_int}:{minutes:02d}"
+    except Exception:
+        return tz_str
+
+
+def is_fixed(tz_obj: tzinfo) -> bool:
+    """Пояс с постоянным смещением (UTC±N): его можно вычислить один раз."""
+    return isinstance(tz_obj, (tz.tzoffset, tz.tzutc))
+
+
+def local_time_formatter(tz_obj: tzinfo) -> Callable[[int], datetime]:
+    """
+    Функция ms -> локальное время для форматирования многих меток подряд.
+    Для постоянного смещения оно вычисляется один раз (результат без tzinfo), иначе — astimezone на каждую метку.
+    """
+    if is_fixed(tz_obj):
+        offset_ms = int(tz_obj.utcoffset(None).total_seconds() * 1000)
+        return lambda ts_ms: _EPOCH + timedelta(milliseconds=ts_ms + offset_ms)
+    return lambda ts_ms: datetime.fromtimestamp(ts_ms / 1000, tz=_UTC).astimezone(tz_obj)
+
+
+class UserTzCache:
+    """
+    Разрешенные пояса пользователей: user_id -> tzinfo (None — пояс не задан).
+    Ограничен по размеру (вытесняются давно не использованные); ttl_seconds ограничивает
+    время жизни записи, если пояс могут изменить другие процессы (SQLite).
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # растет при каждом сбросе: значение, прочитанное до сброса, не попадает в кэш
+        self._version = 0
+
+    def get(self, user_id: int, load: Callable[[], Optional[str]]) -> Optional[tzinfo]:
+        """Пояс пользователя из кэша; при промахе load() возвращает строку пояса из хранилища."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(user_id, self._MISSING)
+            if item is not self._MISSING and (self.ttl is None or item[1] > now):
+                self._items.move_to_end(user_id)
+                return item[0]
+            version = self._version
+        tz_str = load()
+        tz_obj = utc_offset_to_tz(tz_str) if tz_str else None
+        with self._lock:
+            if version != self._version:
+                return tz_obj
+            self._items[user_id] = (tz_obj, now + (self.ttl or 0))
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return tz_obj
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._items.pop(user_id, None)
+            self._version += 1
@@ -1,27 +1,107 @@
 """
 FastAPI WebHook-сервер для обновлений Max Bot API.
-Принимает POST /updates от Max, проверяет секрет, обрабатывает через Bot.handle_update.
+Принимает POST /updates от Max, проверяет секрет и сразу отвечает 200,
+а обработку через Bot.handle_update выполняет пул потоков (dispatcher.UpdateDispatcher).
+
+Сервер начинает слушать порт до загрузки хранилища: bot.py импортируется и данные
+загружаются в фоновом потоке. Пока загрузка не закончена, /ready и POST /updates
+отвечают 503 (Max повторит доставку), /health — 200 (процесс жив; 503, если старт не удался).
+
+GET /ledger/export и POST /ledger/import — потоковая выгрузка и загрузка истории транзакций
+(ledger.py); доступны только с заголовком Authorization: Bearer <LEDGER_TOKEN>.
 """
 
+import hmac
+import io
 import json
 import logging
 import os
 import sys
+import tempfile
+import threading
+from contextlib import asynccontextmanager
 from typing import Optional
 
 from fastapi import FastAPI, Request, HTTPException, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
 
-# Импорт логики бота
-from bot import get_bot, cfg
+import ledger
+import metrics
+import startup
+from config import access_token, load_config
+from dedupe import update_key
+from dispatcher import UpdateDispatcher
+
+cfg = load_config()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title='Max Bot WebHook')
+_dispatcher: Optional[UpdateDispatcher] = None
+
+QUEUE_DEPTH = metrics.Gauge('maxon_webhook_queue_depth', 'Обновлений в очереди обработки',
+                            func=lambda: _dispatcher.queue_depth() if _dispatcher else 0)
+QUEUE_OLDEST_WAIT = metrics.Gauge('maxon_webhook_queue_oldest_wait_seconds', 'Ожидание самого старого обновления в очереди',
+                                  func=lambda: _dispatcher.oldest_wait_ms() / 1000 if _dispatcher else 0)
+
+
+def get_bot():
+    """Экземпляр бота; bot.py импортируется при первом обращении, а не при импорте сервера."""
+    from bot import get_bot as get_bot_instance
+    return get_bot_instance()
+
+
+def get_dispatcher() -> UpdateDispatcher:
+    """Получить или создать пул обработки обновлений."""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = UpdateDispatcher(
+            get_bot().handle_update,
+            workers=cfg.get('webhook_workers', 4),
+            queue_size=cfg.get('webhook_queue_size', 1000),
+        )
+        _dispatcher.start()
+    return _dispatcher
+
+
+def _start_up():
+    """Загрузить бота и хранилище, запустить пул обработки (в фоновом потоке при старте сервера)."""
+    try:
+        get_dispatcher()
+    except Exception as e:
+        logger.exception('WebHook startup failed')
+        startup.set_failed(repr(e))
+        return
+    startup.set_ready()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # без токена — отказ сразу; остальное загружается в фоне, пока сервер уже отвечает
+    access_token()
+    loader = threading.Thread(target=_start_up, name='startup', daemon=True)
+    loader.start()
+    yield
+    loader.join()
+    # Дообработать уже принятые обновления и сохранить данные перед остановкой
+    global _dispatcher
+    if _dispatcher is not None:
+        _dispatcher.stop()
+        _dispatcher = None
+        get_bot().storage.close()
+
+
+app = FastAPI(title='Max Bot WebHook', lifespan=lifespan)
 
 # WebHook-секрет (опционально, но рекомендуется для безопасности)
 WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET') or cfg.get('webhook_secret', '')
+# Токен для /ledger/*: без него эндпоинты выгрузки и загрузки выключены
+LEDGER_TOKEN = os.environ.get('LEDGER_TOKEN') or cfg.get('ledger_token', '')
+# Тело загрузки держится в памяти до этого размера, дальше — во временном файле
+LEDGER_SPOOL_BYTES = 8 * 1024 * 1024
+LEDGER_MEDIA_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
 
 
 @app.post('/updates')
@@ -32,7 +112,8 @@ async def webhook_updates(request: Request, x_max_bot_api_secret: Optional[str]
     POST body: Max Update JSON (такой же, как в GET /updates response.updates[i])
     Header: X-Max-Bot-Api-Secret (опционально, проверяется если WEBHOOK_SECRET установлен)
     
-    Возвращает 200 при успехе, 400/401 при ошибке валидации.
+    Возвращает 200 сразу после постановки в очередь, 400/401 при ошибке валидации,
+    503 при переполненной очереди или до окончания старта (Max повторит доставку).
     """
     try:
         # Проверить секрет, если настроен
@@ -40,7 +121,11 @@ async def webhook_updates(request: Request, x_max_bot_api_secret: Optional[str]
             if not x_max_bot_api_secret or x_max_bot_api_secret != WEBHOOK_SECRET:
                 logger.warning('Webhook secret validation failed')
                 raise HTTPException(status_code=401, detail='Invalid secret')
-        
+
+        # Хранилище еще загружается: Max повторит доставку
+        if not startup.is_ready():
+            raise HTTPException(status_code=503, detail='Starting up')
+
         # Разобрать JSON тело
         body = await request.json()
         logger.info('Received webhook update: %s', body.get('update_type'))
@@ -50,14 +135,23 @@ async def webhook_updates(request: Request, x_max_bot_api_secret: Optional[str]
             logger.warning('Invalid update structure: missing required fields')
             raise HTTPException(status_code=400, detail='Missing update_type or timestamp')
         
-        # Обработать обновление через обработчик бота
-        bot = get_bot()
-        try:
-            bot.handle_update(body)
-        except Exception:
-            logger.exception('Error handling update in bot')
-            # Все равно вернуть 200 для подтверждения получения; Max повторит при non-200
-            # (мы не хотим, чтобы Max продолжал попытки из-за внутренних ошибок)
+        # Повторная доставка уже принятого обновления: подтвердить, не обрабатывая
+        key = update_key(body)
+        seen = get_bot().seen_updates
+        # общий дедуп (SQLite) пишет в базу — вне цикла событий
+        if not (seen.add(key) if seen.store is None else await run_in_threadpool(seen.add, key)):
+            logger.info('Skipping duplicate update %s', key)
+            return {'success': True}
+
+        # Передать обновление в пул обработки и сразу подтвердить получение.
+        # Ошибки обработки логируются воркером: Max повторяет доставку при non-200,
+        # а повторять из-за внутренних ошибок мы не хотим.
+        if not get_dispatcher().submit(body):
+            # Очередь переполнена: попросить Max повторить доставку позже
+            # (и не считать обновление принятым, иначе повтор будет отброшен)
+            await run_in_threadpool(seen.discard, key)
+            logger.warning('Update queue is full, rejecting update')
+            raise HTTPException(status_code=503, detail='Update queue is full')
         
         return {'success': True}
     
@@ -68,18 +162,90 @@ async def webhook_updates(request: Request, x_max_bot_api_secret: Optional[str]
         raise HTTPException(status_code=500, detail='Internal server error')
 
 
+def _check_ledger_access(authorization: Optional[str], fmt: str):
+    if not LEDGER_TOKEN:
+        raise HTTPException(status_code=403, detail='Ledger API is disabled (set LEDGER_TOKEN)')
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.encode(), LEDGER_TOKEN.encode()):
+        logger.warning('Ledger API authorization failed')
+        raise HTTPException(status_code=401, detail='Invalid token', headers={'WWW-Authenticate': 'Bearer'})
+    if fmt not in ledger.FORMATS:
+        raise HTTPException(status_code=400, detail=f'format must be one of: {", ".join(ledger.FORMATS)}')
+    if not startup.is_ready():
+        raise HTTPException(status_code=503, detail='Starting up')
+
+
+@app.get('/ledger/export')
+async def ledger_export(format: str = 'csv', user_id: Optional[int] = None, authorization: Optional[str] = Header(None)):
+    """
+    Потоковая выгрузка транзакций (включая архив) всех пользователей или одного (user_id)
+    в CSV или JSONL; хранилище читается порциями по мере отправки ответа.
+    """
+    _check_ledger_access(authorization, format)
+    # синхронный генератор Starlette обходит в пуле потоков, не блокируя цикл событий
+    body = ledger.dump(get_bot().storage.iter_transactions(user_id), format)
+    filename = f"ledger{'-' + str(user_id) if user_id is not None else ''}.{format}"
+    return StreamingResponse(body, media_type=LEDGER_MEDIA_TYPES[format],
+                             headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.post('/ledger/import')
+async def ledger_import(request: Request, format: str = 'csv', authorization: Optional[str] = Header(None)):
+    """
+    Загрузка транзакций из тела запроса (CSV или JSONL). Тело принимается потоком во временный
+    файл, затем проверяется целиком и загружается пачками; при ошибке в строке — 400, ничего не загружено.
+    Возвращает {'added': N, 'skipped': M} (skipped — строки с уже известным id).
+    """
+    _check_ledger_access(authorization, format)
+    with tempfile.SpooledTemporaryFile(max_size=LEDGER_SPOOL_BYTES) as raw:
+        async for chunk in request.stream():
+            raw.write(chunk)
+        raw.seek(0)
+        with io.TextIOWrapper(raw, encoding='utf-8', newline='') as text:
+            try:
+                added, skipped = await run_in_threadpool(ledger.import_ledger, get_bot().storage, text, format)
+            except (ValueError, UnicodeDecodeError) as e:
+                raise HTTPException(status_code=400, detail=str(e))
+    logger.info('Ledger import: %d added, %d skipped', added, skipped)
+    return {'added': added, 'skipped': skipped}
+
+
 @app.get('/health')
 async def health_check():
-    """Эндпоинт проверки здоровья для мониторинга."""
+    """Эндпоинт проверки здоровья для мониторинга (liveness): 503, только если старт не удался."""
+    if startup.failure():
+        return JSONResponse({'status': 'failed', 'error': startup.failure()}, status_code=503)
     return {'status': 'ok'}
 
 
+@app.get('/ready')
+async def readiness():
+    """Готовность принимать обновления (readiness) и длительность этапов старта."""
+    body = {'status': 'ready' if startup.is_ready() else 'starting', 'startup': startup.phases()}
+    return JSONResponse(body, status_code=200 if startup.is_ready() else 503)
+
+
+@app.get('/stats')
+async def stats():
+    """Состояние очереди обработки (глубина, задержка, счетчики) и кэша повторов."""
+    if not startup.is_ready():
+        raise HTTPException(status_code=503, detail='Starting up')
+    return {'dispatcher': get_dispatcher().stats(), 'dedupe': get_bot().seen_updates.stats()}
+
+
+@app.get('/metrics')
+async def prometheus_metrics():
+    """Метрики в формате Prometheus (обработка обновлений, хранилище, Max API, планировщик)."""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.get('/')
 async def root():
     """Корневой эндпоинт с базовой информацией."""
     return {
         'name': 'Max Bot WebHook',
-        'endpoints': ['/updates (POST)', '/health (GET)', '/ (GET)']
+        'endpoints': ['/updates (POST)', '/health (GET)', '/ready (GET)', '/stats (GET)', '/metrics (GET)',
+                      '/ledger/export (GET)', '/ledger/import (POST)', '/ (GET)']
     }
 
 